@@ -1,25 +1,45 @@
 import os
 import re
+import json
 import time
+import hmac
+import asyncio
 import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
 from pydantic import BaseModel
-from groq import Groq
+import httpx
+from groq import AsyncGroq, DefaultAsyncHttpxClient
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from werkzeug.utils import secure_filename
 # S'assurer que pdf_indexer.py est dans le même répertoire ou PYTHONPATH
-from pdf_indexer import PDFIndexer 
+from pdf_indexer import PDFIndexer, RANKERS
 from fastapi import Query
+from metrics import registry as metrics
+from indexing_jobs import FULL, SYNC, UPLOAD, IndexingJobQueue
+from semantic_cache import SemanticResponseCache
+from text_analysis import LegalTextAnalyzer, POLARITY_TERMS
+from response_cache import LRUCache
+from shared_store import SharedLRUCache, open_store
+from conversation_store import ConversationStore
+from prompt_builder import PromptBuilder, TokenCounter, prompt_budget
+import tracing
+from tracing import span
+from profiler import SamplingProfiler
 
 # Configuration améliorée des logs
 LOG_FILE_PATH = "app.log" # Fichier de log dans le répertoire courant
 logging.basicConfig(
     filename=LOG_FILE_PATH,
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(name)s - %(module)s.%(funcName)s:%(lineno)d - %(message)s'
+    format='%(asctime)s - %(levelname)s - [%(request_id)s] %(name)s - %(module)s.%(funcName)s:%(lineno)d - %(message)s'
 )
+for handler in logging.getLogger().handlers:
+    handler.addFilter(tracing.RequestIdFilter()) # Identifiant de la requête en cours ('-' hors requête)
 logger = logging.getLogger(__name__)
 
 logger.info("Application démarrée et configuration du logging effectuée.")
@@ -30,6 +50,32 @@ load_dotenv()
 # Obtenir la clé API
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+GROQ_MAX_TOKENS = 1024 # Longueur maximale des réponses
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 6000)) # Plafond du prompt (système + historique + contexte), en tokens
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base") # Encodage tiktoken utilisé pour compter les tokens
+PDF_INDEX_WORKERS = int(os.getenv("PDF_INDEX_WORKERS", os.cpu_count() or 1))
+PDF_RANKER = os.getenv("PDF_RANKER", "tfidf") # "tfidf" ou "bm25" (voir benchmarks/compare_rankers.py)
+# Recherche hybride (lexicale + dense) si un modèle sentence-transformers est indiqué, ex.
+# "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2" ; vide: recherche lexicale seule (voir dense_index)
+DENSE_MODEL = os.getenv("DENSE_MODEL", "")
+DENSE_BATCH_SIZE = int(os.getenv("DENSE_BATCH_SIZE", 64)) # Passages encodés par lot à l'indexation
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 1000)) # Classements de recherche mémorisés (0 = désactivé)
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", 100)) # Connexions HTTP simultanées vers Groq (pool partagé)
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 4)) # Threads dédiés à la recherche dans l'index
+STORE_WORKERS = int(os.getenv("STORE_WORKERS", 4)) # Threads dédiés aux accès au stockage partagé (caches, conversations)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.8)) # Similarité (Jaccard) minimale des questions
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 500))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600)) # Secondes
+# Caches de réponses et conversations partagés entre workers uvicorn: "sqlite:<chemin>" ou "memory" (propre au processus)
+SHARED_STORE = os.getenv("SHARED_STORE", "sqlite:shared_store.sqlite3")
+INDEX_REFRESH_INTERVAL = float(os.getenv("INDEX_REFRESH_INTERVAL", 10)) # Secondes entre deux vérifications de l'index publié par les autres workers
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", 10000))
+CONVERSATION_IDLE_TIMEOUT = float(os.getenv("CONVERSATION_IDLE_TIMEOUT", 3600)) # Secondes d'inactivité avant expiration
+CONVERSATION_MAX_HISTORY_TOKENS = int(os.getenv("CONVERSATION_MAX_HISTORY_TOKENS", 2000)) # Au-delà, les anciens tours sont résumés
+CONVERSATION_SWEEP_INTERVAL = float(os.getenv("CONVERSATION_SWEEP_INTERVAL", 60)) # Secondes
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") # Jeton (en-tête X-Admin-Token) des endpoints /admin/, désactivés si absent
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles") # Résultats du profileur à la demande
 
 if not GROQ_API_KEY:
     logger.error("GROQ_API_KEY non trouvée dans le fichier .env")
@@ -48,11 +94,50 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Server-Timing"],
 )
 
+profiler = SamplingProfiler(PROFILE_DIR)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Trace par requête: identifiant (X-Request-ID) et durée des étapes (Server-Timing, log en fin de réponse)."""
+    trace, token = tracing.start_trace(request.headers.get("x-request-id"), f"{request.method} {request.url.path}")
+    counted = not request.url.path.startswith("/admin/") # Les appels d'administration ne comptent pas pour le profileur
+    try:
+        response = await call_next(request)
+    except Exception:
+        logger.info(f"Requête {trace.request_id}: {trace.summary()}, en erreur")
+        if counted:
+            profiler.request_finished()
+        raise
+    finally:
+        tracing.end_trace(token)
+    response.headers["X-Request-ID"] = trace.request_id
+    response.headers["Server-Timing"] = trace.server_timing() # Étapes terminées avant l'envoi des en-têtes
+    body = response.body_iterator
+
+    async def traced_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            # Après la fin du corps: inclut les étapes d'une réponse en streaming
+            logger.info(f"Requête {trace.request_id}: {trace.summary()}")
+            if counted:
+                profiler.request_finished()
+    response.body_iterator = traced_body()
+    return response
+
 try:
-    client = Groq(api_key=GROQ_API_KEY)
-    logger.info("Client Groq initialisé avec succès.")
+    # Client asynchrone: les appels à Groq ne bloquent pas la boucle d'événements, les connexions sont réutilisées
+    client = AsyncGroq(
+        api_key=GROQ_API_KEY,
+        http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+            max_connections=GROQ_MAX_CONNECTIONS, max_keepalive_connections=min(20, GROQ_MAX_CONNECTIONS)
+        )),
+    )
+    logger.info(f"Client Groq asynchrone initialisé avec succès ({GROQ_MAX_CONNECTIONS} connexions max).")
 except Exception as e:
     logger.exception("Erreur lors de l'initialisation du client Groq.")
     raise
@@ -60,46 +145,67 @@ except Exception as e:
 try:
     LEGAL_DOCS_FOLDER = "legal_documents"
     os.makedirs(LEGAL_DOCS_FOLDER, exist_ok=True)
-    pdf_indexer = PDFIndexer(LEGAL_DOCS_FOLDER)
-    logger.info(f"PDFIndexer initialisé pour le dossier: {LEGAL_DOCS_FOLDER}")
+    pdf_indexer = PDFIndexer(LEGAL_DOCS_FOLDER, workers=PDF_INDEX_WORKERS, ranker=PDF_RANKER,
+                             dense_model=DENSE_MODEL, dense_batch_size=DENSE_BATCH_SIZE, retrieval_cache_size=RETRIEVAL_CACHE_SIZE)
+    logger.info(f"PDFIndexer initialisé pour le dossier: {LEGAL_DOCS_FOLDER} ({PDF_INDEX_WORKERS} processus d'extraction, classement {PDF_RANKER}"
+                f"{', recherche dense ' + pdf_indexer.dense_model if pdf_indexer.dense_model else ''})")
 except Exception as e:
     logger.exception("Erreur lors de l'initialisation de PDFIndexer.")
     raise
 
-class ResponseCache:
-    def __init__(self, max_size=100):
-        self.cache = {}
-        self.max_size = max_size
-        self.access_times = {}
-        logger.info(f"Cache de réponses initialisé avec une taille maximale de {max_size}.")
-    
-    def get(self, key):
-        if key in self.cache:
-            self.access_times[key] = time.time()
-            logger.debug(f"Cache HIT pour la clé: {key}")
-            return self.cache[key]
-        logger.debug(f"Cache MISS pour la clé: {key}")
-        return None
-    
-    def set(self, key, value):
-        if len(self.cache) >= self.max_size:
-            try:
-                oldest_key = min(self.access_times.items(), key=lambda x: x[1])[0]
-                del self.cache[oldest_key]
-                del self.access_times[oldest_key]
-                logger.info(f"Cache plein. Élément le moins récent supprimé: {oldest_key}")
-            except ValueError:
-                logger.warning("Tentative de suppression d'un élément du cache alors que access_times est vide.")
-        self.cache[key] = value
-        self.access_times[key] = time.time()
-        logger.debug(f"Clé mise en cache: {key}")
-    
-    def clear(self):
-        self.cache.clear()
-        self.access_times.clear()
-        logger.info("Cache de réponses vidé.")
-
-response_cache = ResponseCache(max_size=100)
+# Recherche (CPU) hors de la boucle d'événements, avec un nombre de threads borné.
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+async def run_in_executor(executor: ThreadPoolExecutor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Copie du contexte: la trace de la requête suit l'appel dans le thread de l'exécuteur
+    return await loop.run_in_executor(executor, tracing.run_in_context(functools.partial(func, *args, **kwargs)))
+
+# Accès au stockage partagé (SQLite: lectures qui mettent à jour l'ordre LRU, écritures, attente
+# du verrou jusqu'à 10 s) hors de la boucle d'événements, dans leurs propres threads
+store_executor = ThreadPoolExecutor(max_workers=STORE_WORKERS, thread_name_prefix="store")
+
+async def run_store(func, *args, **kwargs):
+    return await run_in_executor(store_executor, func, *args, **kwargs)
+
+shared_store = open_store(SHARED_STORE)
+logger.info(f"Stockage des caches et conversations: {SHARED_STORE}")
+# L'indexation (upload, réindexation) passe par une file traitée en arrière-plan par un thread unique,
+# un seul worker à la fois grâce au verrou de fichier ; l'état des travaux est consultable depuis tous les workers
+indexing_queue = IndexingJobQueue(
+    pdf_indexer,
+    lock_path=pdf_indexer.lock_path,
+    refresh_interval=INDEX_REFRESH_INTERVAL,
+    store=shared_store,
+)
+# Premier niveau: question + derniers messages de la conversation, lié à la version de l'index
+if SHARED_STORE == "memory":
+    response_cache = LRUCache("réponses", max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL)
+else:
+    response_cache = SharedLRUCache(shared_store, "réponses", max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL)
+# Second niveau: question normalisée + passages retenus, partagé entre conversations (premiers tours uniquement)
+# Les mots vides sont gardés pour comparer les questions: "sans préavis" n'est pas "avec préavis"
+semantic_cache = SemanticResponseCache(
+    LegalTextAnalyzer(remove_stopwords=False), max_size=500, threshold=SEMANTIC_CACHE_THRESHOLD,
+    store=None if SHARED_STORE == "memory" else shared_store, guard_terms=POLARITY_TERMS,
+)
+
+# Prompt assemblé dans le budget de tokens du modèle (voir prompt_builder)
+token_counter = TokenCounter(TOKENIZER_ENCODING)
+prompt_builder = PromptBuilder(token_counter, prompt_budget(GROQ_MODEL, GROQ_MAX_TOKENS, PROMPT_TOKEN_BUDGET))
+logger.info(f"Budget du prompt: {prompt_builder.budget} tokens.")
+
+CHAT_TTFT = metrics.histogram("chat_time_to_first_token_seconds", "Délai entre la requête /chat/stream/ et le premier fragment de réponse")
+CHAT_DURATION = metrics.histogram("chat_response_seconds", "Durée totale de génération d'une réponse (/chat/ et /chat/stream/)")
+PROMPT_TOKENS = metrics.histogram(
+    "chat_prompt_tokens", "Tokens du prompt envoyé à Groq",
+    buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 16000, 32000),
+)
+RETRIEVAL_SECONDS = metrics.histogram(
+    "retrieval_seconds", "Durée de la recherche des passages juridiques (article cité ou recherche dans l'index)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+GROQ_ERRORS = metrics.counter("groq_errors_total", "Appels à Groq en échec (/chat/ et /chat/stream/)")
 
 class UserInput(BaseModel):
     message: str
@@ -149,7 +255,29 @@ Utilise les informations juridiques fournies dans le contexte pour répondre aux
     def update_last_activity(self):
         self.last_activity = time.time()
 
-conversations: Dict[str, Conversation] = {}
+    def to_dict(self) -> dict:
+        return {"messages": self.messages, "active": self.active, "last_activity": self.last_activity}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Conversation":
+        conversation = cls()
+        conversation.messages = data["messages"]
+        conversation.active = data["active"]
+        conversation.last_activity = data["last_activity"]
+        return conversation
+
+# Conversations dans le stockage partagé: n'importe quel worker peut servir n'importe quel conversation_id.
+# Nombre de sessions, durée d'inactivité et taille de l'historique sont bornés (voir conversation_store).
+conversation_store = ConversationStore(
+    shared_store,
+    max_sessions=CONVERSATION_MAX_SESSIONS,
+    idle_timeout=CONVERSATION_IDLE_TIMEOUT,
+    max_history_tokens=CONVERSATION_MAX_HISTORY_TOKENS,
+    count_tokens=token_counter,
+)
+
+def save_conversation(conversation_id: str, conversation: Conversation):
+    conversation_store.save(conversation_id, conversation.to_dict())
 
 def detect_language(text: str) -> str:
     arabic_pattern = re.compile(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]+')
@@ -157,83 +285,183 @@ def detect_language(text: str) -> str:
         return "arabic"
     return "french"
 
-def query_groq_api(conversation: Conversation, user_query: str) -> str:
+def response_cache_key(conversation: Conversation, user_query: str) -> str:
+    last_messages = conversation.messages[-3:] if len(conversation.messages) > 3 else conversation.messages
+    return f"{user_query}_{str(last_messages)}"
+
+def retrieve_passages(user_query: str):
+    """Renvoie (passages juridiques par pertinence, identifiants des passages, version de l'index)."""
+    logger.info(f"Recherche de contexte pour: {user_query[:50]}...")
+    # Question citant un article précis: accès direct à l'index des articles, sinon recherche TF-IDF
+    start_time = time.perf_counter()
+    with span("retrieval"):
+        passages, generation = pdf_indexer.retrieve_passages(user_query)
+    RETRIEVAL_SECONDS.observe(time.perf_counter() - start_time)
+    if passages:
+        logger.info(f"{len(passages)} passages juridiques trouvés (premier: {passages[0]['source']}).")
+    else:
+        logger.info("Aucun contexte juridique trouvé.")
+    return passages, [passage_id for passage in passages for passage_id in passage['ids']], generation
+
+def is_first_turn(conversation: Conversation) -> bool:
+    """Vrai si la conversation ne contient que le prompt système et la question courante."""
+    return sum(1 for message in conversation.messages if message["role"] != "system") == 1
+
+def build_messages(conversation: Conversation, user_query: str, passages: List[dict]):
+    """Renvoie (messages à envoyer à Groq, répartition des tokens).
+
+    Le dernier message utilisateur est enrichi du contexte juridique ; prompt système, historique
+    et passages sont ajustés au budget de tokens du modèle (voir prompt_builder).
+    """
+    language = detect_language(user_query)
+    logger.info(f"Langue détectée pour la requête: {language}")
+
+    system = [message for message in conversation.messages if message["role"] == "system"]
+    turns = [message for message in conversation.messages if message["role"] != "system"]
+    if not turns or turns[-1]["role"] != "user":
+        logger.warning("Aucun message utilisateur trouvé pour enrichissement.")
+        return conversation.messages.copy(), None
+    original_content = turns[-1]['content']
+
+    def render_question(legal_context: str) -> str:
+        # Le contexte n'est ajouté qu'au message envoyé, pas à l'historique
+        if legal_context:
+            if language == "arabic":
+                return f"""سؤال المستخدم: {original_content}\n\nالسياق القانوني التونسي الذي يجب مراعاته:\n{legal_context}\n\nأجب على السؤال بناءً على هذا السياق القانوني التونسي..."""
+            return f"""Question de l'utilisateur: {original_content}\n\nContexte juridique tunisien à prendre en compte:\n{legal_context}\n\nRéponds à la question en te basant sur ce contexte juridique tunisien..."""
+        if language == "arabic":
+            return f"""سؤال المستخدم: {original_content}\n\nلم يتم العثور على معلومات محددة في قاعدة البيانات القانونية..."""
+        return f"""Question de l'utilisateur: {original_content}\n\nAucune information spécifique n'a été trouvée dans la base de données juridique..."""
+
+    with span("prompt"):
+        messages_with_context, token_report = prompt_builder.build(system, turns[:-1], render_question, passages)
+    PROMPT_TOKENS.observe(token_report['total'])
+    logger.info(f"Message utilisateur enrichi en {language}. Tokens du prompt: {token_report}")
+    return messages_with_context, token_report
+
+async def query_groq_api(conversation: Conversation, user_query: str):
+    """Renvoie (réponse, répartition des tokens du prompt ou None si la réponse vient du cache)."""
     logger.info(f"Début de query_groq_api pour la requête: {user_query[:50]}...")
     try:
-        last_messages = conversation.messages[-3:] if len(conversation.messages) > 3 else conversation.messages
-        cache_key = f"{user_query}_{str(last_messages)}"
-        
-        cached_response = response_cache.get(cache_key)
+        cache_key = response_cache_key(conversation, user_query)
+        with span("response_cache"):
+            cached_response = await run_store(response_cache.get, cache_key, generation=pdf_indexer.snapshot.version)
         if cached_response:
             logger.info("Réponse trouvée dans le cache.")
-            return cached_response
-            
-        language = detect_language(user_query)
-        logger.info(f"Langue détectée pour la requête: {language}")
-        
-        logger.info(f"Recherche de contexte pour: {user_query[:50]}...")
-        legal_context = pdf_indexer.get_relevant_context(user_query)
-        if legal_context:
-            logger.info(f"Contexte juridique trouvé (premiers 100 caractères): {legal_context[:100]}...")
-        else:
-            logger.info("Aucun contexte juridique trouvé.")
-        
-        messages_with_context = conversation.messages.copy()
-        user_message_found = False
-        for i in range(len(messages_with_context) - 1, -1, -1):
-            if messages_with_context[i]["role"] == "user":
-                user_message_found = True
-                original_content = messages_with_context[i]['content']
-                if legal_context:
-                    if language == "arabic":
-                        enhanced_message = f"""سؤال المستخدم: {original_content}\n\nالسياق القانوني التونسي الذي يجب مراعاته:\n{legal_context}\n\nأجب على السؤال بناءً على هذا السياق القانوني التونسي...""" 
-                    else:
-                        enhanced_message = f"""Question de l'utilisateur: {original_content}\n\nContexte juridique tunisien à prendre en compte:\n{legal_context}\n\nRéponds à la question en te basant sur ce contexte juridique tunisien...""" 
-                    messages_with_context[i]["content"] = enhanced_message
-                    logger.info(f"Message utilisateur enrichi avec contexte juridique en {language}.")
-                else:
-                    if language == "arabic":
-                        enhanced_message = f"""سؤال المستخدم: {original_content}\n\nلم يتم العثور على معلومات محددة في قاعدة البيانات القانونية..."""
-                    else:
-                        enhanced_message = f"""Question de l'utilisateur: {original_content}\n\nAucune information spécifique n'a été trouvée dans la base de données juridique..."""
-                    messages_with_context[i]["content"] = enhanced_message
-                    logger.info(f"Message utilisateur enrichi avec instruction de réponse en {language} (aucun contexte trouvé).")
-                break
-        if not user_message_found:
-            logger.warning("Aucun message utilisateur trouvé pour enrichissement.")
+            return cached_response, None
 
+        passages, passage_ids, generation = await run_in_executor(retrieval_executor, retrieve_passages, user_query)
+        first_turn = is_first_turn(conversation)
+        language = detect_language(user_query)
+        if first_turn:
+            with span("semantic_cache"):
+                cached_response = await run_store(semantic_cache.get, user_query, passage_ids, generation, language)
+            if cached_response:
+                await run_store(response_cache.set, cache_key, cached_response, generation=generation)
+                return cached_response, None
+
+        messages_with_context, token_report = build_messages(conversation, user_query, passages)
         logger.info(f"Envoi de la requête à Groq avec le modèle {GROQ_MODEL}. Messages: {len(messages_with_context)}")
         start_time = time.time()
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=messages_with_context,
-            temperature=0.3, max_tokens=1024, top_p=1, stream=False, stop=None
-        )
+        with span("groq"):
+            completion = await client.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=messages_with_context,
+                temperature=0.3, max_tokens=GROQ_MAX_TOKENS, top_p=1, stream=False, stop=None
+            )
         end_time = time.time()
+        CHAT_DURATION.observe(end_time - start_time)
         logger.info(f"Réponse reçue de Groq en {end_time - start_time:.2f} secondes.")
         response = completion.choices[0].message.content
         logger.info(f"Réponse générée par Groq (premiers 100 chars): {response[:100]}...")
-        response_cache.set(cache_key, response)
-        return response
+        await run_store(response_cache.set, cache_key, response, generation=generation)
+        if first_turn:
+            await run_store(semantic_cache.set, user_query, passage_ids, generation, language, response)
+        return response, token_report
     except HTTPException as http_exc:
         logger.error(f"HTTPException dans query_groq_api: {http_exc.status_code} - {http_exc.detail}", exc_info=True)
         raise
     except Exception as e:
+        GROQ_ERRORS.inc()
         logger.exception("Erreur inattendue dans query_groq_api.")
         raise HTTPException(status_code=500, detail=f"Erreur interne API Groq: {str(e)}")
 
+def sse_event(data: dict, event: str = None) -> str:
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+async def stream_groq_api(conversation: Conversation, user_query: str, conversation_id: str, request_start: float):
+    """Générateur SSE: transmet les fragments de Groq dès leur arrivée, puis un événement 'done'.
+
+    La réponse complète est ajoutée à la conversation et mise en cache comme pour /chat/.
+    """
+    token_report = None
+    try:
+        cache_key = response_cache_key(conversation, user_query)
+        with span("response_cache"):
+            response = await run_store(response_cache.get, cache_key, generation=pdf_indexer.snapshot.version)
+        if not response:
+            passages, passage_ids, generation = await run_in_executor(retrieval_executor, retrieve_passages, user_query)
+            first_turn = is_first_turn(conversation)
+            language = detect_language(user_query)
+            if first_turn:
+                with span("semantic_cache"):
+                    response = await run_store(semantic_cache.get, user_query, passage_ids, generation, language)
+                if response:
+                    await run_store(response_cache.set, cache_key, response, generation=generation)
+        if response:
+            logger.info("Réponse trouvée dans le cache (streaming).")
+            CHAT_TTFT.observe(time.time() - request_start)
+            yield sse_event({"delta": response})
+        else:
+            messages_with_context, token_report = build_messages(conversation, user_query, passages)
+            logger.info(f"Envoi de la requête en streaming à Groq avec le modèle {GROQ_MODEL}. Messages: {len(messages_with_context)}")
+            start_time = time.time()
+            trace, groq_start = tracing.current_trace(), time.perf_counter()
+            with span("groq"):
+                stream = await client.chat.completions.create(
+                    model=GROQ_MODEL,
+                    messages=messages_with_context,
+                    temperature=0.3, max_tokens=GROQ_MAX_TOKENS, top_p=1, stream=True, stop=None
+                )
+                parts = []
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    if not parts:
+                        ttft = time.time() - request_start
+                        CHAT_TTFT.observe(ttft)
+                        if trace is not None:
+                            trace.add_span("groq_first_token", groq_start, time.perf_counter() - groq_start)
+                        logger.info(f"Premier fragment reçu de Groq après {ttft:.2f} secondes.")
+                    parts.append(delta)
+                    yield sse_event({"delta": delta})
+            response = "".join(parts)
+            CHAT_DURATION.observe(time.time() - start_time)
+            logger.info(f"Réponse complète reçue de Groq en {time.time() - start_time:.2f} secondes ({len(response)} caractères).")
+            if response:
+                await run_store(response_cache.set, cache_key, response, generation=generation)
+                if first_turn:
+                    await run_store(semantic_cache.set, user_query, passage_ids, generation, language, response)
+        conversation.messages.append({"role": "assistant", "content": response})
+        conversation.update_last_activity()
+        yield sse_event({"conversation_id": conversation_id, "language": detect_language(response), "tokens": token_report}, event="done")
+    except Exception as e:
+        GROQ_ERRORS.inc()
+        logger.exception("Erreur pendant la génération en streaming.")
+        yield sse_event({"detail": "Service de génération de texte indisponible."}, event="error")
+    finally:
+        # Protégée de l'annulation (client déconnecté): la conversation est enregistrée quand même
+        await asyncio.shield(run_store(save_conversation, conversation_id, conversation))
+
 def get_or_create_conversation(conversation_id: str) -> Conversation:
-    if conversation_id not in conversations:
+    data = conversation_store.get(conversation_id)
+    if data is None: # Inconnue, ou inactive depuis plus de CONVERSATION_IDLE_TIMEOUT
         logger.info(f"Création nouvelle conversation ID: {conversation_id}")
-        conversations[conversation_id] = Conversation()
-    else:
-        conversation = conversations[conversation_id]
-        if time.time() - conversation.last_activity > 3600: # 1 hour
-            logger.info(f"Conversation {conversation_id} inactive, réinitialisation.")
-            conversations[conversation_id] = Conversation() # Réinitialise
-        else:
-            logger.info(f"Conversation existante récupérée ID: {conversation_id}")
-    return conversations[conversation_id]
+        return Conversation()
+    logger.info(f"Conversation existante récupérée ID: {conversation_id}")
+    return Conversation.from_dict(data)
 
 @app.post("/chat/")
 async def chat(input: UserInput, request: Request):
@@ -242,13 +470,15 @@ async def chat(input: UserInput, request: Request):
         logger.error("Message ou conversation_id manquant dans /chat/")
         raise HTTPException(status_code=400, detail="Message et conversation_id obligatoires")
     try:
-        conversation = get_or_create_conversation(input.conversation_id)
+        with span("conversation"):
+            conversation = await run_store(get_or_create_conversation, input.conversation_id)
         if not conversation.active: # Devrait être géré par get_or_create_conversation
             raise HTTPException(status_code=400, detail="Session de chat inactive.")
         conversation.messages.append({"role": input.role, "content": input.message})
         conversation.update_last_activity()
         try:
-            response = query_groq_api(conversation, input.message)
+            response, token_report = await query_groq_api(conversation, input.message)
+            conversation.messages.append({"role": "assistant", "content": response})
         except HTTPException as http_exc:
             logger.error(f"HTTPException de query_groq_api: {http_exc.status_code}", exc_info=True)
             if http_exc.status_code == 500 and "Groq API" in str(http_exc.detail):
@@ -257,9 +487,17 @@ async def chat(input: UserInput, request: Request):
         except Exception as e:
             logger.exception("Erreur non gérée query_groq_api depuis /chat/.")
             raise HTTPException(status_code=503, detail="Service temporairement indisponible.")
-        conversation.messages.append({"role": "assistant", "content": response})
+        finally:
+            with span("conversation_save"):
+                await run_store(save_conversation, input.conversation_id, conversation)
         logger.info(f"Réponse générée pour ID: {input.conversation_id}")
-        return {"message": "Réponse générée", "response": response, "conversation_id": input.conversation_id, "language": detect_language(response)}
+        return {
+            "message": "Réponse générée",
+            "response": response,
+            "conversation_id": input.conversation_id,
+            "language": detect_language(response),
+            "tokens": token_report, # Répartition des tokens du prompt (None si réponse en cache)
+        }
     except HTTPException as http_exc:
         logger.error(f"HTTPException dans /chat/: {http_exc.status_code}", exc_info=True)
         raise
@@ -267,36 +505,142 @@ async def chat(input: UserInput, request: Request):
         logger.exception("Erreur majeure inattendue dans /chat/.")
         raise HTTPException(status_code=500, detail="Erreur interne majeure.")
 
-@app.post("/reindex/")
-async def reindex_documents_endpoint():
-    logger.info("Requête reçue sur /reindex/")
-    try:
-        pdf_indexer.index_documents() # Appel à la réindexation complète
-        logger.info("Réindexation des documents terminée avec succès via endpoint.")
-        return {"message": "Documents réindexés avec succès!"}
-    except Exception as e:
-        logger.exception("Erreur lors de la réindexation via endpoint /reindex/")
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la réindexation: {str(e)}")
+@app.post("/chat/stream/")
+async def chat_stream(input: UserInput):
+    """Variante de /chat/ en Server-Sent Events: événements `data: {"delta": ...}`, puis `event: done` (avec la répartition des tokens)."""
+    request_start = time.time()
+    logger.info(f"Requête /chat/stream/ - ID: {input.conversation_id}, Msg: {input.message[:50]}...")
+    if not input.message or not input.conversation_id:
+        logger.error("Message ou conversation_id manquant dans /chat/stream/")
+        raise HTTPException(status_code=400, detail="Message et conversation_id obligatoires")
+    with span("conversation"):
+        conversation = await run_store(get_or_create_conversation, input.conversation_id)
+    if not conversation.active:
+        raise HTTPException(status_code=400, detail="Session de chat inactive.")
+    conversation.messages.append({"role": input.role, "content": input.message})
+    conversation.update_last_activity()
+    return StreamingResponse(
+        stream_groq_api(conversation, input.message, input.conversation_id, request_start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # Pas de mise en tampon par un proxy nginx
+    )
+
+@app.get("/stats/cache/")
+async def cache_stats():
+    """Taux de succès de chaque niveau de cache de réponses, du cache de recherche et du cache d'embeddings des requêtes."""
+    return await run_store(cache_stats_by_name)
+
+@app.get("/stats/conversations/")
+async def conversation_stats():
+    """Sessions stockées, plafonds et nombre d'historiques compactés."""
+    return await run_store(conversation_store.stats)
+
+@app.get("/stats/latency/")
+async def latency_stats():
+    """Histogrammes de latence (délai avant le premier fragment, durée de génération)."""
+    return metrics.snapshot()
+
+def cache_stats_by_name():
+    caches = {"exact": response_cache.stats(), "semantic": semantic_cache.stats()}
+    if pdf_indexer.retrieval_cache is not None:
+        caches["retrieval"] = pdf_indexer.retrieval_cache.stats()
+    if pdf_indexer.encoder is not None:
+        caches["query_embeddings"] = pdf_indexer.encoder.query_cache.stats()
+    return caches
+
+def index_size():
+    snapshot = pdf_indexer.snapshot
+    return {
+        "documents": len(snapshot.documents),
+        "chunks": sum(len(shard.chunks) for shard in snapshot.shards.values()),
+        "shards": len(snapshot.shards),
+    }
+
+# Valeurs lues à chaque export /metrics (déjà tenues par les caches, l'index et le stockage des conversations)
+metrics.register_callback("cache_hits_total", "Réponses trouvées dans chaque cache", "counter",
+                          lambda: {name: stats["hits"] for name, stats in cache_stats_by_name().items()}, label="cache")
+metrics.register_callback("cache_misses_total", "Recherches sans résultat dans chaque cache", "counter",
+                          lambda: {name: stats["misses"] for name, stats in cache_stats_by_name().items()}, label="cache")
+metrics.register_callback("index_size", "Taille de l'index publié", "gauge", index_size, label="unit")
+metrics.register_callback("index_snapshot_generation", "Instantanés d'index publiés par ce processus", "gauge",
+                          lambda: pdf_indexer.snapshot.generation)
+metrics.register_callback("conversations_active", "Conversations stockées (y compris expirées pas encore nettoyées)", "gauge",
+                          lambda: conversation_store.stats()["sessions"])
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métriques au format Prometheus (propres au worker qui répond)."""
+    return PlainTextResponse(await run_store(metrics.render_prometheus), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def require_admin(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Accès administrateur refusé.")
+
+@app.post("/admin/profile")
+async def start_profile(request: Request,
+                        seconds: float = Query(30.0, gt=0, le=600, description="Durée maximale du profilage"),
+                        requests: int = Query(None, ge=1, description="Arrêt après N requêtes terminées"),
+                        interval_ms: float = Query(5.0, ge=1, le=1000, description="Intervalle d'échantillonnage")):
+    """Profile le processus (piles de tous les threads) pendant `seconds` secondes ou `requests` requêtes (réservé à l'administration)."""
+    require_admin(request)
+    if not profiler.start(seconds, requests, interval_ms / 1000):
+        raise HTTPException(status_code=409, detail="Un profilage est déjà en cours.")
+    return {"message": "Profilage démarré.", **profiler.status()}
+
+@app.get("/admin/profile")
+async def profile_status(request: Request):
+    """État du profilage en cours et résumé du dernier (fichiers .folded et .txt dans PROFILE_DIR)."""
+    require_admin(request)
+    return profiler.status()
+
+@app.post("/reindex/", status_code=202)
+async def reindex_documents_endpoint(full: bool = Query(False, description="Ré-extraire tous les PDF en ignorant le cache")):
+    """Met la réindexation en file et renvoie immédiatement l'identifiant du travail (suivi: /index/jobs/{job_id})."""
+    logger.info(f"Requête reçue sur /reindex/ (complète: {full})")
+    # full: réindexation complète sans cache ; sinon seuls les fichiers nouveaux/modifiés/supprimés sont traités
+    job = await run_store(indexing_queue.submit, FULL if full else SYNC)
+    return {"message": "Réindexation programmée.", "job_id": job.id}
+
+@app.get("/index/jobs/{job_id}")
+async def indexing_job_status(job_id: str):
+    job = await run_store(indexing_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Travail d'indexation inconnu.")
+    return job
+
+@app.get("/index/jobs/")
+async def indexing_queue_stats():
+    return indexing_queue.stats()
 
 @app.on_event("startup")
 def startup_event():
-    logger.info("Événement startup: Indexation des documents en cours...")
-    try:
-        pdf_indexer.index_documents() # Indexation complète au démarrage
-        logger.info("Événement startup: Indexation des documents terminée.")
-    except Exception as e:
-        logger.exception("Erreur lors de l'indexation au démarrage.")
+    logger.info("Événement startup: Synchronisation des documents programmée en arrière-plan...")
+    indexing_queue.start()
+    conversation_store.start(CONVERSATION_SWEEP_INTERVAL)
+    indexing_queue.submit(SYNC) # Synchronisation incrémentale au démarrage, l'index en cache sert les requêtes entre-temps
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await client.close() # Ferme les connexions du pool HTTP
+    retrieval_executor.shutdown(wait=False)
+    store_executor.shutdown(wait=False)
+    indexing_queue.stop(timeout=5)
+    conversation_store.stop(timeout=5)
 
 @app.get("/search/{query}")
-def search(query: str):
+async def search(query: str, ranker: str = Query(None, description="Classement: tfidf ou bm25 (défaut: PDF_RANKER)"),
+                 dense: bool = Query(True, description="Fusionner avec la recherche dense si DENSE_MODEL est configuré")):
     logger.info(f"Requête de recherche reçue pour: {query}")
-    return pdf_indexer.search(query)
+    if ranker and ranker not in RANKERS:
+        raise HTTPException(status_code=400, detail=f"Classement inconnu: {ranker}")
+    return await run_in_executor(retrieval_executor, pdf_indexer.search, query, ranker=ranker, dense=dense)
 
 # ... (autres endpoints comme test-groq, clear_cache, feedback, generate_document, etc. peuvent rester ici)
 @app.get("/test-groq/")
 async def test_groq():
     try:
-        completion = client.chat.completions.create(
+        completion = await client.chat.completions.create(
             model=GROQ_MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
@@ -311,7 +655,8 @@ async def test_groq():
 
 @app.post("/clear_cache/")
 async def clear_cache():
-    response_cache.clear()
+    await run_store(response_cache.clear)
+    await run_store(semantic_cache.clear)
     logger.info("Cache de réponses vidé via endpoint.")
     return {"message": "Cache vidé avec succès"}
 
@@ -428,26 +773,20 @@ async def upload_document(
             raise HTTPException(500, "Erreur lors de l'enregistrement du fichier")
 
         summary = f"Fichier {filename} enregistré avec succès."
+        job_id = None
         if file_ext == ".pdf":
-            logger.info(f"Le fichier {filename} est un PDF. Tentative d'ajout à l'index (incrémental)...")
-            try:
-                # Utilisation de la nouvelle méthode pour l'indexation incrémentale
-                if pdf_indexer.add_single_document(file_location):
-                    summary = f"Document PDF {filename} enregistré et ajouté à l'index avec succès."
-                    logger.info(f"Document {filename} ajouté/mis à jour dans l'index (incrémental).")
-                else:
-                    summary = f"Document PDF {filename} enregistré, mais n'a pas pu être ajouté à l'index (contenu vide ou erreur)."
-                    logger.warning(f"Échec de l'ajout incrémental de {filename} à l'index.")
-            except Exception as e:
-                logger.exception(f"Erreur lors de l'ajout incrémental du document {filename} à l'index.")
-                summary = f"Document {filename} enregistré, mais une erreur est survenue lors de son ajout à l'index: {str(e)}"
-        
+            # Indexation en arrière-plan: les uploads en attente sont regroupés en une seule reconstruction
+            job_id = (await run_store(indexing_queue.submit, UPLOAD, file_location)).id
+            summary = f"Document PDF {filename} enregistré. Indexation en cours (travail {job_id})."
+            logger.info(f"Document {filename} mis en file d'indexation (travail {job_id}).")
+
         file_size_mb = os.path.getsize(file_location)/(1024*1024) if os.path.exists(file_location) else 0
         return {
             "status": "success",
             "filename": filename,
             "size": f"{file_size_mb:.2f}MB",
             "summary": summary,
+            "job_id": job_id,
             "conversation_id": conversation_id,
             "language": language
         }
@@ -0,0 +1,122 @@
+"""
+Repérage des articles ("Article 12", "Art. 5 bis", "الفصل 12") dans les textes extraits et
+résolution des questions du type "article 12 du code du travail" vers le bon passage.
+"""
+import os
+import re
+import unicodedata
+
+# Numéros d'article en chiffres arabes orientaux (٠-٩) convertis en chiffres latins
+_EASTERN_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789")
+_ORDINALS = {"premier": "1", "1er": "1", "unique": "1", "الأول": "1", "الاول": "1"}
+_SUFFIXES = r"bis|ter|quater|quinquies|sexies|مكرر|ثالثا|رابعا"
+_NUMBER = r"(?P<number>[0-9٠-٩]+(?:er)?|premier|unique|الأول|الاول)(?:\s*[-–]?\s*(?P<suffix>" + _SUFFIXES + r"))?"
+
+# En-tête d'article en début de ligne, suivi d'un séparateur ("Article 12 -", "Art. 98 –", "الفصل 5 :")
+ARTICLE_HEADING = re.compile(
+    r"^[ \t]*(?:Article|ARTICLE|Art\.|الفصل|الفصــل|المادة)\s*" + _NUMBER + r"(?=\s*(?:[-–—:.)]|$|\n))",
+    re.MULTILINE,
+)
+
+# Référence à un article dans une question ("l'article 12 du code du travail", "الفصل 12 من مجلة الشغل")
+ARTICLE_REFERENCE = re.compile(
+    r"(?:\barticle|\bart\.?|الفصل|المادة)\s*" + _NUMBER
+    + r"\s+(?:du|de\s+la|de\s+l['’]|des|de|من)\s*(?P<code>[^?!.,;\n]+)",
+    re.IGNORECASE,
+)
+
+# Mots trop génériques pour distinguer un code d'un autre
+_CODE_STOPWORDS = {
+    "code", "codes", "de", "des", "du", "la", "le", "les", "l", "d", "et", "en", "sur", "pour", "au", "aux",
+    "tunisie", "tunisien", "tunisienne", "fr", "version", "pdf", "loi", "n", "مجلة", "قانون", "من", "في", "ال",
+}
+
+# Noms arabes des codes -> mots présents dans les noms de fichiers (majoritairement en français)
+_ARABIC_CODE_ALIASES = {
+    "الشغل": "travail", "الالتزامات": "obligations", "العقود": "contrats", "الجزائية": "penale",
+    "الجزائي": "penal", "التجارية": "commerce", "التجارة": "commerce", "الشركات": "societes",
+    "الاحوال": "statut", "الأحوال": "statut", "الشخصية": "personnel", "الديوانة": "douanes",
+    "الطرقات": "route", "المياه": "eaux", "الغابات": "forestier", "التحكيم": "arbitrage",
+    "الجنسية": "nationalite", "الدستور": "constitution", "المدنية": "civile", "المرافعات": "procedure",
+    "التأمين": "assurance", "الصرف": "changes", "البيئة": "environnement", "التهيئة": "urbanisme",
+    "العينية": "reels", "الطفل": "enfance", "المستهلك": "consommateur",
+}
+
+def article_key(number, suffix=None):
+    """Clé canonique d'un article: '12', '12 bis', '1' pour 'premier'."""
+    number = _ORDINALS.get(number.lower(), number).translate(_EASTERN_DIGITS)
+    if number.endswith("er"):
+        number = number[:-2]
+    number = str(int(number))
+    return f"{number} {suffix.lower()}" if suffix else number
+
+def find_article_headings(text):
+    """Renvoie [(position, clé d'article)] pour chaque en-tête d'article du texte."""
+    return [(match.start(), article_key(match.group("number"), match.group("suffix")))
+            for match in ARTICLE_HEADING.finditer(text)]
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+_FOLDED_ARABIC_CODE_ALIASES = {_fold(name): alias for name, alias in _ARABIC_CODE_ALIASES.items()}
+
+def code_tokens(text):
+    """Mots significatifs d'un nom de code, sans accents ni mots génériques (noms arabes traduits)."""
+    tokens = re.findall(r"\w+", _fold(text))
+    tokens = [_FOLDED_ARABIC_CODE_ALIASES.get(token, token) for token in tokens]
+    return {token for token in tokens if token not in _CODE_STOPWORDS and not token.isdigit() and len(token) > 2}
+
+def parse_article_reference(query):
+    """Renvoie (clé d'article, nom du code tel qu'écrit) si la question vise un article précis, sinon None."""
+    match = ARTICLE_REFERENCE.search(query)
+    if not match:
+        return None
+    return article_key(match.group("number"), match.group("suffix")), match.group("code").strip()
+
+class ArticleIndex:
+    """Index (document, article) -> passages, construit à l'indexation.
+
+    `by_document` associe à chaque fichier un dictionnaire {clé d'article: [indices de passages]};
+    `by_article` liste pour chaque clé les fichiers qui contiennent cet article, ce qui permet de
+    ne comparer le nom du code demandé qu'aux documents candidats.
+    """
+
+    def __init__(self):
+        self.by_document = {}
+        self.by_article = {}
+
+    def add(self, filename, key, chunk_indices):
+        articles = self.by_document.setdefault(filename, {})
+        if key in articles: # Première occurrence seulement (un même PDF peut reprendre plusieurs textes)
+            return
+        articles[key] = chunk_indices
+        self.by_article.setdefault(key, []).append(filename)
+
+    def lookup(self, key, code_phrase):
+        """Renvoie [(pertinence, filename, [indices de passages])] des documents dont le nom correspond le mieux."""
+        candidates = self.by_article.get(key)
+        if not candidates:
+            return []
+        wanted = code_tokens(code_phrase)
+        if not wanted:
+            return []
+        scored = []
+        for filename in candidates:
+            # Recherche par sous-chaîne: les noms de fichiers collent souvent les mots ("codedetravail")
+            folded_name = _fold(os.path.splitext(filename)[0])
+            overlap = sum(1 for token in wanted if token in folded_name)
+            if overlap:
+                scored.append((overlap, filename, self.by_document[filename][key]))
+        scored.sort(key=lambda item: -item[0])
+        return [item for item in scored if item[0] == scored[0][0]]
+
+    def to_dict(self):
+        return {'by_document': self.by_document, 'by_article': self.by_article}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls()
+        index.by_document = data.get('by_document', {})
+        index.by_article = data.get('by_article', {})
+        return index
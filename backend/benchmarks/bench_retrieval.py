@@ -0,0 +1,232 @@
+"""
+Banc d'essai hors ligne de la recherche sur le corpus legal_documents.
+
+Mesures, sur le jeu de questions fixe en français et en arabe (queries.json):
+- construction à froid de l'index (cache vide, extraction des PDF comprise) ;
+- chargement de l'index depuis le cache et synchronisation sans changement ;
+- latence (moyenne, p50, p90, p99) de search() pour chaque classement, de get_relevant_context()
+  et de retrieve_passages() ;
+- débit de search() sous concurrence (plusieurs threads) ;
+- charge sur /chat/ (application complète, client Groq remplacé par un bouchon à latence fixe).
+
+Les résultats sont écrits en JSON pour comparer deux versions:
+
+    cd backend
+    python benchmarks/bench_retrieval.py --output bench_$(git rev-parse --short HEAD).json
+    python benchmarks/bench_retrieval.py --skip-cold --chat-requests 0   # recherche seule, index en cache
+"""
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import asyncio
+import platform
+import argparse
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+from pdf_indexer import PDFIndexer, RANKERS
+
+def load_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def summarize(timings_ms):
+    if not timings_ms:
+        return None
+    return {
+        'count': len(timings_ms),
+        'mean': float(np.mean(timings_ms)),
+        'p50': float(np.percentile(timings_ms, 50)),
+        'p90': float(np.percentile(timings_ms, 90)),
+        'p99': float(np.percentile(timings_ms, 99)),
+        'max': float(np.max(timings_ms)),
+    }
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000, result
+
+def corpus_stats(indexer):
+    snapshot = indexer.snapshot
+    return {
+        'documents': len(snapshot.documents),
+        'shards': len(snapshot.shards),
+        'chunks': sum(len(shard.chunks) for shard in snapshot.shards.values()),
+        'pages': sum(doc.get('pages', 0) for doc in snapshot.documents),
+        'bytes': sum(doc.get('size', 0) for doc in snapshot.documents),
+    }
+
+def bench_cold_build(folder, workers, dense_model=None):
+    """Construction complète dans un cache temporaire vide."""
+    cache_dir = tempfile.mkdtemp(prefix="bench_index_")
+    try:
+        elapsed_ms, indexer = timed(PDFIndexer, folder, workers=workers, cache_dir=cache_dir, dense_model=dense_model, retrieval_cache_size=0)
+        return {'seconds': elapsed_ms / 1000, 'workers': workers, **corpus_stats(indexer)}
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+def bench_cache_load(folder, cache_dir, workers, dense_model=None):
+    # Sans cache de recherche: les requêtes répétées mesurent la recherche elle-même
+    load_ms, indexer = timed(PDFIndexer, folder, workers=workers, cache_dir=cache_dir, dense_model=dense_model, retrieval_cache_size=0)
+    sync_ms, _ = timed(indexer.sync_documents)
+    return indexer, {'load_seconds': load_ms / 1000, 'sync_unchanged_seconds': sync_ms / 1000}
+
+def bench_latency(indexer, queries, top_k, repeat):
+    report = {}
+    for ranker in RANKERS:
+        timings = {'all': [], 'french': [], 'arabic': []}
+        for query in queries:
+            for _ in range(repeat):
+                elapsed_ms, _ = timed(indexer.search, query['query'], top_k=top_k, ranker=ranker)
+                timings['all'].append(elapsed_ms)
+                timings.setdefault(query['language'], []).append(elapsed_ms)
+        report[f"search_{ranker}"] = {language: summarize(values) for language, values in timings.items()}
+    for name, func in (("get_relevant_context", indexer.get_relevant_context), ("retrieve_passages", indexer.retrieve_passages)):
+        timings = [timed(func, query['query'])[0] for query in queries for _ in range(repeat)]
+        report[name] = summarize(timings)
+    return report
+
+def bench_concurrency(indexer, queries, top_k, levels, requests_per_level):
+    report = {}
+    texts = [query['query'] for query in queries]
+    for threads in levels:
+        jobs = [texts[i % len(texts)] for i in range(requests_per_level)]
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            start = time.perf_counter()
+            timings = list(executor.map(lambda text: timed(indexer.search, text, top_k=top_k)[0], jobs))
+            elapsed = time.perf_counter() - start
+        report[str(threads)] = {'throughput_qps': len(jobs) / elapsed, 'latency_ms': summarize(timings)}
+    return report
+
+class StubCompletions:
+    """Remplace client.chat.completions de Groq: latence fixe, réponse constante, aucun appel réseau."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, stream=False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        message = types.SimpleNamespace(content="Réponse simulée.")
+        choice = types.SimpleNamespace(message=message, delta=message)
+        if stream:
+            async def chunks():
+                yield types.SimpleNamespace(choices=[choice])
+            return chunks()
+        return types.SimpleNamespace(choices=[choice])
+
+async def _run_chat_load(app_module, queries, requests, concurrency):
+    import httpx
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def one(i):
+            query = queries[i % len(queries)]
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/chat/", json={"message": query['query'], "conversation_id": f"bench-{i}"})
+                return (time.perf_counter() - start) * 1000, response.status_code
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+def bench_chat(queries, requests, concurrency, groq_latency):
+    """Charge sur /chat/ via l'application FastAPI en mémoire (lancer depuis backend/)."""
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ["SHARED_STORE"] = "memory" # Ne pas toucher au stockage partagé de l'application
+    import app as app_module
+    stub = StubCompletions(groq_latency)
+    app_module.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=stub))
+    app_module.response_cache.clear()
+    app_module.semantic_cache.clear()
+    results, elapsed = asyncio.run(_run_chat_load(app_module, queries, requests, concurrency))
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'stub_groq_latency_seconds': groq_latency,
+        'groq_calls': stub.calls,
+        'errors': sum(1 for _, status in results if status != 200),
+        'throughput_rps': requests / elapsed,
+        'latency_ms': summarize([elapsed_ms for elapsed_ms, _ in results]),
+        'cache': {'exact': app_module.response_cache.stats(), 'semantic': app_module.semantic_cache.stats(),
+                  'retrieval': app_module.pdf_indexer.retrieval_cache.stats() if app_module.pdf_indexer.retrieval_cache else None},
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai hors ligne de l'indexation et de la recherche.")
+    parser.add_argument("--folder", default="legal_documents")
+    parser.add_argument("--cache-dir", default="index_cache")
+    parser.add_argument("--queries", default=os.path.join(BENCHMARK_DIR, "queries.json"))
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=10, help="Répétitions de chaque requête pour la latence")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processus d'extraction")
+    parser.add_argument("--concurrency", default="1,4,8", help="Nombres de threads pour le débit de search()")
+    parser.add_argument("--concurrent-requests", type=int, default=400, help="Recherches par niveau de concurrence")
+    parser.add_argument("--dense-model", help="Modèle sentence-transformers: mesure la recherche hybride (voir dense_index)")
+    parser.add_argument("--skip-cold", action="store_true", help="Ne pas mesurer la construction à froid (lente)")
+    parser.add_argument("--chat-requests", type=int, default=200, help="Requêtes /chat/ (0 = pas de test de charge)")
+    parser.add_argument("--chat-concurrency", type=int, default=20)
+    parser.add_argument("--groq-latency", type=float, default=0.2, help="Latence simulée de Groq (secondes)")
+    parser.add_argument("--output", help="Fichier JSON où écrire les résultats")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    queries = load_queries(args.queries)
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'parameters': vars(args),
+        'n_queries': len(queries),
+    }
+
+    if not args.skip_cold:
+        print("Construction à froid...")
+        report['cold_build'] = bench_cold_build(args.folder, args.workers, args.dense_model)
+        print(f"  {report['cold_build']['seconds']:.2f} s, {report['cold_build']['documents']} documents")
+    indexer, report['cache_load'] = bench_cache_load(args.folder, args.cache_dir, args.workers, args.dense_model)
+    report['corpus'] = corpus_stats(indexer)
+    print(f"Chargement depuis le cache: {report['cache_load']['load_seconds']:.2f} s ({report['corpus']['chunks']} passages)")
+
+    report['latency_ms'] = bench_latency(indexer, queries, args.top_k, args.repeat)
+    for name, result in report['latency_ms'].items():
+        summary = result['all'] if 'all' in result else result
+        print(f"  {name:<22} p50 {summary['p50']:7.2f} ms   p99 {summary['p99']:7.2f} ms")
+
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+    report['concurrency'] = bench_concurrency(indexer, queries, args.top_k, levels, args.concurrent_requests)
+    for threads, result in report['concurrency'].items():
+        print(f"  {threads:>3} threads: {result['throughput_qps']:8.1f} recherches/s")
+
+    if args.chat_requests:
+        report['chat'] = bench_chat(queries, args.chat_requests, args.chat_concurrency, args.groq_latency)
+        chat = report['chat']
+        print(f"/chat/: {chat['throughput_rps']:.1f} req/s, p50 {chat['latency_ms']['p50']:.1f} ms, p99 {chat['latency_ms']['p99']:.1f} ms, "
+              f"{chat['groq_calls']} appels Groq, {chat['errors']} erreurs")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nRésultats écrits dans {args.output}")
+
+if __name__ == "__main__":
+    main()
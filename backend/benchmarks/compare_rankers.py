@@ -0,0 +1,106 @@
+"""
+Comparaison hors ligne des classements TF-IDF et BM25 de PDFIndexer.
+
+Utilise l'index en cache (construit au besoin) et un jeu de questions fixe (queries.json) dont
+les documents pertinents sont donnés par des fragments de noms de fichiers. Pour chaque
+classement: hit@k (au moins un passage d'un document pertinent dans le top-k), MRR@k et latence
+de search() (moyenne, p50, p95).
+
+    cd backend
+    python benchmarks/compare_rankers.py --top-k 5 --repeat 20 --output ranker_comparison.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pdf_indexer import PDFIndexer, RANKERS
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def first_relevant_rank(results, relevant):
+    """Rang (1-based) du premier passage issu d'un document pertinent, ou None."""
+    for rank, result in enumerate(results, start=1):
+        if any(fragment.lower() in result['filename'].lower() for fragment in relevant):
+            return rank
+    return None
+
+def evaluate(indexer, queries, ranker, top_k, repeat):
+    per_query = []
+    latencies = []
+    for query in queries:
+        results = indexer.search(query['query'], top_k=top_k, ranker=ranker)
+        if isinstance(results, dict):
+            raise RuntimeError(results.get('error'))
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            indexer.search(query['query'], top_k=top_k, ranker=ranker)
+            timings.append((time.perf_counter() - start) * 1000)
+        latencies.extend(timings)
+        rank = first_relevant_rank(results, query['relevant'])
+        per_query.append({
+            'id': query['id'],
+            'language': query['language'],
+            'rank': rank,
+            'top': [f"{result['filename']} p.{result['page']}" for result in results[:3]],
+            'latency_ms': float(np.mean(timings)) if timings else None,
+        })
+    ranks = [item['rank'] for item in per_query]
+    return {
+        'ranker': ranker,
+        'hit_at_k': sum(rank is not None for rank in ranks) / len(ranks),
+        'mrr_at_k': sum(1.0 / rank for rank in ranks if rank) / len(ranks),
+        'latency_ms': {
+            'mean': float(np.mean(latencies)) if latencies else None,
+            'p50': float(np.percentile(latencies, 50)) if latencies else None,
+            'p95': float(np.percentile(latencies, 95)) if latencies else None,
+        },
+        'queries': per_query,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare les classements TF-IDF et BM25 sur un jeu de questions fixe.")
+    parser.add_argument("--folder", default="legal_documents")
+    parser.add_argument("--cache-dir", default="index_cache")
+    parser.add_argument("--queries", default=os.path.join(BENCHMARK_DIR, "queries.json"))
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20, help="Répétitions de chaque requête pour la latence")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processus d'extraction si l'index doit être construit")
+    parser.add_argument("--output", help="Fichier JSON où écrire les résultats")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # Sans cache de recherche: les répétitions mesurent le classement lui-même, pas le cache
+    indexer = PDFIndexer(args.folder, workers=args.workers, cache_dir=args.cache_dir, retrieval_cache_size=0)
+    indexer.sync_documents()
+    queries = load_queries(args.queries)
+
+    report = {'top_k': args.top_k, 'n_queries': len(queries), 'rankers': {}}
+    for ranker in RANKERS:
+        report['rankers'][ranker] = evaluate(indexer, queries, ranker, args.top_k, args.repeat)
+
+    print(f"{'classement':<10} {'hit@k':>7} {'MRR@k':>7} {'moy. ms':>8} {'p95 ms':>8}")
+    for ranker, result in report['rankers'].items():
+        latency = result['latency_ms']
+        print(f"{ranker:<10} {result['hit_at_k']:>7.2f} {result['mrr_at_k']:>7.3f} {latency['mean']:>8.2f} {latency['p95']:>8.2f}")
+    print()
+    for i, query in enumerate(queries):
+        ranks = "  ".join(f"{ranker}={report['rankers'][ranker]['queries'][i]['rank'] or '-'}" for ranker in RANKERS)
+        print(f"{query['id']:<28} {ranks}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nRésultats écrits dans {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Stockage borné des conversations, au-dessus d'un SQLiteStore/MemoryStore (voir shared_store).
+
+- Une conversation inactive depuis idle_timeout secondes expire. Un thread de nettoyage supprime
+  périodiquement les conversations expirées, puis les moins récemment utilisées au-delà de
+  max_sessions : les sessions abandonnées ne s'accumulent plus.
+- L'historique est borné par un budget de tokens (max_history_tokens, hors prompt système) : les
+  tours les plus anciens sont remplacés par un résumé extractif (questions posées, début des
+  réponses), lui-même borné à summary_tokens. Le prompt envoyé à Groq reste de taille limitée.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = "conversations"
+SUMMARY_PREFIX = "Résumé des échanges précédents de cette conversation :"
+MESSAGE_OVERHEAD_TOKENS = 4 # Rôle et séparateurs ajoutés par le format de chat
+
+def estimate_tokens(text):
+    """Estimation grossière (environ 4 caractères par token), à défaut de tokenizer."""
+    return len(text) // 4 + 1
+
+def clip(text, limit):
+    """Texte sur une ligne, coupé au dernier mot avant limit caractères."""
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + "…"
+
+def is_summary(message):
+    return message["role"] == "system" and message["content"].startswith(SUMMARY_PREFIX)
+
+class ConversationStore:
+    PRUNE_EVERY = 50 # Application du plafond de sessions toutes les N sauvegardes, en plus du nettoyage périodique
+
+    def __init__(self, store, max_sessions=10000, idle_timeout=3600.0, max_history_tokens=2000,
+                 summary_tokens=400, min_recent_messages=2, count_tokens=estimate_tokens):
+        self.store = store
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_history_tokens = max_history_tokens
+        self.summary_tokens = summary_tokens
+        self.min_recent_messages = min_recent_messages # Derniers messages toujours conservés tels quels
+        self.count_tokens = count_tokens
+        self.evicted = 0
+        self.compacted = 0
+        self._saves = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get(self, conversation_id):
+        """Renvoie la conversation sérialisée ({"messages", "active", "last_activity"}) ou None si inconnue ou expirée."""
+        return self.store.get(NAMESPACE, conversation_id)
+
+    def save(self, conversation_id, data):
+        data = dict(data, messages=self.compact(data["messages"]))
+        self.store.set(NAMESPACE, conversation_id, data, ttl=self.idle_timeout)
+        with self._lock:
+            self._saves += 1
+            prune = self._saves % self.PRUNE_EVERY == 0
+        if prune:
+            self.sweep()
+        return data
+
+    def delete(self, conversation_id):
+        self.store.delete(NAMESPACE, conversation_id)
+
+    def sweep(self):
+        """Supprime les conversations expirées et les plus anciennes au-delà de max_sessions."""
+        evicted = self.store.prune(NAMESPACE, max_entries=self.max_sessions)
+        if evicted:
+            with self._lock:
+                self.evicted += evicted
+            logger.info(f"Nettoyage des conversations: {evicted} supprimées (expirées ou au-delà de {self.max_sessions}).")
+        return evicted
+
+    def _message_tokens(self, message):
+        return self.count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def compact(self, messages):
+        """Renvoie l'historique ramené au budget de tokens (prompt système, résumé, derniers tours)."""
+        system = [message for message in messages if message["role"] == "system" and not is_summary(message)]
+        summaries = [message for message in messages if is_summary(message)]
+        turns = [message for message in messages if message["role"] != "system"]
+        tokens = [self._message_tokens(message) for message in turns]
+        summary_cost = sum(self._message_tokens(message) for message in summaries)
+        if sum(tokens) + summary_cost <= self.max_history_tokens:
+            return messages
+
+        # Derniers messages conservés tant qu'ils tiennent dans le budget (résumé compris)
+        budget = self.max_history_tokens - self.summary_tokens
+        keep, used = 0, 0
+        for cost in reversed(tokens):
+            if keep >= self.min_recent_messages and used + cost > budget:
+                break
+            keep += 1
+            used += cost
+        cut = len(turns) - keep
+        if cut == 0:
+            return messages
+
+        lines = summaries[0]["content"][len(SUMMARY_PREFIX):].strip().splitlines() if summaries else []
+        for message in turns[:cut]:
+            if message["role"] == "user":
+                lines.append(f"- Question : {clip(message['content'], 200)}")
+            else:
+                lines.append(f"  Réponse : {clip(message['content'], 300)}")
+        # Le résumé garde les lignes les plus récentes qui tiennent dans son propre budget
+        while lines and self.count_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        while lines and not lines[0].startswith("- "): # Pas de réponse orpheline de sa question
+            lines.pop(0)
+        summary = [{"role": "system", "content": f"{SUMMARY_PREFIX}\n" + "\n".join(lines)}] if lines else []
+        with self._lock:
+            self.compacted += 1
+        logger.info(f"Historique compacté: {cut} messages anciens résumés, {keep} conservés.")
+        return system + summary + turns[cut:]
+
+    def start(self, interval=60.0):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="conversation-sweeper", daemon=True)
+            self._thread.start()
+            logger.info(f"Nettoyage des conversations démarré (toutes les {interval} secondes).")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Erreur pendant le nettoyage des conversations.")
+
+    def stats(self):
+        sessions, size = self.store.usage(NAMESPACE)
+        return {
+            'sessions': sessions, # Inclut les conversations expirées pas encore nettoyées
+            'bytes': size,
+            'max_sessions': self.max_sessions,
+            'idle_timeout': self.idle_timeout,
+            'max_history_tokens': self.max_history_tokens,
+            'evicted': self.evicted,
+            'compacted': self.compacted,
+        }
@@ -0,0 +1,147 @@
+"""
+Recherche dense optionnelle, combinée à la recherche lexicale (TF-IDF/BM25) des shards.
+
+Un petit modèle d'embeddings multilingue (français/arabe) tourne sur CPU via sentence-transformers.
+Les vecteurs des passages sont calculés par lots à l'indexation, mis en cache par document
+(empreinte SHA-256) puis enregistrés avec chaque génération de shard (`dense.npy`, ouvert en mmap).
+Au-delà de HNSW_MIN_VECTORS passages, un index HNSW (hnswlib) est construit et enregistré avec le
+shard ; sinon, ou sans hnswlib, la recherche est exacte (produit scalaire numpy, vecteurs normalisés).
+Les deux classements sont fusionnés par rang (Reciprocal Rank Fusion), ce qui évite de comparer
+des scores d'échelles différentes. Les embeddings des requêtes sont gardés dans un cache LRU.
+
+Dépendances facultatives (absentes: recherche lexicale seule) :
+    pip install sentence-transformers hnswlib
+"""
+import os
+import re
+import logging
+import numpy as np
+from response_cache import LRUCache
+import index_store
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2" # 384 dimensions, 50+ langues dont l'arabe
+RRF_K = 60 # Constante de la fusion par rang (valeur usuelle)
+HNSW_MIN_VECTORS = 20000 # En dessous, la recherche exacte coûte moins d'une milliseconde ou deux
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+VECTORS_FILE = "dense"
+HNSW_FILE = "dense.hnsw"
+
+def model_slug(model_name):
+    """Nom de modèle utilisable dans un nom de fichier de cache."""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+
+class DenseEncoder:
+    """Modèle d'embeddings sur CPU. Les vecteurs renvoyés sont normalisés (L2), en float32."""
+
+    def __init__(self, model_name=DEFAULT_MODEL, batch_size=64, query_cache_size=2048):
+        if SentenceTransformer is None:
+            raise ImportError("sentence-transformers n'est pas installé")
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.query_cache = LRUCache("embeddings de requêtes", max_entries=query_cache_size, max_bytes=query_cache_size * (self.dim * 4 + 512), ttl=None)
+        logger.info(f"Modèle d'embeddings '{model_name}' chargé ({self.dim} dimensions, CPU).")
+
+    def encode(self, texts):
+        """Embeddings d'une liste de textes, calculés par lots de batch_size."""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        vectors = self.model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True,
+                                    convert_to_numpy=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def encode_query(self, query):
+        key = " ".join(query.split())
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = self.encode([key])[0]
+            vector.setflags(write=False) # Partagé entre les threads de recherche
+            self.query_cache.set(key, vector)
+        return vector
+
+def load_encoder(model_name, batch_size=64):
+    """DenseEncoder, ou None (avec un avertissement) si le modèle ou la dépendance est indisponible."""
+    if not model_name:
+        return None
+    try:
+        return DenseEncoder(model_name, batch_size=batch_size)
+    except Exception as e:
+        logger.warning(f"Recherche dense désactivée, modèle '{model_name}' indisponible ({e}).")
+        return None
+
+class VectorIndex:
+    """Vecteurs des passages d'un shard (une ligne par passage) et, s'il y a lieu, leur index HNSW."""
+
+    def __init__(self, vectors, model_name, ann=None):
+        self.vectors = vectors # float32 (passages x dimensions), normalisés ; en mmap une fois chargé
+        self.model_name = model_name
+        self.ann = ann # hnswlib.Index, ou None: recherche exacte
+
+    @classmethod
+    def build(cls, vectors, model_name):
+        ann = None
+        if hnswlib is not None and len(vectors) >= HNSW_MIN_VECTORS:
+            ann = hnswlib.Index(space="ip", dim=vectors.shape[1])
+            ann.init_index(max_elements=len(vectors), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+            ann.add_items(vectors, np.arange(len(vectors)))
+            ann.set_ef(HNSW_EF_SEARCH)
+        return cls(vectors, model_name, ann)
+
+    def save(self, directory):
+        index_store.save_array(directory, VECTORS_FILE, self.vectors)
+        if self.ann is not None:
+            self.ann.save_index(os.path.join(directory, HNSW_FILE))
+        return {'model': self.model_name, 'count': len(self.vectors), 'dim': int(self.vectors.shape[1]), 'hnsw': self.ann is not None}
+
+    @classmethod
+    def load(cls, directory, meta):
+        vectors = index_store.load_array(directory, VECTORS_FILE)
+        ann = None
+        if meta.get('hnsw'):
+            if hnswlib is not None:
+                ann = hnswlib.Index(space="ip", dim=meta['dim'])
+                ann.load_index(os.path.join(directory, HNSW_FILE), max_elements=meta['count'])
+                ann.set_ef(HNSW_EF_SEARCH)
+            else:
+                logger.warning(f"hnswlib absent: recherche dense exacte sur {meta['count']} vecteurs.")
+        return cls(vectors, meta['model'], ann)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query_vector, top_k):
+        """Renvoie [(indice du passage, similarité cosinus)] pour les top_k passages les plus proches."""
+        n = len(self.vectors)
+        top_k = min(top_k, n)
+        if top_k <= 0:
+            return []
+        if self.ann is not None:
+            labels, distances = self.ann.knn_query(query_vector, k=top_k)
+            return [(int(i), float(1.0 - d)) for i, d in zip(labels[0], distances[0])]
+        scores = self.vectors @ query_vector
+        best = np.argpartition(-scores, top_k - 1)[:top_k] if top_k < n else np.arange(n)
+        best = best[np.argsort(-scores[best])]
+        return [(int(i), float(scores[i])) for i in best]
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fusionne des classements (listes de clés, meilleure en tête) en {clé: score RRF}."""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return scores
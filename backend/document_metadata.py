@@ -0,0 +1,63 @@
+"""
+Métadonnées d'un document (titre, code, langue, nombre de pages, taille), calculées une seule fois
+à l'indexation à partir des pages extraites et enregistrées avec le shard (documents.json).
+Les résultats de recherche les renvoient sans relire les textes.
+"""
+import os
+import re
+
+# Intitulé d'un texte juridique dans les premières pages ("Code du travail", "Loi n° 2018-20 du ...", "مجلة الشغل")
+_CODE_TITLES = [
+    re.compile(r"\b(?:Code|CODE)\s+(?:de\s+la\s+|de\s+l['’]|des\s+|du\s+|de\s+)[^\n,;:()\[\]]{3,80}"),
+    re.compile(r"\b(?:Loi|LOI)\s+(?:organique\s+)?n\s*°\s*[0-9]{2,4}\s*[-–]\s*[0-9]+(?:\s+du\s+[0-9]{1,2}(?:er)?\s+\w+\s+[0-9]{4})?"),
+    re.compile(r"\b(?:Décret|DÉCRET|Décret-loi)\s+(?:gouvernemental\s+)?n\s*°\s*[0-9]{2,4}\s*[-–]\s*[0-9]+"),
+    re.compile(r"مجلة\s+[^\n،,:()]{3,60}"),
+    re.compile(r"(?:قانون|أمر|مرسوم)\s+(?:أساسي\s+|حكومي\s+)?عدد\s*[0-9٠-٩]+[^\n،,:()]{0,40}"),
+]
+_ARABIC_LETTER = re.compile(r"[\u0621-\u064a\u0671-\u06d3]")
+_LATIN_LETTER = re.compile(r"[A-Za-zÀ-ÿ]")
+
+def detect_language(text):
+    """'ar', 'fr' ou 'fr+ar' selon la part de lettres arabes et latines ('' si pas de texte)."""
+    arabic = len(_ARABIC_LETTER.findall(text))
+    latin = len(_LATIN_LETTER.findall(text))
+    if not arabic and not latin:
+        return ""
+    share = arabic / (arabic + latin)
+    if share >= 0.8:
+        return "ar"
+    if share <= 0.2:
+        return "fr"
+    return "fr+ar"
+
+def document_title(pages):
+    """Première ligne significative (au moins 3 lettres) du document."""
+    for page in pages[:2]:
+        for line in page.splitlines():
+            line = " ".join(line.split())
+            if len(_ARABIC_LETTER.findall(line)) + len(_LATIN_LETTER.findall(line)) >= 3:
+                return line[:200]
+    return ""
+
+def code_name(filename, pages):
+    """Intitulé du code ou de la loi cité en tête de document, sinon dérivé du nom de fichier."""
+    head = "\n".join(pages[:2])
+    for pattern in _CODE_TITLES:
+        match = pattern.search(head)
+        if match:
+            return " ".join(match.group(0).split()).rstrip(" -–")
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return " ".join(re.split(r"[_\-\s]+", stem)).strip()
+
+def document_metadata(filename, pages, size, modified_time):
+    """Enregistrement d'un document tel que stocké dans IndexShard.documents."""
+    sample = "\n".join(pages[:5]) # Les premières pages suffisent pour la langue
+    return {
+        'filename': filename,
+        'modified_time': modified_time,
+        'pages': len(pages),
+        'size': size,
+        'title': document_title(pages),
+        'code': code_name(filename, pages),
+        'language': detect_language(sample),
+    }
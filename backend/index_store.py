@@ -0,0 +1,183 @@
+"""
+Format disque des shards de l'index, sans pickle.
+
+Chaque shard est un dossier contenant des générations immuables (`g<horodatage>-<pid>/`) et un
+fichier `CURRENT` qui désigne la génération active. Une génération regroupe des fichiers séparés :
+listes de postings (matrice CSC) et métadonnées des passages en `.npy` (ouverts en mmap), textes des passages
+concaténés dans `chunk_texts.bin` (lus à la demande par offset), vocabulaire et documents en JSON.
+Plusieurs workers uvicorn qui ouvrent le même index partagent ainsi les mêmes pages mémoire.
+"""
+import os
+import re
+import json
+import mmap
+import time
+import shutil
+import logging
+from contextlib import contextmanager
+import numpy as np
+from scipy.sparse import csc_matrix
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+
+def atomic_write(path, data, mode='w'):
+    """Écrit un fichier via un fichier temporaire + os.replace pour ne jamais laisser de fichier tronqué."""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def save_json(directory, name, data):
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+def load_json(directory, name):
+    with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_array(directory, name, array):
+    np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+def load_array(directory, name, mmap_mode='r'):
+    return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+def save_csc(directory, prefix, matrix):
+    """Enregistre une matrice au format CSC: indptr par terme, indices = lignes (listes de postings)."""
+    matrix = matrix.tocsc()
+    matrix.sort_indices()
+    save_array(directory, f"{prefix}_data", matrix.data)
+    save_array(directory, f"{prefix}_indices", matrix.indices)
+    save_array(directory, f"{prefix}_indptr", matrix.indptr)
+
+def load_csc(directory, prefix, shape):
+    """Ouvre une matrice CSC dont les tableaux restent en mmap (aucune copie en mémoire)."""
+    data = load_array(directory, f"{prefix}_data")
+    indices = load_array(directory, f"{prefix}_indices")
+    indptr = load_array(directory, f"{prefix}_indptr")
+    return csc_matrix((data, indices, indptr), shape=shape, copy=False)
+
+def _open_blob(path):
+    """Ouvre un fichier binaire en mmap lecture seule (bytes vide si le fichier est vide)."""
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class ChunkTable:
+    """Métadonnées et textes des passages d'un shard.
+
+    Les métadonnées (document, page, offset) sont des tableaux NumPy ; les textes sont stockés
+    en UTF-8 dans un seul blob et décodés à la demande. `table[i]` renvoie un dictionnaire
+    {"doc", "page", "offset", "text"} comme les passages produits par chunk_pages.
+    """
+
+    def __init__(self, doc, page, offset, starts, blob):
+        self.doc = doc
+        self.page = page
+        self.offset = offset
+        self.starts = starts # starts[i]:starts[i+1] = octets du passage i dans le blob
+        self.blob = blob
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        encoded = [chunk['text'].encode('utf-8') for chunk in chunks]
+        starts = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            np.cumsum([len(data) for data in encoded], out=starts[1:])
+        return cls(
+            np.array([chunk['doc'] for chunk in chunks], dtype=np.int32),
+            np.array([chunk['page'] for chunk in chunks], dtype=np.int32),
+            np.array([chunk['offset'] for chunk in chunks], dtype=np.int32),
+            starts,
+            b"".join(encoded),
+        )
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def text(self, i):
+        return bytes(self.blob[self.starts[i]:self.starts[i + 1]]).decode('utf-8')
+
+    def __getitem__(self, i):
+        return {'doc': int(self.doc[i]), 'page': int(self.page[i]), 'offset': int(self.offset[i]), 'text': self.text(i)}
+
+    def texts(self):
+        return (self.text(i) for i in range(len(self)))
+
+    def save(self, directory):
+        save_array(directory, "chunk_doc", self.doc)
+        save_array(directory, "chunk_page", self.page)
+        save_array(directory, "chunk_offset", self.offset)
+        save_array(directory, "chunk_starts", self.starts)
+        with open(os.path.join(directory, "chunk_texts.bin"), 'wb') as f:
+            f.write(self.blob)
+
+    @classmethod
+    def load(cls, directory):
+        return cls(
+            load_array(directory, "chunk_doc"),
+            load_array(directory, "chunk_page"),
+            load_array(directory, "chunk_offset"),
+            load_array(directory, "chunk_starts"),
+            _open_blob(os.path.join(directory, "chunk_texts.bin")),
+        )
+
+def new_generation(shard_dir):
+    """Crée un dossier de génération vide pour y écrire un shard hors ligne."""
+    os.makedirs(shard_dir, exist_ok=True)
+    generation_dir = os.path.join(shard_dir, f"g{time.time_ns()}-{os.getpid()}")
+    os.makedirs(generation_dir)
+    return generation_dir
+
+def _generation_time(name):
+    """Horodatage (ns) d'un dossier de génération "g<time_ns>-<pid>", ou None."""
+    match = re.fullmatch(r"g(\d+)-\d+", name)
+    return int(match.group(1)) if match else None
+
+def publish_generation(shard_dir, generation_dir):
+    """Rend la génération active (écriture atomique de CURRENT) puis supprime les plus anciennes.
+
+    Seules les générations créées avant celle-ci sont supprimées: une génération plus récente est
+    peut-être encore en cours d'écriture par un autre processus. Les processus qui ont encore une
+    ancienne génération ouverte en mmap continuent de la lire : sous Linux, les fichiers supprimés
+    restent accessibles tant qu'ils sont mappés.
+    """
+    atomic_write(os.path.join(shard_dir, CURRENT_FILE), os.path.basename(generation_dir))
+    published = _generation_time(os.path.basename(generation_dir))
+    for name in os.listdir(shard_dir):
+        path = os.path.join(shard_dir, name)
+        created = _generation_time(name)
+        if created is not None and created < published and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+def current_generation(shard_dir):
+    """Renvoie le dossier de la génération active du shard, ou None."""
+    try:
+        with open(os.path.join(shard_dir, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            generation_dir = os.path.join(shard_dir, f.read().strip())
+    except FileNotFoundError:
+        return None
+    return generation_dir if os.path.isdir(generation_dir) else None
+
+@contextmanager
+def process_lock(path):
+    """Verrou exclusif entre processus (flock) : un seul worker uvicorn écrit l'index à la fois.
+
+    Sans fcntl (Windows), le verrou est sans effet : un seul processus est alors supporté.
+    """
+    if fcntl is None or path is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,209 @@
+"""
+File d'attente des travaux d'indexation (uploads, réindexations), exécutés en arrière-plan.
+
+Un thread unique traite les travaux : deux reconstructions ne s'exécutent jamais en même temps.
+Les travaux en attente sont regroupés en un seul lot : plusieurs uploads arrivés pendant une
+reconstruction ne donnent qu'un appel à PDFIndexer.add_documents (chaque shard concerné est
+reconstruit une fois), et une réindexation demandée englobe les uploads en attente. Les requêtes
+continuent d'être servies par les shards existants jusqu'à ce que les nouveaux les remplacent.
+
+Avec plusieurs workers uvicorn, chaque worker a sa file : un verrou de fichier (lock_path) évite
+que deux workers reconstruisent l'index en même temps, et chaque worker recharge périodiquement
+(refresh_interval) les shards publiés par les autres. L'état des travaux est recopié dans le
+stockage partagé (store) : le suivi d'un travail peut être demandé à n'importe quel worker.
+"""
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+from index_store import process_lock
+from metrics import INDEXING_BUCKETS, registry as metrics
+
+logger = logging.getLogger(__name__)
+
+# Types de travaux, du plus faible au plus englobant
+UPLOAD = "upload"
+SYNC = "sync"
+FULL = "full"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+JOBS_NAMESPACE = "indexing_jobs"
+JOB_TTL = 24 * 3600.0 # Secondes pendant lesquelles l'état d'un travail reste consultable dans le stockage partagé
+
+INDEX_BATCH_SECONDS = metrics.histogram("index_batch_seconds", "Durée d'un lot de travaux d'indexation (synchronisation, réindexation, uploads)", INDEXING_BUCKETS)
+
+class IndexingJob:
+    def __init__(self, kind, path=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.path = path # Fichier concerné (uploads uniquement)
+        self.status = QUEUED
+        self.batch_size = None # Nombre de travaux traités dans le même lot
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'batch_size': self.batch_size,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+class IndexingJobQueue:
+    def __init__(self, indexer, coalesce_delay=0.5, max_history=500, lock_path=None, refresh_interval=None, store=None):
+        self.indexer = indexer
+        self.store = store                       # SQLiteStore/MemoryStore partagé entre workers (None = suivi local)
+        self.lock_path = lock_path               # Verrou entre processus pendant l'indexation (None = aucun)
+        self.refresh_interval = refresh_interval # Secondes entre deux PDFIndexer.refresh() (None = jamais)
+        self.coalesce_delay = coalesce_delay # Attente après le premier travail pour regrouper les suivants
+        self.max_history = max_history       # Travaux terminés conservés pour l'endpoint de suivi
+        self.jobs = OrderedDict()            # {job_id: IndexingJob}
+        self.pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="indexing-jobs", daemon=True)
+            self._thread.start()
+            logger.info("File d'indexation démarrée.")
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, kind, path=None):
+        job = IndexingJob(kind, path)
+        with self._condition:
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            self._trim_history()
+            self._condition.notify()
+        self._share([job])
+        logger.info(f"Travail d'indexation {job.id} ({kind}) mis en file. {len(self.pending)} en attente.")
+        return job
+
+    def get(self, job_id):
+        """État du travail, qu'il ait été soumis à ce worker ou à un autre (stockage partagé), ou None."""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        if self.store is None:
+            return None
+        return self.store.get(JOBS_NAMESPACE, job_id, touch=False)
+
+    def _share(self, jobs, prune=False):
+        """Recopie l'état des travaux dans le stockage partagé."""
+        if self.store is None:
+            return
+        try:
+            for job in jobs:
+                self.store.set(JOBS_NAMESPACE, job.id, job.to_dict(), ttl=JOB_TTL)
+            if prune:
+                self.store.prune(JOBS_NAMESPACE, max_entries=self.max_history)
+        except Exception:
+            logger.exception("Échec de l'enregistrement de l'état des travaux d'indexation dans le stockage partagé.")
+
+    def stats(self):
+        with self._condition:
+            by_status = {}
+            for job in self.jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            return {'pending': len(self.pending), 'jobs': by_status}
+
+    def _trim_history(self):
+        while len(self.jobs) > self.max_history:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if oldest.status in (QUEUED, RUNNING):
+                break
+            del self.jobs[oldest_id]
+
+    def _next_batch(self):
+        with self._condition:
+            while not self.pending and not self._stopping:
+                if not self._condition.wait(self.refresh_interval) and not self.pending:
+                    return None # Aucun travail: le moment de vérifier l'index publié par les autres workers
+            if self._stopping:
+                return []
+        time.sleep(self.coalesce_delay)
+        with self._condition:
+            batch, self.pending = self.pending, []
+            now = time.time()
+            for job in batch:
+                job.status, job.started_at, job.batch_size = RUNNING, now, len(batch)
+        self._share(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                self._refresh()
+                continue
+            if not batch:
+                return
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.exception(f"Échec du lot d'indexation ({len(batch)} travaux).")
+                self._finish(batch, FAILED, error=str(e))
+
+    def _refresh(self):
+        try:
+            self.indexer.refresh()
+        except Exception:
+            logger.exception("Échec du rechargement de l'index publié par un autre processus.")
+
+    def _process(self, batch):
+        with process_lock(self.lock_path):
+            # Un autre worker a pu mettre l'index à jour pendant l'attente du verrou
+            self.indexer.refresh()
+            self._process_locked(batch)
+
+    def _process_locked(self, batch):
+        kinds = {job.kind for job in batch}
+        start_time = time.time()
+        if FULL in kinds:
+            # La réindexation complète reprend tous les fichiers du dossier, uploads compris
+            self.indexer.index_documents()
+            self._finish(batch, SUCCEEDED, result={'indexed': True})
+        elif SYNC in kinds:
+            self.indexer.sync_documents()
+            self._finish(batch, SUCCEEDED, result={'indexed': True})
+        else:
+            results = self.indexer.add_documents([job.path for job in batch])
+            for job in batch:
+                if results.get(job.path):
+                    self._finish([job], SUCCEEDED, result={'indexed': True})
+                else:
+                    self._finish([job], FAILED, result={'indexed': False}, error="Aucun contenu extrait du document.")
+        INDEX_BATCH_SECONDS.observe(time.time() - start_time)
+        logger.info(f"Lot d'indexation de {len(batch)} travaux ({', '.join(sorted(kinds))}) terminé en {time.time() - start_time:.2f} secondes.")
+
+    def _finish(self, jobs, status, result=None, error=None):
+        with self._condition:
+            now = time.time()
+            for job in jobs:
+                job.status, job.result, job.error, job.finished_at = status, result, error, now
+        self._share(jobs, prune=True)
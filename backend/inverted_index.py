@@ -0,0 +1,122 @@
+"""
+Recherche top-k par listes de postings, sans produit scalaire dense sur toutes les lignes.
+
+Une matrice de poids passages x termes au format CSC fournit directement les postings : pour
+le terme t, `indices[indptr[t]:indptr[t+1]]` sont les passages qui le contiennent et `data` leurs
+poids. Seules les colonnes des termes de la requête sont parcourues ; les scores sont accumulés
+sur les passages rencontrés uniquement, puis le top-k est sélectionné par argpartition.
+"""
+import numpy as np
+
+class InvertedIndex:
+    """Listes de postings d'un shard et borne supérieure du poids de chaque terme.
+
+    `term_max[t]` (poids maximal du terme t sur tous les passages) permet un élagage de type
+    MaxScore : dès que le k-ième meilleur score dépasse la somme des bornes des termes restant
+    à traiter, aucun passage encore absent de l'accumulateur ne peut entrer dans le top-k, et les
+    termes restants ne sont plus appliqués qu'aux candidats déjà vus. Le classement obtenu est
+    identique à celui du parcours complet.
+    """
+
+    def __init__(self, matrix, term_max=None):
+        matrix = matrix.tocsc()
+        self.indptr = matrix.indptr
+        self.rows = matrix.indices
+        self.weights = matrix.data
+        self.n_rows = matrix.shape[0]
+        self.term_max = term_max if term_max is not None else compute_term_max(matrix)
+
+    def _postings(self, term):
+        start, end = self.indptr[term], self.indptr[term + 1]
+        return self.rows[start:end], self.weights[start:end]
+
+    def search(self, terms, query_weights, top_k, min_score=0.0, early_termination=True):
+        """Renvoie [(ligne, score)] des top_k meilleurs passages, score décroissant.
+
+        `terms`/`query_weights` sont les colonnes non nulles du vecteur de requête. Le score d'un
+        passage est la somme des query_weight * poids sur les termes communs (produit scalaire).
+        Les scores <= min_score sont écartés après la sélection du top-k.
+        """
+        terms = np.asarray(terms, dtype=np.int64)
+        query_weights = np.asarray(query_weights, dtype=np.float64)
+        if top_k <= 0 or terms.size == 0 or self.n_rows == 0:
+            return []
+
+        upper_bounds = query_weights * self.term_max[terms]
+        order = np.argsort(-upper_bounds, kind='stable')
+        terms, query_weights, upper_bounds = terms[order], query_weights[order], upper_bounds[order]
+        # remaining[i] = score maximal encore atteignable via les termes i, i+1, ...
+        remaining = np.append(np.cumsum(upper_bounds[::-1])[::-1], 0.0)
+
+        acc_rows = np.empty(0, dtype=np.int64)    # Passages rencontrés, triés
+        acc_scores = np.empty(0, dtype=np.float64)
+        candidates_only = False
+        for i, (term, query_weight) in enumerate(zip(terms, query_weights)):
+            rows, weights = self._postings(term)
+            if rows.size == 0:
+                continue
+            contributions = weights * query_weight
+            if candidates_only:
+                # Les nouveaux passages ne peuvent plus atteindre le top-k: seuls les candidats sont mis à jour
+                positions = np.searchsorted(acc_rows, rows)
+                positions[positions == acc_rows.size] = 0
+                seen = acc_rows[positions] == rows if acc_rows.size else np.zeros(rows.size, dtype=bool)
+                np.add.at(acc_scores, positions[seen], contributions[seen])
+            else:
+                merged_rows = np.concatenate((acc_rows, rows))
+                merged_scores = np.concatenate((acc_scores, contributions))
+                acc_rows, inverse = np.unique(merged_rows, return_inverse=True)
+                acc_scores = np.bincount(inverse, weights=merged_scores, minlength=acc_rows.size)
+
+            if early_termination and not candidates_only and acc_rows.size >= top_k and i + 1 < terms.size:
+                threshold = np.partition(acc_scores, acc_scores.size - top_k)[acc_scores.size - top_k]
+                if threshold > remaining[i + 1]:
+                    candidates_only = True
+                    # Les candidats qui ne peuvent plus rattraper le seuil sont abandonnés
+                    keep = acc_scores + remaining[i + 1] >= threshold
+                    acc_rows, acc_scores = acc_rows[keep], acc_scores[keep]
+
+        if acc_rows.size == 0:
+            return []
+        k = min(top_k, acc_rows.size)
+        best = np.argpartition(-acc_scores, k - 1)[:k] if k < acc_rows.size else np.arange(acc_rows.size)
+        # Tri final des k meilleurs: score décroissant, puis numéro de ligne pour un ordre déterministe
+        best = best[np.lexsort((acc_rows[best], -acc_scores[best]))]
+        return [(int(acc_rows[j]), float(acc_scores[j])) for j in best if acc_scores[j] > min_score]
+
+def compute_term_max(matrix):
+    """Poids maximal de chaque colonne (terme) d'une matrice creuse à valeurs positives."""
+    matrix = matrix.tocsc()
+    term_max = np.zeros(matrix.shape[1], dtype=np.float64)
+    nonempty = np.diff(matrix.indptr) > 0
+    if matrix.nnz:
+        term_max[nonempty] = np.maximum.reduceat(matrix.data, matrix.indptr[:-1][nonempty])
+    return term_max
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+def bm25_idf(n_rows, df):
+    """IDF BM25 (toujours positif) d'un terme présent dans df passages sur n_rows."""
+    return np.log1p((n_rows - df + 0.5) / (df + 0.5))
+
+def bm25_matrix(counts, k1=BM25_K1, b=BM25_B):
+    """Précalcule les poids BM25 de chaque posting à partir d'une matrice de comptes passages x termes.
+
+    Renvoie (poids CSC, idf par terme, longueur de chaque passage). Le score BM25 d'un passage
+    pour une requête est alors la somme des poids des termes de la requête, ce qui permet de
+    réutiliser InvertedIndex tel quel.
+    """
+    counts = counts.tocsc().astype(np.float64)
+    n_rows = counts.shape[0]
+    doc_len = np.asarray(counts.sum(axis=1)).ravel()
+    avgdl = doc_len.mean() if n_rows else 0.0
+    df = np.diff(counts.indptr)
+    idf = bm25_idf(n_rows, df)
+
+    weights = counts.copy()
+    tf = weights.data
+    row_norm = k1 * (1.0 - b + b * doc_len / avgdl) if avgdl else np.full(n_rows, k1)
+    term_of_posting = np.repeat(np.arange(counts.shape[1]), df)
+    weights.data = idf[term_of_posting] * tf * (k1 + 1.0) / (tf + row_norm[weights.indices])
+    return weights, idf, doc_len
@@ -0,0 +1,174 @@
+"""
+Métriques de l'application (latences, compteurs, jauges), partagées par les endpoints.
+
+Les histogrammes sont cumulatifs (comme Prometheus): compteurs par borne supérieure de bucket,
+somme et nombre d'observations. Les quantiles sont estimés par interpolation dans les buckets.
+
+Sur le chemin des requêtes, une observation coûte une recherche dichotomique et trois additions
+sous verrou. Les valeurs déjà tenues ailleurs (statistiques des caches, taille de l'index,
+conversations) ne sont pas dupliquées: elles sont lues par une fonction au moment de l'export
+(`render_prometheus`, endpoint /metrics).
+"""
+import math
+import bisect
+import threading
+
+# Bornes en secondes, adaptées à des appels LLM (de quelques centaines de ms à plusieurs dizaines de s)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0)
+# Bornes en secondes pour l'indexation (d'un petit shard à une réindexation complète)
+INDEXING_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(text, quote=False):
+    text = text.replace("\\", "\\\\").replace("\n", "\\n")
+    return text.replace('"', '\\"') if quote else text
+
+class Histogram:
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1) # Dernier compteur: au-delà de la plus grande borne (+Inf)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimation du quantile q (0-1) par interpolation linéaire dans le bucket concerné."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                if i == len(self.buckets): # Bucket +Inf: pas de borne supérieure
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        with self._lock:
+            counts, total, total_sum = list(self.counts), self.count, self.sum
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {
+            'description': self.description,
+            'count': total,
+            'sum': total_sum,
+            'mean': total_sum / total if total else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': buckets,
+        }
+
+    def prometheus_lines(self):
+        with self._lock:
+            counts, total, total_sum = list(self.counts), self.count, self.sum
+        lines = [f"# HELP {self.name} {_escape(self.description)}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(float(bound))}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(float(total_sum))}")
+        lines.append(f"{self.name}_count {total}")
+        return lines
+
+class Counter:
+    """Compteur monotone incrémenté par l'application."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def prometheus_lines(self):
+        return [f"# HELP {self.name} {_escape(self.description)}", f"# TYPE {self.name} counter", f"{self.name} {_format_value(self.value)}"]
+
+class CallbackMetric:
+    """Compteur ou jauge dont la valeur est lue par `func` au moment de l'export.
+
+    `func` renvoie un nombre, ou {valeur de l'étiquette: nombre} si `label` est donné
+    (ex. label="cache": une série par cache). Une erreur de lecture omet la métrique.
+    """
+
+    def __init__(self, name, description, kind, func, label=None):
+        self.name = name
+        self.description = description
+        self.kind = kind # "counter" ou "gauge"
+        self.func = func
+        self.label = label
+
+    def prometheus_lines(self):
+        try:
+            value = self.func()
+        except Exception:
+            return []
+        lines = [f"# HELP {self.name} {_escape(self.description)}", f"# TYPE {self.name} {self.kind}"]
+        if self.label is None:
+            lines.append(f"{self.name} {_format_value(value)}")
+        else:
+            lines.extend(f'{self.name}{{{self.label}="{_escape(str(key), quote=True)}"}} {_format_value(item)}'
+                         for key, item in value.items() if item is not None)
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.metrics = {} # Compteurs et jauges, par nom
+        self._lock = threading.Lock()
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        """Renvoie l'histogramme `name`, créé au premier appel."""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, description, buckets)
+            return self.histograms[name]
+
+    def counter(self, name, description):
+        """Renvoie le compteur `name` (suffixe _total), créé au premier appel."""
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = Counter(name, description)
+            return self.metrics[name]
+
+    def register_callback(self, name, description, kind, func, label=None):
+        """Enregistre (ou remplace) une métrique lue par `func` à chaque export."""
+        with self._lock:
+            self.metrics[name] = CallbackMetric(name, description, kind, func, label)
+
+    def snapshot(self):
+        return {name: histogram.snapshot() for name, histogram in list(self.histograms.items())}
+
+    def render_prometheus(self):
+        """Toutes les métriques au format texte d'exposition Prometheus (version 0.0.4)."""
+        lines = []
+        for metric in list(self.histograms.values()) + list(self.metrics.values()):
+            lines.extend(metric.prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
@@ -1,316 +1,1438 @@
 import os
-import pickle
+import re
+import json
+import shutil
+import hashlib
 import pdfplumber
+import pypdf
+import numpy as np
 from tqdm import tqdm
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 import logging
 import time
+import threading
+from collections import Counter
+from types import MappingProxyType
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from article_index import ArticleIndex, find_article_headings, parse_article_reference
+import index_store
+from index_store import ChunkTable, atomic_write as _atomic_write
+from inverted_index import BM25_B, BM25_K1, InvertedIndex, bm25_idf, bm25_matrix
+from text_analysis import LegalTextAnalyzer, with_ngrams
+from document_metadata import document_metadata
+from dense_index import VectorIndex, load_encoder, model_slug, reciprocal_rank_fusion
+from response_cache import LRUCache
+from metrics import INDEXING_BUCKETS, registry as metrics
+from tracing import span
 
 # Configurer le logger pour ce module
 logger = logging.getLogger(__name__)
+logging.getLogger("pypdf").setLevel(logging.ERROR) # Avertissements de polices répétés à chaque page
+
+SHARD_BUILD_SECONDS = metrics.histogram("index_shard_build_seconds", "Durée de reconstruction d'un shard (textes en cache, vectorisation, sauvegarde)", INDEXING_BUCKETS)
 
 def table_to_markdown(table):
     """Convertit une liste de listes (tableau) en une chaîne Markdown."""
-    markdown_table = ""
-    if not table: return markdown_table
+    if not table: return ""
     header = table[0]
-    markdown_table += "| " + " | ".join(str(h) if h is not None else '' for h in header) + " |\n"
-    markdown_table += "| " + " | ".join("--- " * len(header)) + " |\n"
+    lines = ["| " + " | ".join(str(h) if h is not None else '' for h in header) + " |",
+             "| " + " | ".join("--- " * len(header)) + " |"]
     for row in table[1:]:
-        markdown_table += "| " + " | ".join(str(cell) if cell is not None else '' for cell in row) + " |\n"
-    return markdown_table + "\n"
+        lines.append("| " + " | ".join(str(cell) if cell is not None else '' for cell in row) + " |")
+    return "\n".join(lines) + "\n\n"
 
-class PDFIndexer:
-    def __init__(self, folder_path, cache_path="cache.pkl"):
-        self.folder_path = folder_path
-        self.cache_path = cache_path
-        self.documents = [] # Liste de dictionnaires {"filename": str, "text": str, "modified_time": float}
-        self.texts = []     # Liste des textes purs pour TF-IDF
-        self.vectorizer = TfidfVectorizer(max_df=0.85, min_df=2, stop_words=None, max_features=5000, ngram_range=(1, 2))
-        self.tfidf_matrix = None
-        logger.info(f"PDFIndexer initialisé pour le dossier: {folder_path} et cache: {cache_path}")
-
-        if os.path.exists(cache_path):
-            logger.info("Tentative de chargement de l'index depuis le cache...")
-            self._load_cache()
-            # La vérification des mises à jour est complexe avec l'ajout incrémental, 
-            # pour l'instant, on se fie au cache ou à une réindexation manuelle.
-            # self._check_for_updates() # Désactivé pour simplifier l'indexation incrémentale
+EXTRACTOR_VERSION = 3 # À incrémenter quand l'extraction change (invalide les textes en cache)
+RULE_TOLERANCE = 1.0  # Écart (points) en dessous duquel un segment est horizontal ou vertical
+EDGE_MIN_LENGTH = 3.0 # Longueur minimale d'un filet pour pdfplumber (edge_min_length par défaut)
+SHORT_SEGMENTS_LIMIT = 20 # Au-delà, des segments courts (pointillés) peuvent être raccordés en filets
+MAX_FORM_DEPTH = 3    # Profondeur maximale de XObjects Form imbriqués examinés
+
+# Début de chaîne d'un flux de contenu ; dans une chaîne littérale, échappements et parenthèses
+_STRING_START = re.compile(rb"[(<]")
+_LITERAL_TOKEN = re.compile(rb"\\.|[()]", re.S)
+_HEX_STRING = re.compile(rb"<[0-9A-Fa-f\s]*>")
+_PAINT_OPS = {b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*"}
+_IDENTITY = (1.0, 0.0, 0.0, 1.0)
+
+def _strip_strings(data):
+    """Remplace les chaînes d'un flux de contenu par des espaces (leur texte n'est pas un opérateur).
+
+    Les chaînes littérales peuvent contenir des parenthèses équilibrées non échappées,
+    "(voir (art. 5) n)" : la profondeur est comptée jusqu'à la parenthèse fermante. Une
+    parenthèse jamais refermée (données d'image en ligne...) est laissée telle quelle.
+    """
+    parts, position = [], 0
+    while True:
+        match = _STRING_START.search(data, position)
+        if match is None:
+            break
+        start = match.start()
+        if data[start:start + 2] == b"<<": # Dictionnaire, pas une chaîne
+            parts.append(data[position:start + 2])
+            position = start + 2
+            continue
+        end = None
+        if data[start:start + 1] == b"<":
+            hex_string = _HEX_STRING.match(data, start)
+            end = hex_string.end() if hex_string else None
         else:
-            logger.info("Aucun cache trouvé. Indexation complète des documents requise au premier appel ou manuellement.")
-            self.index_documents() # Indexe les documents existants au démarrage si pas de cache
+            depth = 0
+            for token in _LITERAL_TOKEN.finditer(data, start):
+                if token.group() == b"(":
+                    depth += 1
+                elif token.group() == b")":
+                    depth -= 1
+                    if depth == 0:
+                        end = token.end()
+                        break
+        if end is None:
+            parts.append(data[position:start + 1])
+            position = start + 1
+            continue
+        parts.append(data[position:start])
+        parts.append(b" ")
+        position = end
+    parts.append(data[position:])
+    return b"".join(parts)
 
-    def _extract_text_and_tables(self, path):
-        logger.debug(f"Début de l'extraction de texte et tableaux pour: {path}")
-        full_content = ""
+def _multiply(m, ctm):
+    """Partie linéaire (a, b, c, d) de m x ctm (convention des matrices PDF)."""
+    a, b, c, d = m
+    return (a * ctm[0] + b * ctm[2], a * ctm[1] + b * ctm[3], c * ctm[0] + d * ctm[2], c * ctm[1] + d * ctm[3])
+
+class _DrawingScan:
+    """Filets peints (après transformation) et images d'une page, relevés dans ses flux de contenu."""
+
+    def __init__(self):
+        self.horizontal = 0
+        self.vertical = 0
+        self.short = 0
+        self.curves = False
+        self.images = 0
+
+    def add_segment(self, dx, dy, ctm):
+        a, b, c, d = ctm
+        dx, dy = abs(a * dx + c * dy), abs(b * dx + d * dy)
+        if dy <= RULE_TOLERANCE and dx > RULE_TOLERANCE:
+            if dx >= EDGE_MIN_LENGTH:
+                self.horizontal += 1
+            else:
+                self.short += 1
+        elif dx <= RULE_TOLERANCE and dy > RULE_TOLERANCE:
+            if dy >= EDGE_MIN_LENGTH:
+                self.vertical += 1
+            else:
+                self.short += 1
+
+    def scan(self, data, resources, ctm=_IDENTITY, depth=0):
+        data = _strip_strings(data)
+        xobjects = None
+        stack, operands, name = [], [], None
+        segments, start, current, curve = [], None, None, False # Chemin en cours de construction
+        for token in data.split():
+            if token[0] in b"0123456789.-+":
+                operands.append(token)
+                continue
+            if token[0] == 0x2f: # /Nom
+                name = token
+                continue
+            try:
+                if token == b"cm" and len(operands) >= 6:
+                    ctm = _multiply(tuple(float(x) for x in operands[-6:-2]), ctm)
+                elif token == b"q":
+                    stack.append(ctm)
+                elif token == b"Q":
+                    ctm = stack.pop() if stack else _IDENTITY
+                elif token == b"m" and len(operands) >= 2:
+                    start = current = (float(operands[-2]), float(operands[-1]))
+                elif token == b"l" and len(operands) >= 2 and current is not None:
+                    point = (float(operands[-2]), float(operands[-1]))
+                    segments.append((point[0] - current[0], point[1] - current[1]))
+                    current = point
+                elif token == b"re" and len(operands) >= 4:
+                    w, h = float(operands[-2]), float(operands[-1])
+                    segments.extend(((w, 0.0), (0.0, h), (w, 0.0), (0.0, h)))
+                    start = current = None
+                elif token in (b"c", b"v", b"y"):
+                    curve = True
+                    current = (float(operands[-2]), float(operands[-1])) if len(operands) >= 2 else None
+                elif token == b"h" and start is not None and current is not None:
+                    segments.append((start[0] - current[0], start[1] - current[1]))
+                    current = start
+                elif token in _PAINT_OPS or token == b"n": # n: chemin de découpage seulement, rien n'est tracé
+                    if token != b"n":
+                        for dx, dy in segments:
+                            self.add_segment(dx, dy, ctm)
+                        self.curves = self.curves or curve
+                    segments, start, current, curve = [], None, None, False
+                elif token == b"BI":
+                    self.images += 1 # Image en ligne
+                elif token == b"Do" and name is not None:
+                    if xobjects is None:
+                        xobjects = resources.get("/XObject") if resources is not None else None
+                        xobjects = xobjects.get_object() if xobjects is not None else {}
+                    xobject = xobjects.get(name.decode("latin-1"))
+                    xobject = xobject.get_object() if xobject is not None else None
+                    if xobject is not None and xobject.get("/Subtype") == "/Image":
+                        self.images += 1
+                    elif xobject is not None:
+                        if depth >= MAX_FORM_DEPTH:
+                            self.curves = True # Trop profond: considéré comme candidat
+                        else:
+                            matrix = xobject.get("/Matrix")
+                            form_ctm = _multiply(tuple(float(x) for x in matrix[:4]), ctm) if matrix is not None else ctm
+                            form_resources = xobject.get("/Resources")
+                            self.scan(xobject.get_data(), form_resources.get_object() if form_resources is not None else resources,
+                                      form_ctm, depth + 1)
+            except (ValueError, IndexError):
+                pass # Jeton inattendu (données d'image en ligne...)
+            operands = []
+
+    @property
+    def may_have_tables(self):
+        return self.curves or self.short > SHORT_SEGMENTS_LIMIT or (self.horizontal >= 2 and self.vertical >= 2)
+
+def scan_page_drawing(page):
+    """Pré-vérification (pypdf) des tracés d'une page, sans analyse de mise en page.
+
+    Renvoie (tableau possible, nombre d'images). pdfplumber ne détecte un tableau (stratégie
+    "lines" par défaut) qu'à partir de filets peints formant au moins une cellule : il faut au
+    moins deux filets horizontaux et deux verticaux d'au moins EDGE_MIN_LENGTH points. Les
+    chemins de découpage (`re W n`) et les filets trop courts sont ignorés ; courbes, pointillés
+    et XObjects Form trop imbriqués rendent la page candidate par prudence.
+    """
+    contents = page.get_contents()
+    resources = page.get("/Resources")
+    scan = _DrawingScan()
+    scan.scan(contents.get_data() if contents is not None else b"", resources.get_object() if resources is not None else None)
+    return scan.may_have_tables, scan.images
+
+def _normalize_page_text(text):
+    """Texte pypdf: espaces de fin de ligne retirés (comme pdfplumber)."""
+    return "\n".join(line.rstrip() for line in (text or "").splitlines()).strip()
+
+def _page_content(text, tables):
+    """Contenu d'une page: texte puis tableaux en Markdown entre marqueurs."""
+    parts = [text + "\n\n"] if text else []
+    for table_data in tables or []:
+        if table_data:
+            parts.extend(("\n--- DÉBUT TABLEAU ---\n", table_to_markdown(table_data), "--- FIN TABLEAU ---\n\n"))
+    return "".join(parts).strip()
+
+def _extract_with_pdfplumber(path):
+    """Extraction complète avec pdfplumber (texte et tableaux de chaque page), si pypdf ne peut pas lire le fichier."""
+    with pdfplumber.open(path) as pdf:
+        logger.info(f"Traitement de {len(pdf.pages)} pages pour {os.path.basename(path)} (pdfplumber).")
+        return [_page_content(page.extract_text(), page.extract_tables()) for page in pdf.pages]
+
+def extract_text_and_tables(path):
+    """Extrait le texte et les tableaux (en Markdown) d'un PDF, page par page.
+
+    Renvoie une liste de chaînes, une par page (chaîne vide pour une page sans texte), afin
+    que l'index puisse rattacher chaque passage à sa page. Fonction de niveau module pour
+    pouvoir être exécutée dans un pool de processus.
+
+    Le texte de toutes les pages d'un document vient du même moteur: pypdf (arabe dans l'ordre
+    logique), ou pdfplumber pour tout le document si pypdf ne lit pas une page où pdfplumber
+    trouve du texte (polices non décodées). Les deux moteurs n'ordonnent pas l'arabe de la même
+    façon : mélangés, ils donneraient deux graphies de chaque mot dans un même document.
+    Une pré-vérification des tracés (voir scan_page_drawing) limite extract_tables de pdfplumber,
+    l'opération la plus coûteuse, aux pages qui peuvent contenir un tableau. Les pages sans texte
+    sont signalées: vides, ou numérisées (images seules, à passer par un OCR).
+    """
+    name = os.path.basename(path)
+    logger.debug(f"Début de l'extraction de texte et tableaux pour: {path}")
+    try:
+        reader = pypdf.PdfReader(path)
+        page_count = len(reader.pages)
+    except Exception as e:
+        logger.warning(f"pypdf ne peut pas lire {name} ({type(e).__name__}: {e}), extraction avec pdfplumber.")
         try:
-            with pdfplumber.open(path) as pdf:
-                logger.info(f"Traitement de {len(pdf.pages)} pages pour {os.path.basename(path)}.")
-                for i, page in enumerate(pdf.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        full_content += page_text + "\n\n"
-                    tables = page.extract_tables()
-                    if tables:
-                        for table_data in tables:
-                            if table_data:
-                                markdown_table = table_to_markdown(table_data)
-                                full_content += "\n--- DÉBUT TABLEAU ---\n"
-                                full_content += markdown_table
-                                full_content += "--- FIN TABLEAU ---\n\n"
+            return _extract_with_pdfplumber(path)
         except Exception as e:
             logger.exception(f"Erreur lors de l'extraction de texte et tableaux du fichier PDF: {path}")
-            return ""
-        return full_content.strip()
+            return []
+
+    logger.info(f"Traitement de {page_count} pages pour {name}.")
+    timings = [] # Par page: {'precheck', 'text', 'tables'} en secondes
+    table_pages, empty_pages, scanned_pages = [], [], []
+    try:
+        with ExitStack() as stack:
+            plumber = None
+            def plumber_page(i):
+                nonlocal plumber
+                if plumber is None: # Ouvert seulement si une page en a besoin
+                    plumber = stack.enter_context(pdfplumber.open(path))
+                return plumber.pages[i]
+
+            texts, candidates, page_images, unread = [], [], [], []
+            for i, page in enumerate(reader.pages):
+                start = time.perf_counter()
+                try:
+                    candidate, images = scan_page_drawing(page)
+                except Exception as e:
+                    logger.debug(f"{name} page {i + 1}: pré-vérification impossible ({e}), détection de tableaux lancée.")
+                    candidate, images = True, 0
+                checked = time.perf_counter()
+                try:
+                    text = _normalize_page_text(page.extract_text())
+                except Exception as e:
+                    logger.debug(f"{name} page {i + 1}: texte pypdf illisible ({e}).")
+                    text = None
+                if text is None or (not text and not images):
+                    unread.append(i)
+                texts.append(text or "")
+                candidates.append(candidate)
+                page_images.append(images)
+                timings.append({'precheck': checked - start, 'text': time.perf_counter() - checked, 'tables': 0.0})
+
+            # Page que pypdf ne lit pas mais pdfplumber si: tout le document passe par pdfplumber
+            def plumber_text(i):
+                start = time.perf_counter()
+                text = (plumber_page(i).extract_text() or "").strip()
+                timings[i]['text'] += time.perf_counter() - start
+                return text
+            if any(plumber_text(i) for i in unread):
+                logger.info(f"{name}: texte illisible par pypdf sur {len(unread)} pages, texte pdfplumber pour tout le document.")
+                texts = [plumber_text(i) for i in range(page_count)]
+
+            pages = []
+            for i, text in enumerate(texts):
+                tables = None
+                if candidates[i]:
+                    start = time.perf_counter()
+                    tables = plumber_page(i).extract_tables()
+                    if tables:
+                        table_pages.append(i + 1)
+                    timings[i]['tables'] = time.perf_counter() - start
+                pages.append(_page_content(text, tables))
+                logger.debug(f"{name} page {i + 1}: pré-vérification {timings[i]['precheck'] * 1000:.1f} ms, texte {timings[i]['text'] * 1000:.1f} ms, "
+                             f"tableaux {timings[i]['tables'] * 1000:.1f} ms{' (tableaux recherchés)' if candidates[i] else ''}.")
+                if not pages[-1]:
+                    (scanned_pages if page_images[i] else empty_pages).append(i + 1)
+    except Exception as e:
+        logger.exception(f"Erreur lors de l'extraction de texte et tableaux du fichier PDF: {path}")
+        return []
+
+    if scanned_pages:
+        logger.warning(f"{name}: {len(scanned_pages)} pages numérisées sans texte (OCR nécessaire): {scanned_pages[:20]}")
+    if empty_pages:
+        logger.info(f"{name}: {len(empty_pages)} pages vides: {empty_pages[:20]}")
+    totals = {step: sum(timing[step] for timing in timings) for step in ('precheck', 'text', 'tables')}
+    logger.info(f"{name}: {page_count} pages extraites, tableaux recherchés sur {sum(candidates)} pages ({len(table_pages)} avec tableaux) ; "
+                f"pré-vérification {totals['precheck']:.2f} s, texte {totals['text']:.2f} s, tableaux {totals['tables']:.2f} s.")
+    return pages
+
+def _extract_worker(path):
+    """Point d'entrée du pool: renvoie (path, pages, erreur) sans jamais lever d'exception."""
+    try:
+        return path, extract_text_and_tables(path), None
+    except Exception as e:  # Un PDF défectueux ne doit pas bloquer le lot
+        return path, [], f"{type(e).__name__}: {e}"
+
+CHUNK_MAX_CHARS = 1200 # Taille maximale d'un passage indexé
+CHUNK_MIN_CHARS = 40   # En dessous (numéro de page, pied de page isolé), un passage est rattaché à un voisin
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+def chunk_pages(pages, max_chars=CHUNK_MAX_CHARS, min_chars=CHUNK_MIN_CHARS):
+    """Découpe les pages en passages d'au plus `max_chars` caractères.
+
+    Les paragraphes consécutifs d'une même page sont regroupés ; un paragraphe trop long est
+    coupé sur les fins de ligne, et chaque en-tête d'article ("Article 12 -", "الفصل 12") ouvre
+    un nouveau passage. Renvoie des dictionnaires {"page": int (1-based), "offset": int (position
+    dans le texte de la page), "text": str}, avec une clé "article" pour les passages qui
+    commencent un article.
+
+    Un passage de moins de `min_chars` caractères qui n'ouvre pas un article (numéro de page,
+    fragment de pied de page) est fusionné avec le passage précédent de la page, sinon avec le
+    suivant ; seul sur sa page, il est écarté. Isolé, un tel fragment ("12") obtiendrait un score
+    maximal pour toute requête qui le contient.
+    """
+    chunks = []
+    for page_number, page_text in enumerate(pages, start=1):
+        if not page_text:
+            continue
+        page_start = len(chunks)
+        # Segments (offset, texte, article) : paragraphes coupés aux en-têtes d'articles, puis si trop longs
+        segments = []
+        position = 0
+        for match in list(_PARAGRAPH_BREAK.finditer(page_text)) + [None]:
+            end = match.start() if match else len(page_text)
+            paragraph = page_text[position:end]
+            headings = find_article_headings(paragraph)
+            bounds = [0] + [start for start, _ in headings if start > 0] + [len(paragraph)]
+            keys = {start: key for start, key in headings}
+            for piece_start, piece_end in zip(bounds, bounds[1:]):
+                piece = paragraph[piece_start:piece_end]
+                offset = position + piece_start
+                article = keys.get(piece_start)
+                while len(piece) > max_chars:
+                    cut = piece.rfind("\n", 0, max_chars)
+                    cut = cut if cut > 0 else max_chars
+                    if piece[:cut].strip():
+                        leading = len(piece[:cut]) - len(piece[:cut].lstrip())
+                        segments.append((offset + leading, piece[leading:cut], article))
+                        article = None
+                    piece = piece[cut:]
+                    offset += cut
+                if piece.strip():
+                    leading = len(piece) - len(piece.lstrip())
+                    segments.append((offset + leading, piece[leading:], article))
+            position = match.end() if match else len(page_text)
+
+        current, current_end = None, None # current_end: fin du dernier segment rattaché à current
+        for offset, segment, article in segments:
+            if current is not None and (article or offset + len(segment) - current['offset'] > max_chars):
+                current['text'] = page_text[current['offset']:current_end].strip()
+                chunks.append(current)
+                current = None
+            if current is None:
+                current = {'page': page_number, 'offset': offset}
+                if article:
+                    current['article'] = article
+            current_end = offset + len(segment)
+        if current is not None:
+            current['text'] = page_text[current['offset']:current_end].strip()
+            chunks.append(current)
+        chunks[page_start:] = _merge_short_chunks(chunks[page_start:], page_text, min_chars)
+    return chunks
+
+def _merge_short_chunks(page_chunks, page_text, min_chars=CHUNK_MIN_CHARS):
+    """Rattache les passages trop courts d'une page (hors débuts d'articles) à leur voisin, voir chunk_pages."""
+    merged = []
+    pending = None # Fragment court en tête de page, en attente du passage suivant
+    for chunk in page_chunks:
+        if pending is not None:
+            chunk = dict(chunk, offset=pending['offset'], text=page_text[pending['offset']:chunk['offset'] + len(chunk['text'])].strip())
+            pending = None
+        if len(chunk['text']) >= min_chars or chunk.get('article'):
+            merged.append(chunk)
+        elif merged:
+            previous = merged[-1]
+            previous['text'] = page_text[previous['offset']:chunk['offset'] + len(chunk['text'])].strip()
+        else:
+            pending = chunk
+    return merged
+
+def file_sha256(path, block_size=1024 * 1024):
+    """Calcule l'empreinte SHA-256 du contenu d'un fichier, par blocs."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+TFIDF_NGRAM_RANGE = (1, 2)
+
+def _pretokenized(tokens):
+    """Analyseur identité: les vectorizers reçoivent des listes de termes déjà produites par l'analyseur."""
+    return tokens
+
+def make_vectorizer(n_docs=None):
+    """Crée le TfidfVectorizer de l'index, alimenté par les termes de l'analyseur (voir text_analysis).
+
+    Les petits shards (un dossier avec un ou deux PDF, comme constitutions/) ne peuvent pas
+    satisfaire min_df=2 / max_df=0.85 : on relâche alors ces seuils.
+    """
+    return TfidfVectorizer(analyzer=_pretokenized, **vectorizer_config(n_docs))
+
+def vectorizer_config(n_docs=None):
+    """Paramètres du TfidfVectorizer (sérialisables en JSON pour le format disque)."""
+    if n_docs is not None and n_docs < 3:
+        return dict(max_df=1.0, min_df=1, max_features=5000)
+    return dict(max_df=0.85, min_df=2, max_features=5000)
+
+def tfidf_idf(n_docs, df):
+    """IDF lissé du TfidfVectorizer (smooth_idf=True)."""
+    return np.log((1 + n_docs) / (1 + df)) + 1.0
+
+def query_terms(query_tokens, ranker):
+    """Termes de la requête et leur nombre d'occurrences: unigrammes pour BM25, plus les bigrammes pour TF-IDF."""
+    return Counter(query_tokens if ranker == "bm25" else with_ngrams(query_tokens, TFIDF_NGRAM_RANGE))
 
-    def _rebuild_tfidf(self):
-        """Reconstruit le vectorizer et la matrice TF-IDF à partir de self.texts."""
-        if self.texts:
-            logger.info("Reconstruction de la matrice TF-IDF...")
+def make_bm25_vectorizer():
+    """Compteur de termes pour BM25: unigrammes de l'analyseur, vocabulaire non plafonné.
+
+    Contrairement au TF-IDF (max_features=5000, max_df=0.85), les termes rares sont conservés:
+    ce sont souvent les plus discriminants dans un corpus juridique (l'IDF BM25 pénalise déjà
+    les termes fréquents).
+    """
+    return CountVectorizer(analyzer=_pretokenized, min_df=1)
+
+RANKERS = ("tfidf", "bm25")
+
+CACHE_FORMAT_VERSION = 7 # À incrémenter quand le format disque des shards change
+CHUNKER_VERSION = 2 # À incrémenter quand chunk_pages change (invalide les termes en cache)
+ARTICLE_MAX_CHUNKS = 3 # Passages retenus au maximum pour un même article
+ROOT_SHARD = "" # Nom du shard des PDF placés directement à la racine du dossier
+DENSE_POOL_FACTOR = 4 # Recherche hybride: top_k * DENSE_POOL_FACTOR candidats de chaque classement avant fusion
+
+def shard_name_for(relpath):
+    """Un shard par sous-dossier: 'codes/Code des eaux.pdf' -> 'codes', 'Annuaire.pdf' -> ''."""
+    return os.path.dirname(relpath).replace(os.sep, "/")
+
+class IndexShard:
+    """Index TF-IDF d'un sous-dossier du corpus, construit et mis en cache indépendamment des autres.
+
+    Chaque ligne de la matrice est un passage (voir chunk_pages) et non un document entier. Un
+    shard chargé depuis le disque garde sa matrice et ses passages en mmap (voir index_store).
+    Textes et requêtes passent par le même analyseur, dont la version est enregistrée avec le shard.
+    """
+
+    def __init__(self, name, shard_dir, analyzer=None):
+        self.name = name
+        self.shard_dir = shard_dir
+        self.analyzer = analyzer or LegalTextAnalyzer()
+        self.generation_id = None # Génération publiée sur disque (nom du dossier), la même dans tous les processus
+        self.chunk_tokens = [] # Termes analysés de chaque passage, pendant la construction uniquement
+        self.documents = [] # Métadonnées par document, voir document_metadata (filename, pages, size, title, code, language...)
+        self.doc_index = {} # {filename: indice dans documents}
+        self.chunks = []    # Passages {"doc": indice dans documents, "page": int, "offset": int, "text": str} (ChunkTable une fois chargé)
+        self.articles = ArticleIndex() # (document, numéro d'article) -> indices de passages
+        self.vectorizer = make_vectorizer()
+        self.tfidf_matrix = None # Matrice passages x termes au format CSC (colonnes = listes de postings)
+        self.postings = None     # InvertedIndex sur tfidf_matrix
+        self.bm25_vectorizer = make_bm25_vectorizer()
+        self.bm25_matrix = None  # Poids BM25 précalculés par posting (CSC)
+        self.bm25 = None         # InvertedIndex sur bm25_matrix
+        self.bm25_doc_len = None # Longueur (en termes) de chaque passage
+        self.dense = None        # VectorIndex des passages (recherche dense optionnelle, voir dense_index)
+
+    def _chunk_texts(self):
+        if isinstance(self.chunks, ChunkTable):
+            return list(self.chunks.texts())
+        return [chunk['text'] for chunk in self.chunks]
+
+    def _chunk_tokens(self):
+        if len(self.chunk_tokens) == len(self.chunks):
+            return self.chunk_tokens
+        return [self.analyzer(text) for text in self._chunk_texts()]
+
+    def rebuild(self):
+        """Reconstruit le vectorizer et la matrice TF-IDF à partir des passages."""
+        if len(self.chunks):
+            logger.info(f"Reconstruction de la matrice TF-IDF du shard '{self.name}'...")
             try:
-                self.tfidf_matrix = self.vectorizer.fit_transform(self.texts)
-                logger.info(f"Matrice TF-IDF reconstruite avec succès. Dimensions: {self.tfidf_matrix.shape}")
+                self.vectorizer = make_vectorizer(len(self.chunks))
+                tokens = self._chunk_tokens()
+                self.tfidf_matrix = self.vectorizer.fit_transform([with_ngrams(t, TFIDF_NGRAM_RANGE) for t in tokens]).tocsc()
+                self.postings = InvertedIndex(self.tfidf_matrix)
+                self.bm25_vectorizer = make_bm25_vectorizer()
+                self.bm25_matrix, self.bm25_idf, self.bm25_doc_len = bm25_matrix(self.bm25_vectorizer.fit_transform(tokens))
+                self.bm25 = InvertedIndex(self.bm25_matrix)
+                logger.info(f"Matrice TF-IDF du shard '{self.name}' reconstruite avec succès. Dimensions: {self.tfidf_matrix.shape}")
             except Exception as e:
-                logger.exception("Erreur lors de la reconstruction de la matrice TF-IDF.")
+                logger.exception(f"Erreur lors de la reconstruction de la matrice TF-IDF du shard '{self.name}'.")
                 self.tfidf_matrix = None # Assurer un état cohérent
+                self.postings = None
+                self.bm25 = None
         else:
-            logger.warning("Aucun texte à indexer. La matrice TF-IDF est vide.")
+            logger.warning(f"Aucun texte à indexer dans le shard '{self.name}'. La matrice TF-IDF est vide.")
             self.tfidf_matrix = None
+            self.postings = None
+            self.bm25 = None
             # Réinitialiser le vectorizer s'il n'y a plus de textes pour éviter des états incohérents
-            self.vectorizer = TfidfVectorizer(max_df=0.85, min_df=2, stop_words=None, max_features=5000, ngram_range=(1, 2))
-
-    def index_documents(self):
-        logger.info(f"Début de l'indexation complète des documents dans {self.folder_path}")
-        start_time_total = time.time()
-        self.documents = []
-        self.texts = []
-        files_to_index = [f for f in os.listdir(self.folder_path) if f.endswith(".pdf")]
-        logger.info(f"{len(files_to_index)} fichiers PDF trouvés pour l'indexation complète.")
-
-        for filename in tqdm(files_to_index, desc="📄 Indexation PDF (Complète)"):
-            path = os.path.join(self.folder_path, filename)
-            content = self._extract_text_and_tables(path)
-            if content:
-                modified_time = os.path.getmtime(path)
-                self.documents.append({
-                    'filename': filename,
-                    'text': content,
-                    'modified_time': modified_time
-                })
-                self.texts.append(content)
-            else:
-                logger.warning(f"Aucun contenu extrait de {filename} lors de l'indexation complète.")
-        
-        self._rebuild_tfidf()
-        self._save_cache()
-        end_time_total = time.time()
-        logger.info(f"Indexation complète terminée en {end_time_total - start_time_total:.2f} secondes. {len(self.documents)} documents indexés.")
+            self.vectorizer = make_vectorizer()
 
-    def add_single_document(self, file_path):
-        """Ajoute ou met à jour un seul document PDF à l'index existant."""
-        filename = os.path.basename(file_path)
-        logger.info(f"Ajout/Mise à jour du document unique: {filename}")
-        start_time = time.time()
-
-        content = self._extract_text_and_tables(file_path)
-        if not content:
-            logger.warning(f"Aucun contenu extrait de {filename}. Le document ne sera pas ajouté/mis à jour.")
+    def save(self):
+        """Écrit le shard dans une nouvelle génération puis la publie. Renvoie False en cas d'échec."""
+        logger.info(f"Sauvegarde du shard '{self.name}' dans le cache: {self.shard_dir}")
+        try:
+            generation_dir = index_store.new_generation(self.shard_dir)
+            dense_meta = self.dense.save(generation_dir) if self.dense is not None else None
+            index_store.save_json(generation_dir, "meta.json", {
+                'format_version': CACHE_FORMAT_VERSION,
+                'name': self.name,
+                'analyzer': self.analyzer.version,
+                'shape': list(self.tfidf_matrix.shape) if self.tfidf_matrix is not None else None,
+                'vectorizer': vectorizer_config(len(self.chunks)),
+                'bm25': {'k1': BM25_K1, 'b': BM25_B, 'n_terms': len(self.bm25_vectorizer.vocabulary_) if self.bm25 else 0},
+                'dense': dense_meta, # Modèle et nombre de vecteurs, None sans recherche dense
+            })
+            index_store.save_json(generation_dir, "documents.json", self.documents)
+            index_store.save_json(generation_dir, "articles.json", self.articles.to_dict())
+            chunks = self.chunks if isinstance(self.chunks, ChunkTable) else ChunkTable.from_chunks(self.chunks)
+            chunks.save(generation_dir)
+            if self.tfidf_matrix is not None:
+                index_store.save_json(generation_dir, "vocabulary.json", {term: int(col) for term, col in self.vectorizer.vocabulary_.items()})
+                index_store.save_array(generation_dir, "idf", self.vectorizer.idf_)
+                index_store.save_csc(generation_dir, "tfidf", self.tfidf_matrix)
+                index_store.save_array(generation_dir, "tfidf_term_max", self.postings.term_max)
+                index_store.save_json(generation_dir, "bm25_vocabulary.json", {term: int(col) for term, col in self.bm25_vectorizer.vocabulary_.items()})
+                index_store.save_array(generation_dir, "bm25_idf", self.bm25_idf)
+                index_store.save_array(generation_dir, "bm25_doc_len", self.bm25_doc_len)
+                index_store.save_csc(generation_dir, "bm25", self.bm25_matrix)
+                index_store.save_array(generation_dir, "bm25_term_max", self.bm25.term_max)
+            index_store.publish_generation(self.shard_dir, generation_dir)
+            self.generation_id = os.path.basename(generation_dir)
+            logger.info(f"Shard '{self.name}' sauvegardé avec succès ({os.path.basename(generation_dir)}).")
+            return True
+        except Exception as e:
+            logger.exception(f"Erreur lors de la sauvegarde du shard dans {self.shard_dir}")
             return False
 
-        modified_time = os.path.getmtime(file_path)
-        
-        # Vérifier si le document existe déjà pour le mettre à jour
-        doc_exists = False
-        for i, doc_info in enumerate(self.documents):
-            if doc_info['filename'] == filename:
-                logger.info(f"Le document {filename} existe déjà. Mise à jour du contenu et de modified_time.")
-                self.documents[i]['text'] = content
-                self.documents[i]['modified_time'] = modified_time
-                self.texts[i] = content # Assumer que l'ordre est conservé
-                doc_exists = True
-                break
-        
-        if not doc_exists:
-            logger.info(f"Nouveau document {filename}. Ajout à l'index.")
-            self.documents.append({
-                'filename': filename,
-                'text': content,
-                'modified_time': modified_time
-            })
-            self.texts.append(content)
+    @classmethod
+    def load(cls, shard_dir, analyzer=None, dense_model=None):
+        """Ouvre la génération active d'un shard. Seuls les petits fichiers JSON sont lus entièrement.
 
-        self._rebuild_tfidf() # Reconstruit TF-IDF avec le nouveau/mis à jour texte
-        self._save_cache()
-        end_time = time.time()
-        logger.info(f"Document {filename} ajouté/mis à jour et index reconstruit en {end_time - start_time:.2f} secondes.")
-        return True
+        Les vecteurs denses ne sont ouverts que s'ils ont été calculés avec `dense_model`.
+        """
+        logger.info(f"Chargement d'un shard depuis le cache: {shard_dir}")
+        generation_dir = index_store.current_generation(shard_dir)
+        if generation_dir is None:
+            raise FileNotFoundError(f"Aucune génération publiée dans {shard_dir}")
+        meta = index_store.load_json(generation_dir, "meta.json")
+        if meta.get('format_version') != CACHE_FORMAT_VERSION:
+            raise ValueError(f"Format de cache obsolète ({meta.get('format_version')}, attendu {CACHE_FORMAT_VERSION})")
+        shard = cls(meta.get('name', ROOT_SHARD), shard_dir, analyzer)
+        shard.generation_id = os.path.basename(generation_dir)
+        if meta.get('analyzer') != shard.analyzer.version:
+            raise ValueError(f"Shard construit avec un autre analyseur ({meta.get('analyzer')}, attendu {shard.analyzer.version})")
+        shard.documents = index_store.load_json(generation_dir, "documents.json")
+        shard.doc_index = {doc['filename']: i for i, doc in enumerate(shard.documents)}
+        shard.articles = ArticleIndex.from_dict(index_store.load_json(generation_dir, "articles.json"))
+        shard.chunks = ChunkTable.load(generation_dir)
+        dense_meta = meta.get('dense')
+        if dense_model and dense_meta and dense_meta['model'] == dense_model and dense_meta['count'] == len(shard.chunks):
+            shard.dense = VectorIndex.load(generation_dir, dense_meta)
+        if meta.get('shape'):
+            shard.vectorizer = TfidfVectorizer(analyzer=_pretokenized, **meta['vectorizer'])
+            shard.vectorizer.vocabulary_ = index_store.load_json(generation_dir, "vocabulary.json") # Restaurer le vocabulaire
+            shard.vectorizer.idf_ = index_store.load_array(generation_dir, "idf", mmap_mode=None)
+            shard.tfidf_matrix = index_store.load_csc(generation_dir, "tfidf", tuple(meta['shape']))
+            shard.postings = InvertedIndex(shard.tfidf_matrix, index_store.load_array(generation_dir, "tfidf_term_max"))
+            shard.bm25_vectorizer.vocabulary_ = index_store.load_json(generation_dir, "bm25_vocabulary.json")
+            shard.bm25_idf = index_store.load_array(generation_dir, "bm25_idf")
+            shard.bm25_doc_len = index_store.load_array(generation_dir, "bm25_doc_len")
+            shard.bm25_matrix = index_store.load_csc(generation_dir, "bm25", (meta['shape'][0], meta['bm25']['n_terms']))
+            shard.bm25 = InvertedIndex(shard.bm25_matrix, index_store.load_array(generation_dir, "bm25_term_max"))
+        logger.info(f"Shard '{shard.name}' chargé: {len(shard.documents)} documents, {len(shard.chunks)} passages{', vecteurs denses' if shard.dense is not None else ''}.")
+        return shard
 
-    def remove_document(self, filename):
-        """Supprime un document de l'index."""
-        logger.info(f"Tentative de suppression du document: {filename} de l'index.")
-        doc_found = False
-        # Utiliser une compréhension de liste pour reconstruire documents et texts sans le fichier spécifié
-        new_documents = []
-        new_texts = []
-        for doc_info in self.documents:
-            if doc_info['filename'] == filename:
-                doc_found = True
-                logger.info(f"Document {filename} trouvé et marqué pour suppression.")
-            else:
-                new_documents.append(doc_info)
-                new_texts.append(doc_info['text'])
-        
-        if doc_found:
-            self.documents = new_documents
-            self.texts = new_texts
-            self._rebuild_tfidf()
-            self._save_cache()
-            logger.info(f"Document {filename} supprimé de l'index et index reconstruit.")
-            return True
+    def add_document(self, record):
+        """Ajoute un document pendant la construction et renvoie son indice."""
+        self.doc_index[record['filename']] = len(self.documents)
+        self.documents.append(record)
+        return len(self.documents) - 1
+
+    def index_articles(self, doc_index, first_chunk):
+        """Enregistre les articles du document à partir de ses passages (self.chunks[first_chunk:]), pendant la construction."""
+        filename = self.documents[doc_index]['filename']
+        current_key, current_chunks = None, []
+        for i in range(first_chunk, len(self.chunks)):
+            article = self.chunks[i].get('article')
+            if article:
+                if current_key:
+                    self.articles.add(filename, current_key, current_chunks)
+                current_key, current_chunks = article, [i]
+            elif current_key and len(current_chunks) < ARTICLE_MAX_CHUNKS:
+                current_chunks.append(i) # Suite de l'article sur le passage suivant
+        if current_key:
+            self.articles.add(filename, current_key, current_chunks)
+
+    def _ranker_index(self, ranker):
+        if ranker == "bm25":
+            return self.bm25_vectorizer.vocabulary_, self.bm25
+        return self.vectorizer.vocabulary_, self.postings
+
+    def document_frequencies(self, terms, ranker="tfidf"):
+        """{terme: nombre de passages du shard qui le contiennent} pour les termes de son vocabulaire."""
+        if self.postings is None:
+            return {}
+        vocabulary, index = self._ranker_index(ranker)
+        frequencies = {}
+        for term in terms:
+            column = vocabulary.get(term)
+            if column is not None:
+                frequencies[term] = int(index.indptr[column + 1] - index.indptr[column])
+        return frequencies
+
+    def search(self, query, top_k, ranker="tfidf", query_tokens=None, corpus=None):
+        """Renvoie [(indice du passage, score)] pour les top_k passages du shard.
+
+        `query_tokens` évite de ré-analyser la requête pour chaque shard (termes de self.analyzer).
+        `corpus` = (nombre de passages, {terme: fréquence documentaire}) sur l'ensemble des shards
+        (voir PDFIndexer._corpus_stats) ; sans lui, les statistiques du shard seul sont utilisées.
+        Les poids de la requête reposent sur ces statistiques globales, de sorte que les scores de
+        shards différents soient comparables.
+
+        ranker="tfidf": les lignes TF-IDF étant normalisées (L2), le produit scalaire calculé sur les
+        listes de postings est la similarité cosinus avec le vecteur de requête, pondéré par l'IDF
+        global et normalisé sur tous les termes connus du corpus : un shard où manquent la plupart
+        des termes de la requête ne peut pas atteindre un cosinus de 1.
+        ranker="bm25": somme des poids BM25 précalculés des termes de la requête (pondérés par
+        leur nombre d'occurrences dans la requête), l'IDF du shard étant remplacé par l'IDF global.
+        """
+        if self.postings is None or self.tfidf_matrix.shape[0] == 0:
+            return []
+        if query_tokens is None:
+            query_tokens = self.analyzer(query)
+        terms = query_terms(query_tokens, ranker)
+        n_docs, frequencies = corpus if corpus is not None else (len(self.chunks), self.document_frequencies(terms, ranker))
+        vocabulary, _ = self._ranker_index(ranker)
+        columns, weights = [], []
+        if ranker == "bm25":
+            for term, count in terms.items():
+                column = vocabulary.get(term)
+                if column is not None and frequencies.get(term):
+                    columns.append(column)
+                    weights.append(count * bm25_idf(n_docs, frequencies[term]) / self.bm25_idf[column])
+            results = self.bm25.search(columns, weights, top_k, min_score=0.0)
         else:
-            logger.warning(f"Document {filename} non trouvé dans l'index. Aucune action de suppression.")
-            return False
+            term_weights = {term: count * tfidf_idf(n_docs, frequencies[term]) for term, count in terms.items() if frequencies.get(term)}
+            norm = np.sqrt(sum(weight * weight for weight in term_weights.values()))
+            for term, weight in term_weights.items():
+                column = vocabulary.get(term)
+                if column is not None:
+                    columns.append(column)
+                    weights.append(weight / norm)
+            results = self.postings.search(columns, weights, top_k, min_score=0.01)
+        num_chunks = len(self.chunks)
+        for i, _ in results:
+            if i >= num_chunks:
+                logger.warning(f"Indice {i} hors limites pour le shard '{self.name}' lors de la recherche.")
+        return [(i, score) for i, score in results if i < num_chunks]
+
+def assemble_context(passages, context_char_limit=4000):
+    """Concatène les passages ({"source", "text", "ids"}) dans la limite de context_char_limit caractères.
+
+    Renvoie (contexte, identifiants des passages inclus).
+    """
+    context = ""
+    passage_ids = []
+    for passage in passages:
+        if len(context) >= context_char_limit:
+            break
+        context_to_add = f"\n--- {passage['source']} ---\n"
+        remaining_total_chars = context_char_limit - len(context) - len(context_to_add)
+        if remaining_total_chars > 0:
+            context += context_to_add + passage['text'][:remaining_total_chars]
+            passage_ids.extend(passage['ids'])
+    return context.strip(), passage_ids
+
+class IndexSnapshot:
+    """État publié de l'index: ensemble de shards figé, remplacé en bloc à chaque modification.
+
+    Les lecteurs lisent une seule fois PDFIndexer.snapshot puis n'utilisent que cet objet : ils
+    voient toujours des shards cohérents entre eux, sans verrou, même si une reconstruction publie
+    un nouvel instantané entre-temps. Les shards eux-mêmes ne sont jamais modifiés après publication.
+    """
+    __slots__ = ("shards", "generation", "version")
+
+    def __init__(self, shards, generation):
+        object.__setattr__(self, "shards", MappingProxyType(dict(shards))) # {nom du shard: IndexShard}
+        object.__setattr__(self, "generation", generation) # Incrémenté à chaque publication (propre au processus)
+        # Empreinte des générations publiées sur disque: identique dans tous les workers qui servent le même index
+        signature = "|".join(f"{name}={shard.generation_id}" for name, shard in sorted(self.shards.items()))
+        object.__setattr__(self, "version", hashlib.sha256(signature.encode("utf-8")).hexdigest()[:16])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("IndexSnapshot est immuable")
+
+    @property
+    def documents(self):
+        return [doc for shard in self.shards.values() for doc in shard.documents]
+
+    @property
+    def ready(self):
+        return any(shard.tfidf_matrix is not None for shard in self.shards.values())
+
+class PDFIndexer:
+    def __init__(self, folder_path, workers=1, cache_dir="index_cache", ranker="tfidf", analyzer=None, dense_model=None, dense_batch_size=64,
+                 retrieval_cache_size=1000):
+        if ranker not in RANKERS:
+            raise ValueError(f"Classement inconnu: {ranker} (attendu: {', '.join(RANKERS)})")
+        self.folder_path = folder_path
+        self.analyzer = analyzer or LegalTextAnalyzer() # Normalisation FR/AR et mots vides, voir text_analysis
+        self.ranker = ranker # Classement par défaut de search(): "tfidf" ou "bm25"
+        self.workers = workers # Nombre de processus d'extraction (1 = mode séquentiel)
+        self.encoder = load_encoder(dense_model, dense_batch_size) # None: recherche lexicale seule
+        self.dense_model = self.encoder.model_name if self.encoder else None
+        # Classements déjà calculés {(requête normalisée, classement, top_k, dense): [(shard, passage, score, ...)]},
+        # liés à la version de l'instantané ; 0 = pas de cache (mesures de la recherche elle-même)
+        self.retrieval_cache = LRUCache("recherche", max_entries=retrieval_cache_size, ttl=None) if retrieval_cache_size else None
+        self.cache_dir = cache_dir
+        self.text_cache_dir = os.path.join(cache_dir, "texts") # Textes extraits, un fichier par empreinte SHA-256 et version d'extraction
+        self.token_cache_dir = os.path.join(cache_dir, "tokens") # Termes analysés des passages, par empreinte et version d'analyseur
+        self.embedding_cache_dir = os.path.join(cache_dir, "embeddings") # Vecteurs denses des passages, par empreinte et modèle
+        self.shard_cache_dir = os.path.join(cache_dir, "shards") # Un dossier par shard (sous-dossier du corpus), voir index_store
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.lock_path = os.path.join(cache_dir, "indexing.lock") # Verrou entre processus des écritures de l'index (voir index_store.process_lock)
+        self.manifest = {}  # {chemin relatif: {"sha256": str, "size": int, "modified_time": float}}
+        self.snapshot = IndexSnapshot({}, 0) # Instantané lu par les recherches, remplacé atomiquement par _publish
+        self._write_lock = threading.RLock() # Un seul écrivain à la fois (manifeste, caches, shards)
+        os.makedirs(self.text_cache_dir, exist_ok=True)
+        os.makedirs(self.token_cache_dir, exist_ok=True)
+        os.makedirs(self.embedding_cache_dir, exist_ok=True)
+        os.makedirs(self.shard_cache_dir, exist_ok=True)
+        self._load_manifest()
+        logger.info(f"PDFIndexer initialisé pour le dossier: {folder_path} et cache: {cache_dir}")
+
+        if self._load_shards():
+            logger.info(f"{len(self.shards)} shards chargés depuis le cache.")
+            # La synchronisation avec le disque (sync_documents) est faite par l'application au démarrage.
+        else:
+            # Plusieurs workers démarrent ensemble: un seul construit l'index, les autres attendent le verrou puis le chargent
+            with index_store.process_lock(self.lock_path):
+                self._load_manifest()
+                if self._load_shards():
+                    logger.info(f"{len(self.shards)} shards construits par un autre processus, chargés depuis le cache.")
+                else:
+                    logger.info("Aucun cache trouvé. Synchronisation des documents (textes en cache réutilisés si disponibles).")
+                    self.sync_documents() # Indexe les documents existants au démarrage si pas de cache
+
+    @property
+    def shards(self):
+        """Shards de l'instantané courant (lecture seule)."""
+        return self.snapshot.shards
+
+    @property
+    def documents(self):
+        """Vue agrégée (lecture seule) des documents de tous les shards."""
+        return self.snapshot.documents
+
+    def _publish(self, shards):
+        """Remplace l'instantané courant (une seule affectation de référence, atomique pour les lecteurs).
+
+        Rien n'est publié si aucun shard n'a changé: la génération ne bouge pas.
+        """
+        if shards == dict(self.snapshot.shards):
+            return
+        self.snapshot = IndexSnapshot(shards, self.snapshot.generation + 1)
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.clear() # Classements calculés sur l'ancien corpus (ajout, suppression, réindexation)
+        logger.info(f"Instantané d'index {self.snapshot.generation} publié ({len(shards)} shards).")
+
+    def _extract_text_and_tables(self, path):
+        return extract_text_and_tables(path)
+
+    def _shard_cache_path(self, name):
+        safe_name = name.replace("/", "__") if name else "_racine"
+        return os.path.join(self.shard_cache_dir, safe_name)
+
+    def _open_shard(self, shard_dir):
+        return IndexShard.load(shard_dir, self.analyzer, self.dense_model)
+
+    def _load_shards(self):
+        shards = {}
+        for entry in sorted(os.listdir(self.shard_cache_dir)):
+            shard_dir = os.path.join(self.shard_cache_dir, entry)
+            if not os.path.isdir(shard_dir):
+                os.remove(shard_dir) # Ancien cache pickle (*.pkl)
+                continue
+            try:
+                shard = self._open_shard(shard_dir)
+                shards[shard.name] = shard
+            except Exception as e:
+                logger.exception(f"Erreur lors du chargement du shard {entry}. Il sera reconstruit.")
+        self._publish(shards)
+        return bool(shards)
+
+    def refresh(self):
+        """Recharge les shards publiés sur disque par un autre processus (autre worker uvicorn).
+
+        Seuls les shards dont la génération active a changé sont rouverts. Renvoie True si un
+        nouvel instantané a été publié.
+        """
+        with self._write_lock:
+            shards = dict(self.snapshot.shards)
+            by_dir = {shard.shard_dir: name for name, shard in shards.items()}
+            on_disk = set()
+            changed = False
+            for entry in sorted(os.listdir(self.shard_cache_dir)):
+                shard_dir = os.path.join(self.shard_cache_dir, entry)
+                generation_dir = index_store.current_generation(shard_dir) if os.path.isdir(shard_dir) else None
+                if generation_dir is None:
+                    continue
+                on_disk.add(shard_dir)
+                current = shards.get(by_dir.get(shard_dir))
+                if current is not None and current.generation_id == os.path.basename(generation_dir):
+                    continue
+                try:
+                    shard = self._open_shard(shard_dir)
+                except Exception as e:
+                    logger.exception(f"Erreur lors du rechargement du shard {entry}.")
+                    continue
+                shards[shard.name] = shard
+                changed = True
+            for name in [name for name, shard in shards.items() if shard.generation_id and shard.shard_dir not in on_disk]:
+                del shards[name] # Shard supprimé par un autre processus
+                changed = True
+            if changed:
+                logger.info("Index modifié par un autre processus, rechargement du manifeste et des shards.")
+                self._load_manifest()
+                self._publish(shards)
+            return changed
+
+    def discover_files(self):
+        """Parcourt récursivement le dossier et renvoie {shard: [chemins relatifs des PDF]}."""
+        by_shard = {}
+        for dirpath, dirnames, filenames in os.walk(self.folder_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(".pdf"):
+                    continue
+                relpath = os.path.relpath(os.path.join(dirpath, filename), self.folder_path).replace(os.sep, "/")
+                by_shard.setdefault(shard_name_for(relpath), []).append(relpath)
+        return by_shard
+
+    def _relative_name(self, file_path):
+        """Chemin relatif au dossier indexé (nom de fichier seul si le fichier est en dehors)."""
+        abs_folder = os.path.abspath(self.folder_path)
+        abs_path = os.path.abspath(file_path)
+        if os.path.commonpath([abs_folder, abs_path]) == abs_folder:
+            return os.path.relpath(abs_path, abs_folder).replace(os.sep, "/")
+        return os.path.basename(file_path)
+
+    def _extract_many(self, paths, workers=None):
+        """Extrait une liste de PDF, en série ou via un pool de processus.
+
+        Renvoie une liste de pages extraites par fichier, dans le même ordre que `paths`, de sorte que le
+        résultat soit identique quel que soit le nombre de workers. Un fichier en échec
+        donne un contenu vide et n'interrompt pas le lot.
+        """
+        workers = self.workers if workers is None else workers
+        workers = max(1, min(workers or 1, len(paths) or 1))
+        contents = {}
 
-    def _save_cache(self):
-        logger.info(f"Sauvegarde de l'index dans le cache: {self.cache_path}")
+        if workers == 1:
+            for path in tqdm(paths, desc="📄 Indexation PDF (Complète)"):
+                _, contents[path], error = _extract_worker(path)
+                if error:
+                    logger.error(f"Échec de l'extraction de {os.path.basename(path)}: {error}")
+        else:
+            logger.info(f"Extraction parallèle de {len(paths)} fichiers avec {workers} processus.")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_extract_worker, path): path for path in paths}
+                progress = tqdm(as_completed(futures), total=len(futures), desc=f"📄 Indexation PDF ({workers} processus)")
+                for future in progress:
+                    path = futures[future]
+                    try:
+                        _, content, error = future.result()
+                    except Exception as e: # Processus tué, erreur de sérialisation...
+                        content, error = [], f"{type(e).__name__}: {e}"
+                    contents[path] = content
+                    if error:
+                        logger.error(f"Échec de l'extraction de {os.path.basename(path)}: {error}")
+                    else:
+                        logger.info(f"Extraction terminée pour {os.path.basename(path)} ({len(content)} pages).")
+        return [contents.get(path, []) for path in paths]
+
+    def _load_manifest(self):
         try:
-            with open(self.cache_path, 'wb') as f:
-                pickle.dump({
-                    'documents': self.documents,
-                    'texts': self.texts, # Sauvegarder texts pour reconstruire si vectorizer change
-                    'vectorizer_params': self.vectorizer.get_params(), # Sauvegarder les paramètres pour recréer
-                    'vectorizer_vocabulary': getattr(self.vectorizer, 'vocabulary_', None),
-                    'tfidf_matrix': self.tfidf_matrix
-                }, f)
-            logger.info("Cache sauvegardé avec succès.")
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+            logger.info(f"Manifeste chargé: {len(self.manifest)} fichiers suivis.")
+        except FileNotFoundError:
+            self.manifest = {}
         except Exception as e:
-            logger.exception(f"Erreur lors de la sauvegarde du cache dans {self.cache_path}")
+            logger.exception(f"Manifeste illisible ({self.manifest_path}). Il sera reconstruit.")
+            self.manifest = {}
 
-    def _load_cache(self):
-        logger.info(f"Chargement de l'index depuis le cache: {self.cache_path}")
+    def _save_manifest(self):
         try:
-            with open(self.cache_path, 'rb') as f:
-                data = pickle.load(f)
-                self.documents = data.get('documents', [])
-                self.texts = data.get('texts', [])
-                
-                vectorizer_params = data.get('vectorizer_params')
-                vocabulary = data.get('vectorizer_vocabulary')
-                self.tfidf_matrix = data.get('tfidf_matrix')
-
-                if vectorizer_params:
-                    self.vectorizer = TfidfVectorizer(**vectorizer_params)
-                    if self.texts and vocabulary is not None:
-                        # Si le vocabulaire est sauvegardé et qu'il y a des textes, on peut essayer de reconstruire
-                        # la matrice TF-IDF sans refaire fit_transform si les textes n'ont pas changé.
-                        # Cependant, pour la robustesse, il est plus simple de refaire fit_transform.
-                        self.vectorizer.vocabulary_ = vocabulary # Restaurer le vocabulaire
-                        if self.tfidf_matrix is not None and self.tfidf_matrix.shape[0] == len(self.texts):
-                             logger.info("Vectorizer et TF-IDF matrix chargés depuis le cache.")
-                        else:
-                            logger.info("Vocabulaire restauré, mais la matrice TF-IDF sera reconstruite.")
-                            self._rebuild_tfidf()
-                    elif self.texts:
-                         logger.info("Textes chargés, reconstruction de TF-IDF car vocabulaire non trouvé dans cache.")
-                         self._rebuild_tfidf()
-                    else:
-                        logger.info("Vectorizer chargé, mais pas de textes ou de vocabulaire pour construire TF-IDF.")
-                        self.tfidf_matrix = None
-                else:
-                    logger.warning("Paramètres du Vectorizer non trouvés dans le cache. Utilisation des valeurs par défaut.")
-                    self.vectorizer = TfidfVectorizer(max_df=0.85, min_df=2, stop_words=None, max_features=5000, ngram_range=(1, 2))
-                    self._rebuild_tfidf() # Reconstruire si les paramètres par défaut sont utilisés
+            _atomic_write(self.manifest_path, json.dumps(self.manifest, ensure_ascii=False, indent=1))
+        except Exception as e:
+            logger.exception(f"Erreur lors de la sauvegarde du manifeste {self.manifest_path}")
 
-                if not self.documents or not self.texts:
-                    logger.warning("Cache chargé mais documents ou textes vides. Une réindexation pourrait être nécessaire.")
-                else:
-                    logger.info(f"Cache chargé: {len(self.documents)} documents.")
+    def _fingerprint(self, path, filename):
+        """Renvoie l'entrée de manifeste du fichier. Le hash n'est recalculé que si taille ou mtime ont changé."""
+        stat = os.stat(path)
+        previous = self.manifest.get(filename)
+        if previous and previous.get('size') == stat.st_size and previous.get('modified_time') == stat.st_mtime:
+            return previous
+        return {'sha256': file_sha256(path), 'size': stat.st_size, 'modified_time': stat.st_mtime}
 
+    def _text_cache_file(self, sha256):
+        return os.path.join(self.text_cache_dir, f"{sha256}.x{EXTRACTOR_VERSION}.json")
+
+    def _read_cached_text(self, sha256):
+        """Renvoie la liste des pages extraites en cache pour cette empreinte, ou None."""
+        try:
+            with open(self._text_cache_file(sha256), 'r', encoding='utf-8') as f:
+                return json.load(f)
         except FileNotFoundError:
-            logger.error(f"Fichier cache {self.cache_path} non trouvé. L'indexation sera effectuée si des documents sont présents.")
+            return None
+        except ValueError:
+            logger.warning(f"Texte en cache illisible pour {sha256}, il sera ré-extrait.")
+            return None
+
+    def _write_cached_text(self, sha256, pages):
+        try:
+            _atomic_write(self._text_cache_file(sha256), json.dumps(pages, ensure_ascii=False))
         except Exception as e:
-            logger.exception(f"Erreur lors du chargement du cache depuis {self.cache_path}. Réinitialisation de l'index.")
-            self.documents = []
-            self.texts = []
-            self.vectorizer = TfidfVectorizer(max_df=0.85, min_df=2, stop_words=None, max_features=5000, ngram_range=(1, 2))
-            self.tfidf_matrix = None
-            # Ne pas appeler index_documents() ici, laisser l'init ou un appel explicite le faire.
+            logger.exception(f"Impossible d'écrire le texte extrait en cache pour {sha256}")
+        # Les termes et vecteurs en cache dérivent de l'ancien texte extrait
+        for cache_dir in (self.token_cache_dir, self.embedding_cache_dir):
+            for name in os.listdir(cache_dir):
+                if name.startswith(f"{sha256}."):
+                    os.remove(os.path.join(cache_dir, name))
 
-    def _check_for_updates(self): # Cette méthode devient moins pertinente avec l'ajout incrémental géré par l'application
-        logger.info("Vérification des mises à jour des fichiers PDF (fonctionnalité _check_for_updates)...")
-        # Cette logique devrait être revue si on veut un scan automatique en plus des ajouts/suppressions manuels.
-        # Pour l'instant, on se fie aux appels explicites à add_single_document ou index_documents.
-        pass
-
-    def search(self, query, top_k=5):
-        logger.debug(f"Recherche demandée pour la requête: '{query[:50]}...', top_k={top_k}")
-        if self.tfidf_matrix is None or self.tfidf_matrix.shape[0] == 0:
-            logger.warning("Matrice TF-IDF non initialisée ou vide. Recherche impossible. Documents: %s", len(self.documents))
-            # Optionnellement, tenter une réindexation si aucun document n'est chargé
-            if not self.documents and os.path.exists(self.folder_path) and os.listdir(self.folder_path):
-                logger.info("Tentative de réindexation car aucun document chargé et dossier non vide.")
-                self.index_documents()
-                if self.tfidf_matrix is None or self.tfidf_matrix.shape[0] == 0:
-                    return {"error": "TF-IDF non initialisée ou aucun document indexable trouvé après tentative de réindexation."}
-            else:
-                return {"error": "TF-IDF non initialisée ou aucun document indexable trouvé."}
-        
+    def _token_cache_file(self, sha256):
+        return os.path.join(self.token_cache_dir, f"{sha256}.{self.analyzer.version}.c{CHUNKER_VERSION}.json")
+
+    def _analyzed_tokens(self, sha256, chunks):
+        """Termes de chaque passage du document, lus en cache ou calculés par l'analyseur puis mis en cache."""
+        path = self._token_cache_file(sha256)
         try:
-            query_vec = self.vectorizer.transform([query])
-            similarities = cosine_similarity(query_vec, self.tfidf_matrix).flatten()
-            num_docs_available = self.tfidf_matrix.shape[0]
-            actual_top_k = min(top_k, num_docs_available)
-            # S'assurer que les indices sont valides pour self.documents
-            if actual_top_k > len(self.documents):
-                logger.error(f"Incohérence: actual_top_k ({actual_top_k}) > len(self.documents) ({len(self.documents)})")
-                actual_top_k = len(self.documents)
-            
-            ranked_indices = similarities.argsort()[::-1][:actual_top_k]
-            
-            results = []
-            for i in ranked_indices:
-                if i < len(self.documents) and similarities[i] > 0.01:
-                    results.append({
-                        'filename': self.documents[i]['filename'],
-                        'score': float(similarities[i])
-                    })
-                elif i >= len(self.documents):
-                    logger.warning(f"Indice {i} hors limites pour self.documents lors de la recherche.")
-            
+            with open(path, 'r', encoding='utf-8') as f:
+                tokens = json.load(f)
+            if len(tokens) == len(chunks):
+                return tokens
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logger.warning(f"Termes en cache illisibles pour {sha256}, ils seront recalculés.")
+        tokens = [self.analyzer(chunk['text']) for chunk in chunks]
+        try:
+            _atomic_write(path, json.dumps(tokens, ensure_ascii=False))
+        except Exception as e:
+            logger.exception(f"Impossible d'écrire les termes analysés en cache pour {sha256}")
+        return tokens
+
+    def _embedding_cache_file(self, sha256):
+        return os.path.join(self.embedding_cache_dir, f"{sha256}.{model_slug(self.dense_model)}.c{CHUNKER_VERSION}.npy")
+
+    def _chunk_embeddings(self, sha256, chunks):
+        """Vecteurs denses des passages du document, lus en cache ou calculés par lots puis mis en cache."""
+        path = self._embedding_cache_file(sha256)
+        try:
+            vectors = np.load(path)
+            if vectors.shape == (len(chunks), self.encoder.dim):
+                return vectors
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logger.warning(f"Vecteurs en cache illisibles pour {sha256}, ils seront recalculés.")
+        vectors = self.encoder.encode([chunk['text'] for chunk in chunks])
+        try:
+            tmp_path = f"{path}.tmp{os.getpid()}.npy"
+            np.save(tmp_path, vectors)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.exception(f"Impossible d'écrire les vecteurs denses en cache pour {sha256}")
+        return vectors
+
+    def _purge_text_cache(self):
+        """Supprime les textes, termes et vecteurs en cache qui ne correspondent plus à aucun fichier du manifeste."""
+        live = {entry['sha256'] for entry in self.manifest.values()}
+        for name in os.listdir(self.text_cache_dir):
+            sha256 = name.split(".", 1)[0]
+            # Y compris les anciens caches (texte non paginé, autre version d'extraction)
+            if sha256 not in live or os.path.join(self.text_cache_dir, name) != self._text_cache_file(sha256):
+                os.remove(os.path.join(self.text_cache_dir, name))
+        for name in os.listdir(self.token_cache_dir):
+            sha256 = name.split(".", 1)[0]
+            # Autre version d'analyseur ou de découpage: ces termes ne seront plus relus
+            if sha256 not in live or os.path.join(self.token_cache_dir, name) != self._token_cache_file(sha256):
+                os.remove(os.path.join(self.token_cache_dir, name))
+        for name in os.listdir(self.embedding_cache_dir):
+            sha256 = name.split(".", 1)[0]
+            # Autre modèle (ou recherche dense désactivée): ces vecteurs ne seront plus relus
+            if sha256 not in live or not self.encoder or os.path.join(self.embedding_cache_dir, name) != self._embedding_cache_file(sha256):
+                os.remove(os.path.join(self.embedding_cache_dir, name))
+
+    def _build_shard(self, name, relpaths, pages_by_file):
+        """Construit (et met en cache) le shard `name` à partir des pages déjà extraites."""
+        start_time = time.perf_counter()
+        shard = IndexShard(name, self._shard_cache_path(name), self.analyzer)
+        vectors = []
+        for relpath in relpaths:
+            sha256 = self.manifest[relpath]['sha256']
+            pages = pages_by_file.get(relpath)
+            if pages is None:
+                pages = self._read_cached_text(sha256) or []
+            chunks = chunk_pages(pages)
+            if chunks:
+                entry = self.manifest[relpath]
+                doc_index = shard.add_document(document_metadata(relpath, pages, entry['size'], entry['modified_time']))
+                first_chunk = len(shard.chunks)
+                for chunk in chunks:
+                    chunk['doc'] = doc_index
+                    shard.chunks.append(chunk)
+                shard.chunk_tokens.extend(self._analyzed_tokens(sha256, chunks))
+                if self.encoder:
+                    vectors.append(self._chunk_embeddings(sha256, chunks))
+                shard.index_articles(doc_index, first_chunk)
+            else:
+                logger.warning(f"Aucun contenu extrait de {relpath}.")
+        shard.rebuild()
+        if vectors:
+            shard.dense = VectorIndex.build(np.vstack(vectors), self.dense_model)
+        if shard.save():
+            # Recharger depuis le disque: passages et matrice en mmap plutôt qu'en mémoire
+            shard = self._open_shard(shard.shard_dir)
+        SHARD_BUILD_SECONDS.observe(time.perf_counter() - start_time)
+        return shard
+
+    def _drop_shard(self, shards, name):
+        shards.pop(name, None)
+        shutil.rmtree(self._shard_cache_path(name), ignore_errors=True)
+        logger.info(f"Shard '{name}' supprimé (plus aucun PDF dans ce dossier).")
+
+    def sync_documents(self, workers=None):
+        """Synchronisation incrémentale de l'index avec le dossier.
+
+        Compare taille/mtime puis empreinte SHA-256 de chaque PDF au manifeste persistant, et
+        ne ré-extrait que les fichiers nouveaux ou modifiés. Seuls les shards (sous-dossiers)
+        contenant un fichier nouveau, modifié ou supprimé sont reconstruits ; les textes des
+        fichiers inchangés proviennent du cache disque.
+        """
+        with self._write_lock:
+            shards = dict(self.snapshot.shards) # Copie de travail, publiée une fois complète
+            logger.info(f"Début de la synchronisation incrémentale des documents dans {self.folder_path}")
+            start_time_total = time.time()
+            files_by_shard = self.discover_files()
+
+            new_manifest = {}
+            pages_by_file = {}
+            to_extract = []
+            dirty_shards = set()
+            for shard_name, relpaths in files_by_shard.items():
+                for relpath in relpaths:
+                    path = os.path.join(self.folder_path, relpath)
+                    try:
+                        entry = self._fingerprint(path, relpath)
+                    except OSError as e:
+                        logger.error(f"Fichier illisible ignoré: {relpath} ({e})")
+                        continue
+                    new_manifest[relpath] = entry
+                    previous = self.manifest.get(relpath)
+                    if not previous or previous['sha256'] != entry['sha256']:
+                        dirty_shards.add(shard_name)
+                    pages = self._read_cached_text(entry['sha256'])
+                    if pages is None:
+                        to_extract.append(relpath)
+                        dirty_shards.add(shard_name) # Texte absent du cache ou d'une ancienne version d'extraction
+                    else:
+                        pages_by_file[relpath] = pages
+
+            deleted = set(self.manifest) - set(new_manifest)
+            dirty_shards.update(shard_name_for(relpath) for relpath in deleted)
+            # Shards absents du cache (premier démarrage, cache corrompu)
+            for shard_name in files_by_shard:
+                shard = shards.get(shard_name)
+                if shard is None or shard.tfidf_matrix is None or (self.encoder and shard.dense is None):
+                    dirty_shards.add(shard_name) # Y compris les shards sans vecteurs du modèle dense configuré
+            logger.info(f"Synchronisation: {len(to_extract)} fichiers à extraire, {len(deleted)} supprimés, shards à reconstruire: {sorted(dirty_shards)}")
+
+            if to_extract:
+                paths = [os.path.join(self.folder_path, relpath) for relpath in to_extract]
+                for relpath, pages in zip(to_extract, self._extract_many(paths, workers=workers)):
+                    pages_by_file[relpath] = pages
+                    # Les échecs (contenu vide) sont aussi mémorisés pour ne pas re-parser un PDF défectueux à chaque synchronisation
+                    self._write_cached_text(new_manifest[relpath]['sha256'], pages)
+
+            self.manifest = new_manifest
+            for shard_name in sorted(dirty_shards):
+                relpaths = [relpath for relpath in files_by_shard.get(shard_name, []) if relpath in new_manifest]
+                if relpaths:
+                    shards[shard_name] = self._build_shard(shard_name, relpaths, pages_by_file)
+                else:
+                    self._drop_shard(shards, shard_name)
+            for shard_name in set(shards) - set(files_by_shard):
+                self._drop_shard(shards, shard_name)
+            self._publish(shards)
+
+            if not dirty_shards:
+                logger.info("Aucun changement détecté, les index TF-IDF existants sont conservés.")
+            self._save_manifest()
+            self._purge_text_cache()
+            logger.info(f"Synchronisation terminée en {time.time() - start_time_total:.2f} secondes. {len(self.documents)} documents indexés dans {len(self.shards)} shards.")
+
+    def index_documents(self, workers=None):
+        with self._write_lock:
+            shards = dict(self.snapshot.shards) # Copie de travail, publiée une fois complète
+            logger.info(f"Début de l'indexation complète des documents dans {self.folder_path}")
+            start_time_total = time.time()
+            files_by_shard = self.discover_files()
+            files_to_index = [relpath for relpaths in files_by_shard.values() for relpath in relpaths]
+            logger.info(f"{len(files_to_index)} fichiers PDF trouvés pour l'indexation complète ({len(files_by_shard)} shards).")
+
+            paths = [os.path.join(self.folder_path, relpath) for relpath in files_to_index]
+            start_time_extraction = time.time()
+            contents = self._extract_many(paths, workers=workers)
+            logger.info(f"Extraction terminée en {time.time() - start_time_extraction:.2f} secondes.")
+
+            self.manifest = {}
+            pages_by_file = {}
+            for relpath, path, pages in zip(files_to_index, paths, contents):
+                entry = self._fingerprint(path, relpath)
+                self.manifest[relpath] = entry
+                self._write_cached_text(entry['sha256'], pages)
+                pages_by_file[relpath] = pages
+
+            for shard_name in set(shards) - set(files_by_shard):
+                self._drop_shard(shards, shard_name)
+            for shard_name, relpaths in files_by_shard.items():
+                shards[shard_name] = self._build_shard(shard_name, relpaths, pages_by_file)
+            self._publish(shards)
+            self._save_manifest()
+            self._purge_text_cache()
+            end_time_total = time.time()
+            logger.info(f"Indexation complète terminée en {end_time_total - start_time_total:.2f} secondes. {len(self.documents)} documents indexés.")
+
+    def add_single_document(self, file_path):
+        """Ajoute ou met à jour un seul document PDF. Seul le shard de son dossier est reconstruit."""
+        return self.add_documents([file_path])[file_path]
+
+    def add_documents(self, file_paths):
+        """Ajoute ou met à jour un lot de PDF en reconstruisant une seule fois chaque shard concerné.
+
+        Renvoie {chemin: bool} (False si aucun contenu n'a pu être extrait du fichier).
+        """
+        with self._write_lock:
+            shards = dict(self.snapshot.shards) # Copie de travail, publiée une fois complète
+            start_time = time.time()
+            results = {}
+            pages_by_shard = {} # {shard: {chemin relatif: pages}} des documents nouveaux ou modifiés
+            for file_path in file_paths:
+                filename = self._relative_name(file_path)
+                shard_name = shard_name_for(filename)
+                logger.info(f"Ajout/Mise à jour du document: {filename} (shard '{shard_name}')")
+                entry = self._fingerprint(file_path, filename)
+                previous = self.manifest.get(filename)
+                shard = shards.get(shard_name)
+                if previous and previous['sha256'] == entry['sha256'] and shard and filename in shard.doc_index:
+                    logger.info(f"Le document {filename} est inchangé (même empreinte). Aucune réindexation nécessaire.")
+                    self.manifest[filename] = entry
+                    results[file_path] = True
+                    continue
+
+                pages = self._read_cached_text(entry['sha256'])
+                if pages is None:
+                    pages = self._extract_text_and_tables(file_path)
+                    if pages:
+                        self._write_cached_text(entry['sha256'], pages)
+                if not any(pages):
+                    logger.warning(f"Aucun contenu extrait de {filename}. Le document ne sera pas ajouté/mis à jour.")
+                    results[file_path] = False
+                    continue
+                self.manifest[filename] = entry
+                pages_by_shard.setdefault(shard_name, {})[filename] = pages
+                results[file_path] = True
+
+            for shard_name, pages_by_file in pages_by_shard.items():
+                shard = shards.get(shard_name)
+                # Les pages des autres documents du shard sont relues depuis le cache de textes
+                relpaths = sorted(set(shard.doc_index) | set(pages_by_file)) if shard else sorted(pages_by_file)
+                shards[shard_name] = self._build_shard(shard_name, relpaths, pages_by_file) # Reconstruit TF-IDF du seul shard concerné
+            self._publish(shards)
+            self._save_manifest()
+            logger.info(f"{len(file_paths)} documents traités, shards reconstruits: {sorted(pages_by_shard)} en {time.time() - start_time:.2f} secondes.")
             return results
+
+    def remove_document(self, filename):
+        """Supprime un document de l'index (chemin relatif, ou nom de fichier s'il est unique)."""
+        with self._write_lock:
+            shards = dict(self.snapshot.shards) # Copie de travail, publiée une fois complète
+            logger.info(f"Tentative de suppression du document: {filename} de l'index.")
+            if filename not in self.manifest:
+                matches = [relpath for relpath in self.manifest if os.path.basename(relpath) == filename]
+                if len(matches) == 1:
+                    filename = matches[0]
+            shard_name = shard_name_for(filename)
+            shard = shards.get(shard_name)
+            if shard is None or filename not in shard.doc_index:
+                logger.warning(f"Document {filename} non trouvé dans l'index. Aucune action de suppression.")
+                return False
+
+            logger.info(f"Document {filename} trouvé et marqué pour suppression.")
+            self.manifest.pop(filename, None)
+            relpaths = sorted(relpath for relpath in shard.doc_index if relpath != filename)
+            if relpaths:
+                shards[shard_name] = self._build_shard(shard_name, relpaths, {})
+            else:
+                self._drop_shard(shards, shard_name)
+            self._publish(shards)
+            self._save_manifest()
+            self._purge_text_cache()
+            logger.info(f"Document {filename} supprimé de l'index et shard '{shard_name}' reconstruit.")
+            return True
+
+    def _check_for_updates(self):
+        logger.info("Vérification des mises à jour des fichiers PDF (fonctionnalité _check_for_updates)...")
+        self.sync_documents()
+
+    def search(self, query, top_k=5, ranker=None, snapshot=None, dense=None):
+        """Interroge chaque shard puis fusionne leurs top_k en un top_k global par score.
+
+        Les poids de la requête sont calculés avec les statistiques de tout le corpus (voir
+        _corpus_stats), ce qui rend comparables les scores de shards indexés séparément.
+
+        `ranker` ("tfidf" ou "bm25") remplace ponctuellement le classement par défaut de l'indexeur.
+        `snapshot` permet à l'appelant de relire les passages dans le même instantané que la recherche.
+        Si un modèle dense est configuré (et sauf dense=False), le classement lexical et le classement
+        dense sont fusionnés par rang (RRF) ; 'score' est alors le score RRF, et 'sparse_score' /
+        'dense_score' les scores de chaque classement (None si le passage n'y figure pas).
+        Le classement (identifiants et scores) est mémorisé par requête normalisée pour la version
+        de l'instantané : une question déjà posée ne refait ni la vectorisation ni le calcul de similarité.
+        """
+        ranker = ranker or self.ranker
+        snapshot = snapshot or self.snapshot
+        logger.debug(f"Recherche demandée pour la requête: '{query[:50]}...', top_k={top_k}, classement={ranker}")
+        if not snapshot.ready:
+            # Pas d'indexation dans le chemin de lecture: elle passe par la file d'indexation (verrou entre processus)
+            logger.warning("Aucun shard TF-IDF initialisé. Recherche impossible. Documents: %s", len(snapshot.documents))
+            return {"error": "Index non prêt: aucun document indexé pour le moment (indexation en cours ou dossier vide)."}
+
+        def result(shard_name, i, score, extra):
+            shard = snapshot.shards[shard_name]
+            chunk = shard.chunks[i]
+            document = shard.documents[chunk['doc']]
+            return {
+                'filename': document['filename'],
+                'shard': shard_name,
+                'doc': chunk['doc'], # Identifiants de ligne: document et passage dans le shard
+                'chunk': i,
+                'page': chunk['page'],
+                'offset': chunk['offset'],
+                'score': score,
+                'document': document, # Métadonnées calculées à l'indexation (aucun texte relu)
+                **extra,
+            }
+
+        try:
+            query_tokens = self.analyzer(query)
+            use_dense = self.encoder is not None and dense is not False
+            cache_key = None
+            if self.retrieval_cache is not None:
+                # Requête normalisée: termes analysés (seuls utilisés par TF-IDF/BM25), plus le texte pour l'embedding
+                cache_key = (ranker, top_k, use_dense, " ".join(query_tokens), " ".join(query.casefold().split()) if use_dense else "")
+                ranked = self.retrieval_cache.get(cache_key, generation=snapshot.version)
+                if ranked is not None:
+                    return [result(*entry) for entry in ranked]
+
+            if not use_dense:
+                corpus = self._corpus_stats(snapshot, query_tokens, ranker)
+                ranked = [(shard.name, i, score, {}) for shard in snapshot.shards.values()
+                          for i, score in shard.search(query, top_k, ranker=ranker, query_tokens=query_tokens, corpus=corpus)]
+                ranked.sort(key=lambda entry: entry[2], reverse=True)
+                ranked = ranked[:top_k]
+            else:
+                query_vector = self.encoder.encode_query(query)
+                pool = top_k * DENSE_POOL_FACTOR
+                sparse, dense_hits = {}, {}
+                corpus = self._corpus_stats(snapshot, query_tokens, ranker)
+                for shard in snapshot.shards.values():
+                    for i, score in shard.search(query, pool, ranker=ranker, query_tokens=query_tokens, corpus=corpus):
+                        sparse[(shard.name, i)] = score
+                    if shard.dense is not None:
+                        for i, score in shard.dense.search(query_vector, pool):
+                            dense_hits[(shard.name, i)] = score
+                rankings = [sorted(hits, key=hits.get, reverse=True)[:pool] for hits in (sparse, dense_hits)]
+                fused = reciprocal_rank_fusion(rankings)
+                ranked = [(shard_name, i, fused[(shard_name, i)], {'sparse_score': sparse.get((shard_name, i)), 'dense_score': dense_hits.get((shard_name, i))})
+                          for shard_name, i in sorted(fused, key=fused.get, reverse=True)[:top_k]]
+            if cache_key is not None:
+                self.retrieval_cache.set(cache_key, ranked, generation=snapshot.version)
+            return [result(*entry) for entry in ranked]
         except Exception as e:
             logger.exception(f"Erreur lors de la recherche pour la requête: {query}")
             return {"error": f"Erreur lors de la recherche: {str(e)}"}
 
-    def get_relevant_context(self, query, top_k=3):
+    def _corpus_stats(self, snapshot, query_tokens, ranker):
+        """(nombre de passages, {terme: fréquence documentaire}) des termes de la requête sur tous les shards.
+
+        Chaque shard a son propre vocabulaire et ses propres IDF ; les scores ne sont comparables
+        d'un shard à l'autre que si la requête est pondérée avec les mêmes statistiques partout.
+        """
+        terms = query_terms(query_tokens, ranker)
+        n_docs, frequencies = 0, Counter()
+        for shard in snapshot.shards.values():
+            if shard.postings is not None:
+                n_docs += len(shard.chunks)
+                frequencies.update(shard.document_frequencies(terms, ranker))
+        return n_docs, frequencies
+
+    def lookup_article(self, query, context_char_limit=4000):
+        """Contexte direct pour une question qui cite un article ("article 12 du code du travail").
+
+        Consulte l'index (document, article) construit à l'indexation, sans passer par la
+        similarité TF-IDF. Renvoie une chaîne vide si la question ne cite pas d'article ou si
+        aucun document correspondant ne contient cet article.
+        """
+        return assemble_context(self._article_passages(self.snapshot, query), context_char_limit)[0]
+
+    def get_relevant_context(self, query, top_k=8):
+        """Assemble les meilleurs passages dans la limite de 4000 caractères, par score décroissant."""
+        return assemble_context(self._search_passages(self.snapshot, query, top_k))[0]
+
+    def retrieve_passages(self, query, top_k=8):
+        """Passages pour le LLM (article cité, sinon recherche), sans limite de taille.
+
+        Renvoie ([{"source", "text", "ids"}] par pertinence décroissante, version de l'instantané).
+        Le découpage au budget de tokens du modèle est fait par prompt_builder.
+        """
+        snapshot = self.snapshot
+        with span("index.articles"):
+            passages = self._article_passages(snapshot, query)
+        if not passages:
+            with span("index.search"):
+                passages = self._search_passages(snapshot, query, top_k)
+        return passages, snapshot.version
+
+    def retrieve_context(self, query, top_k=8):
+        """Contexte pour le LLM (article cité, sinon recherche) et identifiants des passages utilisés.
+
+        Renvoie (contexte, [identifiants "shard:passage"], version de l'instantané). Les
+        identifiants ne sont comparables qu'à version égale ; la version est la même dans tous
+        les processus qui servent le même index (caches partagés entre workers).
+        """
+        passages, version = self.retrieve_passages(query, top_k)
+        context, passage_ids = assemble_context(passages)
+        return context, passage_ids, version
+
+    def _article_passages(self, snapshot, query):
+        """Passages de l'article cité dans la question (liste vide si aucun article cité ou trouvé)."""
+        reference = parse_article_reference(query)
+        if not reference:
+            return []
+        key, code_phrase = reference
+        matches = []
+        for shard in snapshot.shards.values():
+            for overlap, filename, chunk_indices in shard.articles.lookup(key, code_phrase):
+                matches.append((overlap, filename, shard, chunk_indices))
+        if not matches:
+            logger.info(f"Article {key} ('{code_phrase}') introuvable dans l'index des articles.")
+            return []
+        best = max(overlap for overlap, _, _, _ in matches)
+
+        passages = []
+        for overlap, filename, shard, chunk_indices in matches:
+            if overlap < best:
+                continue
+            passages.append({
+                'source': f"Source: {filename}, page {shard.chunks[chunk_indices[0]]['page']} (Article {key})",
+                'text': "\n".join(shard.chunks[i]['text'] for i in chunk_indices),
+                'ids': [f"{shard.name}:{i}" for i in chunk_indices],
+            })
+        logger.info(f"Article {key} ('{code_phrase}') trouvé directement dans l'index des articles.")
+        return passages
+
+    def _search_passages(self, snapshot, query, top_k):
         logger.debug(f"Obtention du contexte pertinent pour la requête: '{query[:50]}...', top_k={top_k}")
-        results = self.search(query, top_k=top_k)
-        
+        results = self.search(query, top_k=top_k, snapshot=snapshot) # Passages relus dans l'instantané qui a servi à la recherche
+
         if isinstance(results, dict) and "error" in results:
             logger.error(f"Erreur lors de la recherche de documents pour le contexte: {results['error']}")
-            return ""
+            return []
         if not results:
             logger.info(f"Aucun document pertinent trouvé pour la requête: '{query[:50]}...' lors de la recherche de contexte.")
-            return ""
-
-        context = ""
-        chars_per_doc_limit = 1500 
-        total_context_char_limit = 4000
+            return []
 
+        passages = []
         for result in results:
-            if len(context) >= total_context_char_limit: break
             try:
-                doc_content = next((doc['text'] for doc in self.documents if doc['filename'] == result['filename']), None)
-                if doc_content:
-                    context_to_add = f"\n--- Source: {result['filename']} (Score: {result['score']:.4f}) ---\n"
-                    remaining_chars_for_doc = chars_per_doc_limit
-                    remaining_total_chars = total_context_char_limit - len(context) - len(context_to_add)
-                    chars_to_take_from_doc = min(len(doc_content), remaining_chars_for_doc, remaining_total_chars)
-                    if chars_to_take_from_doc > 0:
-                        context_to_add += doc_content[:chars_to_take_from_doc]
-                        context += context_to_add
+                shard = snapshot.shards.get(result['shard'])
+                passage = shard.chunks[result['chunk']]['text'] if shard and result['chunk'] < len(shard.chunks) else None
+                if passage:
+                    passages.append({
+                        'source': f"Source: {result['filename']} ({result['document']['code']}), page {result['page']} (Score: {result['score']:.4f})",
+                        'text': passage,
+                        'ids': [f"{result['shard']}:{result['chunk']}"],
+                    })
             except Exception as e:
                 logger.exception(f"Erreur lors de la construction du contexte pour {result['filename']}.")
-        return context.strip()
-
+        return passages
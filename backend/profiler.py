@@ -0,0 +1,116 @@
+"""
+Profileur par échantillonnage, déclenché à la demande (endpoint d'administration /admin/profile).
+
+Un thread relève toutes les `interval` secondes la pile de chaque thread du processus
+(sys._current_frames), sans instrumenter le code : le coût est borné par la fréquence
+d'échantillonnage et nul en dehors d'un profilage. Le profilage s'arrête après `seconds`
+secondes ou après `requests` requêtes terminées (le premier atteint), puis écrit :
+- `<nom>.folded`: piles repliées ("module:fonction;...;module:fonction nombre"), lisibles par
+  flamegraph.pl ou speedscope ;
+- `<nom>.txt`: fonctions les plus présentes (en propre et en cumulé).
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 64
+TOP_FUNCTIONS = 30
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}" # Sans numéro de ligne: une entrée par fonction
+
+class SamplingProfiler:
+    def __init__(self, output_dir="profiles"):
+        self.output_dir = output_dir
+        self.running = False
+        self.last_result = None # Résumé du dernier profilage terminé
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stacks = Counter()
+        self._remaining_requests = None
+        self._info = {}
+
+    def start(self, seconds=30.0, requests=None, interval=0.005):
+        """Démarre un profilage. Renvoie False si un profilage est déjà en cours."""
+        with self._lock:
+            if self.running:
+                return False
+            self.running = True
+            self._stop.clear()
+            self._stacks = Counter()
+            self._remaining_requests = requests
+            self._info = {'seconds': seconds, 'requests': requests, 'interval': interval, 'started_at': time.time()}
+            self._thread = threading.Thread(target=self._run, args=(seconds, interval), name="sampling-profiler", daemon=True)
+            self._thread.start()
+        logger.info(f"Profilage démarré (au plus {seconds} s{f' ou {requests} requêtes' if requests else ''}, échantillon toutes les {interval * 1000:.0f} ms).")
+        return True
+
+    def request_finished(self):
+        """Appelé à la fin de chaque requête: arrête le profilage après le nombre de requêtes demandé."""
+        if not self.running or self._remaining_requests is None:
+            return
+        with self._lock:
+            if self._remaining_requests is not None:
+                self._remaining_requests -= 1
+                if self._remaining_requests <= 0:
+                    self._stop.set()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, seconds, interval):
+        deadline = time.monotonic() + seconds
+        own_id = threading.get_ident()
+        samples = 0
+        try:
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                        stack.append(_frame_label(frame))
+                        frame = frame.f_back
+                    self._stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                self._stop.wait(interval)
+            self.last_result = self._write(samples)
+        except Exception:
+            logger.exception("Erreur pendant le profilage.")
+        finally:
+            with self._lock:
+                self.running = False
+
+    def _write(self, samples):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, time.strftime("profile-%Y%m%d-%H%M%S"))
+        with open(f"{base}.folded", 'w', encoding='utf-8') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        own, cumulative = Counter(), Counter()
+        total = sum(self._stacks.values())
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                cumulative[label] += count
+        top = [{'function': label, 'self': count / total, 'cumulative': cumulative[label] / total}
+               for label, count in own.most_common(TOP_FUNCTIONS)] if total else []
+        with open(f"{base}.txt", 'w', encoding='utf-8') as f:
+            f.write(f"{samples} échantillons, {total} piles (tous threads)\n\n  propre  cumulé  fonction\n")
+            for entry in top:
+                f.write(f"{entry['self'] * 100:7.1f}% {entry['cumulative'] * 100:6.1f}%  {entry['function']}\n")
+        result = dict(self._info, finished_at=time.time(), samples=samples, folded=f"{base}.folded", report=f"{base}.txt", top=top[:10])
+        logger.info(f"Profilage terminé: {samples} échantillons, résultats dans {base}.folded et {base}.txt")
+        return result
+
+    def status(self):
+        return {'running': self.running, 'current': self._info if self.running else None, 'last_result': self.last_result}
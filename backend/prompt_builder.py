@@ -0,0 +1,147 @@
+"""
+Assemblage du prompt envoyé à Groq dans un budget de tokens, au lieu de limites en caractères.
+
+Les tokens sont comptés avec tiktoken (encodage BPE proche de celui des modèles Llama 3 servis par
+Groq). Si l'encodage n'est pas disponible localement (pas de cache tiktoken, pas d'accès réseau),
+le nombre de tokens est estimé par script : l'arabe produit nettement plus de tokens par caractère
+que le français.
+
+Priorités, dans le budget du modèle : prompt système (et résumé de l'historique) et question
+courante toujours inclus ; passages du contexte juridique par ordre de pertinence, le dernier
+éventuellement tronqué ; puis les tours précédents, du plus récent au plus ancien. Une part du
+budget (history_share) reste réservée à l'historique s'il en a besoin.
+"""
+import re
+import math
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Fenêtre de contexte (tokens) des modèles Groq
+MODEL_CONTEXT_WINDOWS = {
+    "llama-3.3-70b-versatile": 131072,
+    "llama-3.1-8b-instant": 131072,
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "gemma2-9b-it": 8192,
+    "mixtral-8x7b-32768": 32768,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+MESSAGE_OVERHEAD_TOKENS = 4 # Rôle et séparateurs ajoutés par le format de chat
+MIN_PASSAGE_TOKENS = 50     # En dessous, un passage tronqué n'apporte plus rien
+
+_ARABIC_CHAR = re.compile(r"[\u0600-\u06ff\u0750-\u077f\u08a0-\u08ff]")
+
+def estimate_tokens(text):
+    """Estimation sans tokenizer: ~4 caractères par token en français, ~2,5 en arabe."""
+    arabic = len(_ARABIC_CHAR.findall(text))
+    return math.ceil((len(text) - arabic) / 4 + arabic / 2.5)
+
+def prompt_budget(model, max_completion_tokens, cap=None):
+    """Tokens disponibles pour le prompt: fenêtre du modèle moins la réponse, plafonnés par cap."""
+    budget = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW) - max_completion_tokens
+    return min(budget, cap) if cap else budget
+
+class TokenCounter:
+    def __init__(self, encoding_name="cl100k_base"):
+        self.encoding_name = encoding_name
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logger.warning(f"Encodage tiktoken '{encoding_name}' indisponible ({e}). Nombre de tokens estimé.")
+        self.exact = self.encoding is not None
+        logger.info(f"Comptage des tokens: {'tiktoken ' + encoding_name if self.exact else 'estimation'}.")
+
+    def __call__(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return estimate_tokens(text)
+
+    def truncate(self, text, max_tokens):
+        """Début de text tenant en max_tokens tokens."""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+        count = estimate_tokens(text)
+        while count > max_tokens and text:
+            text = text[:max(0, int(len(text) * max_tokens / count) - 1)]
+            count = estimate_tokens(text)
+        return text
+
+class PromptBuilder:
+    def __init__(self, count_tokens, budget, history_share=0.3):
+        self.count_tokens = count_tokens # TokenCounter (ou fonction texte -> nombre de tokens)
+        self.budget = budget
+        self.history_share = history_share
+
+    def message_tokens(self, message):
+        return self.count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def _select_passages(self, passages, context_budget):
+        """Renvoie (blocs de contexte, tokens utilisés, dernier passage tronqué)."""
+        blocks, used, truncated = [], 0, False
+        for passage in passages:
+            header = f"\n--- {passage['source']} ---\n"
+            cost = self.count_tokens(header + passage['text'])
+            if used + cost > context_budget:
+                room = context_budget - used - self.count_tokens(header)
+                if room >= MIN_PASSAGE_TOKENS and hasattr(self.count_tokens, "truncate"):
+                    block = header + self.count_tokens.truncate(passage['text'], room)
+                    blocks.append(block)
+                    used += self.count_tokens(block)
+                    truncated = True
+                break
+            blocks.append(header + passage['text'])
+            used += cost
+        return blocks, used, truncated
+
+    def build(self, system, history, render_question, passages):
+        """Assemble les messages dans le budget.
+
+        system: messages système toujours inclus (prompt, résumé de l'historique) ; history: tours
+        précédents, sans la question courante ; render_question(contexte) -> contenu du message
+        utilisateur final ; passages: [{"source", "text"}] par pertinence décroissante.
+        Renvoie (messages, rapport de répartition des tokens).
+        """
+        system_tokens = sum(self.message_tokens(message) for message in system)
+        wrapper_tokens = self.message_tokens({"content": render_question(" ")})
+        remaining = max(0, self.budget - system_tokens - wrapper_tokens)
+        history_tokens = [self.message_tokens(message) for message in history]
+        history_reserve = min(sum(history_tokens), int(remaining * self.history_share))
+
+        blocks, context_tokens, truncated = self._select_passages(passages, remaining - history_reserve)
+        question = {"role": "user", "content": render_question("".join(blocks).strip())}
+        question_tokens = self.message_tokens(question)
+        used = system_tokens + question_tokens
+
+        # Tours précédents, du plus récent au plus ancien, dans ce qui reste du budget
+        kept = 0
+        history_used = 0
+        for cost in reversed(history_tokens):
+            if used + history_used + cost > self.budget:
+                break
+            history_used += cost
+            kept += 1
+        messages = list(system) + list(history[len(history) - kept:]) + [question]
+        report = {
+            'budget': self.budget,
+            'total': used + history_used,
+            'system': system_tokens,
+            'history': history_used,
+            'context': context_tokens,
+            'question': question_tokens - context_tokens, # Question et consignes autour du contexte
+            'history_messages': kept,
+            'history_dropped': len(history) - kept,
+            'passages': len(blocks),
+            'passages_available': len(passages),
+            'passages_truncated': truncated,
+            'exact': getattr(self.count_tokens, "exact", False), # False: nombre de tokens estimé
+        }
+        return messages, report
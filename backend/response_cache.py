@@ -0,0 +1,117 @@
+"""
+Cache LRU borné en nombre d'entrées et en octets, avec durée de vie par entrée.
+
+get/set/éviction sont en O(1) (OrderedDict: l'entrée la moins récemment utilisée est en tête).
+Le cache est lié à une génération de l'index (IndexSnapshot.generation) : dès qu'une lecture ou
+une écriture arrive avec une autre génération, toutes les entrées sont invalidées, puisqu'elles
+ont été calculées sur un corpus qui a changé.
+"""
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def approximate_size(value):
+    """Taille approximative en octets d'une valeur mise en cache (texte compté en UTF-8)."""
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(approximate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+class LRUCache:
+    def __init__(self, name, max_entries=500, max_bytes=16 * 1024 * 1024, ttl=3600.0):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl # Durée de vie par défaut (secondes), None = pas d'expiration
+        self._entries = OrderedDict() # {clé: (valeur, taille, expiration)}
+        self._lock = threading.Lock()
+        self.generation = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        logger.info(f"Cache '{name}' initialisé: {max_entries} entrées, {max_bytes} octets, TTL {ttl}s.")
+
+    def _check_generation(self, generation):
+        if generation is not None and generation != self.generation:
+            if self._entries:
+                logger.info(f"Cache '{self.name}': génération d'index {self.generation} -> {generation}, {len(self._entries)} entrées invalidées.")
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self.bytes = 0
+            self.generation = generation
+
+    def _pop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key, generation=None):
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, _, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None, ttl=None):
+        size = approximate_size(key) + approximate_size(value)
+        if size > self.max_bytes:
+            logger.warning(f"Cache '{self.name}': entrée de {size} octets ignorée (budget {self.max_bytes}).")
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._check_generation(generation)
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, size, expires_at)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._pop(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+        logger.info(f"Cache '{self.name}' vidé.")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'generation': self.generation,
+        }
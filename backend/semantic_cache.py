@@ -0,0 +1,156 @@
+"""
+Cache de réponses de second niveau, indépendant de l'historique de la conversation.
+
+Une réponse est retrouvée si la question porte sur les mêmes passages de l'index (identifiants
+des passages retenus pour le contexte) et si ses termes normalisés (voir text_analysis) sont assez
+proches d'une question déjà posée (similarité de Jaccard >= seuil). Deux reformulations d'une
+même question FAQ partagent ainsi la réponse générée par Groq pour la première.
+
+Le normaliseur garde les mots vides: négations et prépositions ("sans"/"avec", "ne ... pas",
+"قبل"/"بعد") changent la réponse juridique. Les termes de guard_terms (voir
+text_analysis.POLARITY_TERMS) doivent en outre être identiques dans les deux questions, quelle
+que soit la similarité du reste.
+
+Avec un stockage partagé (voir shared_store), les groupes de questions sont stockés hors du
+processus et profitent à tous les workers ; max_size borne alors le nombre de groupes de passages.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def similarity(a, b, guard_terms=frozenset()):
+    """Jaccard de deux ensembles de termes, 0 s'ils diffèrent sur un terme de guard_terms."""
+    if (a & guard_terms) != (b & guard_terms):
+        return 0.0
+    return jaccard(a, b)
+
+class SemanticResponseCache:
+    PRUNE_EVERY = 20 # Stockage partagé: vérification de la taille toutes les N écritures
+
+    def __init__(self, normalizer, max_size=500, threshold=0.8, store=None, name="sémantique", guard_terms=frozenset()):
+        self.normalizer = normalizer # Texte -> liste de termes (analyseur sans suppression des mots vides)
+        self.guard_terms = frozenset(guard_terms)
+        self.max_size = max_size
+        self.threshold = threshold
+        self.entries = OrderedDict() # {(génération, langue, passages): [(termes, réponse)]}, ordre LRU
+        self.size = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.store = store # SQLiteStore/MemoryStore partagé, ou None (dictionnaire du processus)
+        self.name = name   # Espace de noms dans le stockage partagé
+        self._writes = 0
+        self._lock = threading.Lock()
+        logger.info(f"Cache sémantique initialisé (taille maximale {max_size}, seuil de similarité {threshold}).")
+
+    def _key(self, passage_ids, generation, language):
+        return (generation, language, frozenset(passage_ids))
+
+    def _store_key(self, passage_ids, generation, language):
+        # Version du normaliseur dans la clé: les termes enregistrés par un autre normaliseur ne sont pas comparables
+        version = getattr(self.normalizer, "version", "")
+        return hashlib.sha256(f"{version}|{generation}|{language}|{','.join(sorted(passage_ids))}".encode("utf-8")).hexdigest()
+
+    def _check_generation(self, generation):
+        # Les identifiants de passages d'une ancienne génération ne seront plus jamais demandés
+        if generation != self.generation:
+            self.entries.clear()
+            self.size = 0
+            self.generation = generation
+
+    def get(self, query, passage_ids, generation, language):
+        """Renvoie la réponse d'une question proche portant sur les mêmes passages, ou None."""
+        if not passage_ids:
+            return None
+        terms = frozenset(self.normalizer(query))
+        if self.store is not None:
+            return self._shared_get(terms, passage_ids, generation, language)
+        key = self._key(passage_ids, generation, language)
+        with self._lock:
+            self._check_generation(generation)
+            best, best_score = None, 0.0
+            for cached_terms, response in self.entries.get(key, ()):
+                score = similarity(terms, cached_terms, self.guard_terms)
+                if score > best_score:
+                    best, best_score = response, score
+            if best is not None and best_score >= self.threshold:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                logger.info(f"Cache sémantique HIT (similarité {best_score:.2f}).")
+                return best
+            self.misses += 1
+        return None
+
+    def set(self, query, passage_ids, generation, language, response):
+        if not passage_ids or not response:
+            return
+        terms = frozenset(self.normalizer(query))
+        if self.store is not None:
+            self._shared_set(terms, passage_ids, generation, language, response)
+            return
+        key = self._key(passage_ids, generation, language)
+        with self._lock:
+            self._check_generation(generation)
+            bucket = self.entries.setdefault(key, [])
+            if any(cached_terms == terms for cached_terms, _ in bucket):
+                return
+            bucket.append((terms, response))
+            self.entries.move_to_end(key)
+            self.size += 1
+            while self.size > self.max_size and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _shared_get(self, terms, passage_ids, generation, language):
+        # Les groupes d'une autre version de l'index ne sont jamais relus, l'éviction LRU les supprime
+        bucket = self.store.get(self.name, self._store_key(passage_ids, generation, language), generation=generation) or []
+        best, best_score = None, 0.0
+        for cached_terms, response in bucket:
+            score = similarity(terms, frozenset(cached_terms), self.guard_terms)
+            if score > best_score:
+                best, best_score = response, score
+        with self._lock: # Compteurs du processus: pas d'écriture dans le stockage à chaque lecture
+            if best is not None and best_score >= self.threshold:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if best is not None and best_score >= self.threshold:
+            logger.info(f"Cache sémantique partagé HIT (similarité {best_score:.2f}).")
+            return best
+        return None
+
+    def _shared_set(self, terms, passage_ids, generation, language, response):
+        key = self._store_key(passage_ids, generation, language)
+        bucket = self.store.get(self.name, key, generation=generation, touch=False) or []
+        if any(frozenset(cached_terms) == terms for cached_terms, _ in bucket):
+            return
+        bucket.append([sorted(terms), response])
+        self.store.set(self.name, key, bucket, generation=generation)
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            self.store.prune(self.name, max_entries=self.max_size)
+
+    def clear(self):
+        if self.store is not None:
+            self.store.clear(self.name)
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+        logger.info("Cache sémantique vidé.")
+
+    def stats(self):
+        if self.store is not None:
+            hits, misses = self.hits, self.misses
+            return {'size': self.store.usage(self.name)[0], 'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else None, 'shared': True}
+        lookups = self.hits + self.misses
+        return {'size': self.size, 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else None}
@@ -0,0 +1,285 @@
+"""
+Stockage partagé entre workers uvicorn (caches de réponses, état des conversations).
+
+SQLiteStore est un magasin clé/valeur par espace de noms dans un fichier SQLite en mode WAL :
+aucun service externe, lectures concurrentes sans blocage et écritures sérialisées par SQLite.
+Tous les processus qui ouvrent le même fichier voient les mêmes entrées ; ajouter des workers
+augmente donc le taux de succès des caches au lieu de le diviser. MemoryStore offre la même
+interface dans le processus (un seul worker, tests).
+
+Les valeurs sont sérialisées en JSON. Chaque entrée porte une expiration optionnelle, la version
+de l'index sur laquelle elle a été calculée (optionnelle) et sa date de dernier accès (éviction LRU).
+"""
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from response_cache import approximate_size
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    generation, -- Version de l'index (sans affinité de type: entier ou texte)
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+class SQLiteStore:
+    def __init__(self, path, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local() # Une connexion par thread (les connexions sqlite3 ne se partagent pas)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+        logger.info(f"Stockage partagé SQLite ouvert: {path}")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")   # Lecteurs et écrivain ne se bloquent pas
+            conn.execute("PRAGMA synchronous=NORMAL") # Suffisant pour un cache (pas de fsync à chaque écriture)
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key, generation=None, touch=True):
+        """Renvoie la valeur (désérialisée) ou None si absente, expirée ou d'une autre génération."""
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, expires_at, generation FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at, entry_generation = row
+        now = time.time()
+        if (expires_at is not None and expires_at <= now) or (generation is not None and entry_generation != generation):
+            return None
+        if touch:
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+        return json.loads(value)
+
+    def set(self, namespace, key, value, ttl=None, generation=None):
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, size, expires_at, generation, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (namespace, key, data, approximate_size(key) + len(data.encode("utf-8")), now + ttl if ttl else None, generation, now),
+        )
+
+    def delete(self, namespace, key):
+        self._connection().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace):
+        self._connection().execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+    def keys(self, namespace):
+        return [row[0] for row in self._connection().execute("SELECT key FROM entries WHERE namespace = ?", (namespace,))]
+
+    def usage(self, namespace):
+        """Renvoie (nombre d'entrées, octets) de l'espace de noms."""
+        count, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return count, size
+
+    def prune(self, namespace, max_entries=None, max_bytes=None):
+        """Supprime les entrées expirées puis les moins récemment utilisées au-delà des limites. Renvoie le nombre d'évictions."""
+        conn = self._connection()
+        conn.execute("DELETE FROM entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?", (namespace, time.time()))
+        evicted = 0
+        count, size = self.usage(namespace)
+        if max_entries is not None and count > max_entries:
+            evicted += conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key IN "
+                "(SELECT key FROM entries WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                (namespace, namespace, count - max_entries),
+            ).rowcount
+            count, size = self.usage(namespace)
+        while max_bytes is not None and size > max_bytes and count:
+            evicted += conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key IN "
+                "(SELECT key FROM entries WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                (namespace, namespace, max(1, count // 10)),
+            ).rowcount
+            count, size = self.usage(namespace)
+        return evicted
+
+    def incr(self, name, amount=1):
+        self._connection().execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def counter(self, name):
+        row = self._connection().execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+
+class MemoryStore:
+    """Équivalent en mémoire de SQLiteStore, propre au processus."""
+
+    def __init__(self):
+        self._entries = {} # {espace de noms: {clé: (valeur JSON, taille, expiration, génération, dernier accès)}}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key, generation=None, touch=True):
+        with self._lock:
+            entry = self._entries.get(namespace, {}).get(key)
+            if entry is None:
+                return None
+            value, size, expires_at, entry_generation, _ = entry
+            now = time.time()
+            if (expires_at is not None and expires_at <= now) or (generation is not None and entry_generation != generation):
+                return None
+            if touch:
+                self._entries[namespace][key] = (value, size, expires_at, entry_generation, now)
+            return json.loads(value)
+
+    def set(self, namespace, key, value, ttl=None, generation=None):
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._entries.setdefault(namespace, {})[key] = (data, approximate_size(key) + len(data.encode("utf-8")), now + ttl if ttl else None, generation, now)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._entries.get(namespace, {}).pop(key, None)
+
+    def clear(self, namespace):
+        with self._lock:
+            self._entries.pop(namespace, None)
+
+    def keys(self, namespace):
+        with self._lock:
+            return list(self._entries.get(namespace, {}))
+
+    def usage(self, namespace):
+        with self._lock:
+            entries = self._entries.get(namespace, {})
+            return len(entries), sum(entry[1] for entry in entries.values())
+
+    def prune(self, namespace, max_entries=None, max_bytes=None):
+        with self._lock:
+            entries = self._entries.get(namespace, {})
+            now = time.time()
+            for key in [key for key, entry in entries.items() if entry[2] is not None and entry[2] <= now]:
+                del entries[key]
+            evicted = 0
+            by_age = sorted(entries, key=lambda key: entries[key][4])
+            size = sum(entry[1] for entry in entries.values())
+            while by_age and ((max_entries is not None and len(entries) > max_entries) or (max_bytes is not None and size > max_bytes)):
+                key = by_age.pop(0)
+                size -= entries.pop(key)[1]
+                evicted += 1
+            return evicted
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+def open_store(url):
+    """'memory' -> MemoryStore, 'sqlite:<chemin>' (ou un chemin) -> SQLiteStore."""
+    if url == "memory":
+        return MemoryStore()
+    return SQLiteStore(url[len("sqlite:"):] if url.startswith("sqlite:") else url)
+
+class SharedLRUCache:
+    """Cache de réponses stocké dans un SQLiteStore/MemoryStore, même interface que LRUCache.
+
+    Les clés sont hachées (SHA-256) ; les limites (entrées, octets) valent pour l'ensemble des
+    processus qui partagent le stockage. Les compteurs de succès/échecs sont propres au processus :
+    les tenir dans le stockage coûterait une écriture de plus à chaque lecture. Contrairement à LRUCache, un changement
+    de version de l'index ne vide pas le cache : les workers ne rechargent pas l'index au même
+    instant, une entrée n'est donc servie qu'à la version qui l'a produite et les entrées
+    d'anciennes versions disparaissent par éviction LRU ou expiration.
+    """
+
+    PRUNE_EVERY = 20 # Vérification des limites toutes les N écritures de ce processus
+
+    def __init__(self, store, name, max_entries=500, max_bytes=16 * 1024 * 1024, ttl=3600.0):
+        self.store = store
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation = None # Dernière version de l'index vue par ce processus
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        logger.info(f"Cache partagé '{name}' initialisé: {max_entries} entrées, {max_bytes} octets, TTL {ttl}s.")
+
+    def _key(self, key):
+        return hashlib.sha256((key if isinstance(key, str) else repr(key)).encode("utf-8")).hexdigest()
+
+    def get(self, key, generation=None):
+        if generation is not None:
+            self.generation = generation
+        value = self.store.get(self.name, self._key(key), generation=generation)
+        with self._lock:
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return value
+
+    def set(self, key, value, generation=None, ttl=None):
+        size = approximate_size(key) + approximate_size(value)
+        if size > self.max_bytes:
+            logger.warning(f"Cache partagé '{self.name}': entrée de {size} octets ignorée (budget {self.max_bytes}).")
+            return
+        if generation is not None:
+            self.generation = generation
+        ttl = self.ttl if ttl is None else ttl
+        self.store.set(self.name, self._key(key), value, ttl=ttl, generation=generation)
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            evicted = self.store.prune(self.name, self.max_entries, self.max_bytes)
+            if evicted:
+                with self._lock:
+                    self.evictions += evicted
+
+    def clear(self):
+        self.store.clear(self.name)
+        logger.info(f"Cache partagé '{self.name}' vidé.")
+
+    def __len__(self):
+        return self.store.usage(self.name)[0]
+
+    def stats(self):
+        entries, size = self.store.usage(self.name)
+        hits, misses = self.hits, self.misses
+        return {
+            'entries': entries,
+            'bytes': size,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+            'evictions': self.evictions,
+            'generation': self.generation,
+            'shared': True,
+        }
@@ -0,0 +1,18 @@
+from pdf_indexer import chunk_pages
+
+ARTICLE = "Article 5 - La durée normale du travail effectif ne peut excéder quarante-huit heures par semaine."
+
+def test_page_number_merged_into_next_passage():
+    chunks = chunk_pages(["12\n\n" + ARTICLE])
+    assert [chunk['text'] for chunk in chunks] == ["12\n\n" + ARTICLE]
+    assert chunks[0]['offset'] == 0
+
+def test_short_footer_merged_into_previous_passage():
+    chunks = chunk_pages([ARTICLE + "\n\n- 3 -"])
+    assert len(chunks) == 1
+    assert chunks[0]['text'].endswith("- 3 -")
+
+def test_page_with_only_a_number_dropped():
+    chunks = chunk_pages([ARTICLE, "4"])
+    assert all(chunk['page'] == 1 for chunk in chunks)
+    assert all(len(chunk['text']) >= 40 for chunk in chunks)
@@ -0,0 +1,72 @@
+from pypdf import PageObject
+from pypdf.generic import ArrayObject, DictionaryObject, FloatObject, NameObject, StreamObject
+
+from pdf_indexer import scan_page_drawing
+
+# Tableau 2 x 2 tracé filet par filet: 3 horizontaux, 3 verticaux
+RULED_TABLE = b"""
+0.5 w
+50 700 m 250 700 l S  50 680 m 250 680 l S  50 660 m 250 660 l S
+50 660 m 50 700 l S  150 660 m 150 700 l S  250 660 m 250 700 l S
+"""
+
+def stream(data, **entries):
+    obj = StreamObject()
+    obj.set_data(data)
+    for key, value in entries.items():
+        obj[NameObject(f"/{key}")] = value
+    return obj
+
+def page(content, xobjects=None):
+    result = PageObject.create_blank_page(width=300, height=800)
+    result[NameObject("/Contents")] = stream(content)
+    if xobjects:
+        result[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/XObject"): DictionaryObject({NameObject(f"/{key}"): value for key, value in xobjects.items()}),
+        })
+    return result
+
+def form(content):
+    bbox = ArrayObject(FloatObject(x) for x in (0, 0, 300, 800))
+    return stream(content, Type=NameObject("/XObject"), Subtype=NameObject("/Form"), BBox=bbox)
+
+def test_ruled_table_is_candidate():
+    assert scan_page_drawing(page(RULED_TABLE)) == (True, 0)
+
+def test_text_only_page_is_not_candidate():
+    assert scan_page_drawing(page(b"BT /F1 12 Tf 50 700 Td (Article 1) Tj ET")) == (False, 0)
+
+def test_rectangles_are_cells():
+    assert scan_page_drawing(page(b"50 660 100 20 re 150 660 100 20 re S"))[0]
+
+def test_clipping_path_is_not_painted():
+    # Rectangle de découpage (re W n) puis texte: aucun filet tracé
+    content = b"q 0 0 300 800 re W n BT (Titre) Tj ET Q 10 10 m 290 10 l S"
+    assert scan_page_drawing(page(content)) == (False, 0)
+
+# Grille de segments de 1 point, agrandie 10 fois par cm: filets de 10 points
+SCALED_GRID = b"0 0 m 1 0 l S 0 1 m 1 1 l S 0 0 m 0 1 l S 1 0 m 1 1 l S"
+
+def test_nested_parentheses_in_strings():
+    # Lu comme un opérateur, le "Q" de la chaîne annulerait l'agrandissement de la grille
+    content = b"q 10 0 0 10 0 0 cm BT (voir (art. 5) Q et n) Tj ET " + SCALED_GRID + b" Q"
+    assert scan_page_drawing(page(content)) == (True, 0)
+
+def test_escaped_parenthesis_in_string():
+    content = rb"q 10 0 0 10 0 0 cm BT (art. 5\) Q et n) Tj ET " + SCALED_GRID + b" Q"
+    assert scan_page_drawing(page(content)) == (True, 0)
+
+def test_unit_grid_is_not_candidate():
+    assert scan_page_drawing(page(SCALED_GRID)) == (False, 0)
+
+def test_table_in_form_xobject():
+    assert scan_page_drawing(page(b"q /Fm1 Do Q", {"Fm1": form(RULED_TABLE)})) == (True, 0)
+
+def test_form_matrix_scales_segments():
+    scaled = form(SCALED_GRID)
+    scaled[NameObject("/Matrix")] = ArrayObject(FloatObject(x) for x in (10, 0, 0, 10, 0, 0))
+    assert scan_page_drawing(page(b"/Fm1 Do", {"Fm1": scaled})) == (True, 0)
+
+def test_image_xobject_counted():
+    image = stream(b"\x00", Type=NameObject("/XObject"), Subtype=NameObject("/Image"))
+    assert scan_page_drawing(page(b"q 100 0 0 100 0 0 cm /Im1 Do Q", {"Im1": image})) == (False, 1)
@@ -0,0 +1,33 @@
+import pytest
+
+from semantic_cache import SemanticResponseCache
+from shared_store import MemoryStore
+from text_analysis import LegalTextAnalyzer, POLARITY_TERMS
+
+PASSAGES = ["codes:12", "codes:13"]
+
+def make_cache(shared):
+    return SemanticResponseCache(LegalTextAnalyzer(remove_stopwords=False), threshold=0.8,
+                                 store=MemoryStore() if shared else None, guard_terms=POLARITY_TERMS)
+
+@pytest.mark.parametrize("shared", [False, True])
+@pytest.mark.parametrize("first, second", [
+    ("Un salarié peut-il être licencié sans préavis pour faute grave ?",
+     "Un salarié peut-il être licencié avec préavis pour faute grave ?"),
+    ("Le salarié ne peut pas être licencié pendant son congé de maladie",
+     "Le salarié peut être licencié pendant son congé de maladie"),
+    ("ما هي حقوق العامل بعد الإجازة السنوية", "ما هي حقوق العامل قبل الإجازة السنوية"),
+    ("هل يمكن طرد العامل دون إعلام مسبق", "هل يمكن طرد العامل مع إعلام مسبق"),
+])
+def test_opposite_questions_do_not_share_answer(shared, first, second):
+    cache = make_cache(shared)
+    cache.set(first, PASSAGES, 1, "fr", "réponse 1")
+    assert cache.get(second, PASSAGES, 1, "fr") is None
+    assert cache.get(first, PASSAGES, 1, "fr") == "réponse 1"
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_rephrased_question_hits(shared):
+    cache = make_cache(shared)
+    cache.set("Quelle est la durée du préavis de licenciement pour un salarié ?", PASSAGES, 1, "fr", "réponse")
+    assert cache.get("quelle est la duree du preavis de licenciement pour un salarie", PASSAGES, 1, "fr") == "réponse"
+    assert cache.get("Quelle est la durée du préavis de licenciement pour un salarié ?", ["codes:14"], 1, "fr") is None
@@ -0,0 +1,12 @@
+from text_analysis import ARABIC_STOPWORDS, LegalTextAnalyzer, normalize_arabic
+
+def test_arabic_stopwords_removed_after_normalization():
+    analyzer = LegalTextAnalyzer()
+    assert analyzer.analyze("إلى على متى حتى") == []
+    assert analyzer.analyze("يحال العامل إلى مجلس التأديب") == ["يحال", "عامل", "مجلس", "تاديب"]
+
+def test_stopword_list_is_normalized():
+    assert all(normalize_arabic(word) == word for word in ARABIC_STOPWORDS)
+
+def test_stopwords_kept_on_request():
+    assert LegalTextAnalyzer(remove_stopwords=False).analyze("على حتى") == ["علي", "حتي"]
@@ -0,0 +1,112 @@
+"""
+Normalisation et découpage en termes des textes juridiques français et arabes pour l'index.
+
+Un analyseur est un objet appelable `analyzer(texte) -> [termes]` muni d'un attribut `version` :
+la version fait partie des clés de cache (termes par passage, shards sur disque), de sorte que
+changer d'analyseur invalide automatiquement ce qui a été calculé avec l'ancien.
+"""
+import re
+import unicodedata
+
+# Diacritiques arabes (tashkil), alef suscrit et tatweel
+_ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_ARABIC_LETTERS = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي",
+    "ؤ": "و",
+    "ة": "ه",
+})
+_EASTERN_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789")
+_ARABIC_CHAR = re.compile("[\u0600-\u06ff\u0750-\u077f\u08a0-\u08ff]")
+# Préfixes (article défini et conjonctions/prépositions collées) retirés par la racinisation légère
+_ARABIC_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+_TOKEN = re.compile(r"(?u)\b\w\w+\b")
+
+FRENCH_STOPWORDS = frozenset("""
+au aux avec ce ces cet cette dans de des du elle en et eux il ils je la le les leur leurs lui ma mais me
+meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une
+vos votre vous est sont ete etre avoir ont fait peut doit dont lorsque ainsi si sans sous entre apres avant
+tout tous toute toutes autre autres cas lequel laquelle lesquels lesquelles aupres cela celui celle ceux
+quel quelle quels quelles comment combien pourquoi quand
+""".split())
+
+_ARABIC_STOPWORDS = """
+في من على الى عن مع او ان انه انها ما لا لم لن هذا هذه ذلك تلك التي الذي الذين اللذين هو هي هم كل
+قد كان كانت يكون تكون بين عند بعد قبل حتى اذا ثم او اي غير حيث منه منها فيه فيها عليه عليها به بها له لها
+ماذا كيف متى لماذا هل كم ماهي ماهو
+"""
+
+def fold_french(text):
+    """Minuscules, ligatures et accents supprimés ("Délégué" -> "delegue")."""
+    text = text.lower().replace("œ", "oe").replace("æ", "ae").replace("’", "'")
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+def normalize_arabic(text):
+    """Formes de présentation ramenées aux lettres de base (PDF), diacritiques et tatweel retirés,
+    alef/ya/ta marbuta unifiés, chiffres orientaux convertis."""
+    text = unicodedata.normalize("NFKC", text)
+    text = _ARABIC_DIACRITICS.sub("", text)
+    return text.translate(_ARABIC_LETTERS).translate(_EASTERN_DIGITS)
+
+# Normalisés comme les termes comparés (ى -> ي, أ/إ -> ا...), sans quoi "على" ou "حتى" ne seraient jamais retirés
+ARABIC_STOPWORDS = frozenset(normalize_arabic(word) for word in _ARABIC_STOPWORDS.split())
+
+def stem_arabic(token):
+    """Racinisation légère: retire l'article défini et les proclitiques courants."""
+    for prefix in _ARABIC_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+def with_ngrams(tokens, ngram_range=(1, 2)):
+    """Ajoute les n-grammes (mots séparés par une espace) aux unigrammes, comme scikit-learn."""
+    min_n, max_n = ngram_range
+    if max_n == 1:
+        return list(tokens)
+    grams = list(tokens) if min_n == 1 else []
+    for n in range(max(min_n, 2), max_n + 1):
+        grams.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+    return grams
+
+class LegalTextAnalyzer:
+    """Analyseur bilingue français/arabe.
+
+    Chaque terme est traité selon son écriture: les termes arabes sont normalisés puis
+    racinisés légèrement, les termes latins sont repliés (accents, casse). Les mots vides des
+    deux langues sont retirés. Renvoie des unigrammes ; les bigrammes sont ajoutés par
+    with_ngrams au moment de la vectorisation.
+    """
+
+    version = "legal-fr-ar-3"
+
+    def __init__(self, remove_stopwords=True):
+        self.remove_stopwords = remove_stopwords
+        if not remove_stopwords:
+            self.version = f"{self.version}-sw"
+
+    def __call__(self, text):
+        return self.analyze(text)
+
+    def analyze(self, text):
+        tokens = []
+        for token in _TOKEN.findall(normalize_arabic(fold_french(text))):
+            if _ARABIC_CHAR.search(token):
+                if self.remove_stopwords and token in ARABIC_STOPWORDS:
+                    continue
+                token = stem_arabic(token)
+            elif self.remove_stopwords and token in FRENCH_STOPWORDS:
+                continue
+            if len(token) > 1:
+                tokens.append(token)
+        return tokens
+
+# Négations, prépositions et comparatifs qui inversent ou restreignent le sens d'une question
+# ("sans préavis" / "avec préavis", "ne peut pas" / "peut", "قبل" / "بعد"). Ce sont des mots vides
+# pour la recherche, mais deux questions qui en diffèrent n'appellent pas la même réponse.
+_POLARITY_WORDS = """
+ne pas non ni sans avec jamais aucun aucune rien nul nulle plus moins avant apres pendant depuis jusqu
+sauf hors excepte contre pour sous sur entre
+لا لم لن ليس ليست غير بدون دون عدم إلا سوى مع قبل بعد أثناء خلال منذ حتى إلى أكثر أقل فوق تحت
+"""
+POLARITY_TERMS = frozenset(LegalTextAnalyzer(remove_stopwords=False).analyze(_POLARITY_WORDS))
@@ -0,0 +1,96 @@
+"""
+Traçage par requête: identifiant de requête et durée de chaque étape (spans).
+
+Le middleware HTTP ouvre une trace par requête (identifiant repris de l'en-tête X-Request-ID
+s'il est valide, sinon généré) et la place dans une variable de contexte. Les étapes sont
+mesurées avec `with span("retrieval"):` n'importe où dans le code appelé, y compris dans
+l'indexeur ; hors requête, span() ne fait rien. Les threads de l'exécuteur de recherche
+reçoivent une copie du contexte (voir run_in_context), et RequestIdFilter ajoute l'identifiant
+à chaque ligne de log.
+"""
+import re
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("trace", default=None)
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+class Trace:
+    def __init__(self, request_id=None, name=""):
+        self.request_id = request_id if request_id and _VALID_REQUEST_ID.match(request_id) else uuid.uuid4().hex
+        self.name = name # Ex. "POST /chat/"
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = [] # [(nom, début relatif, durée)] en secondes, dans l'ordre de fin
+        self._lock = threading.Lock() # Spans ajoutés depuis la boucle d'événements et les threads de recherche
+
+    def add_span(self, name, start, duration):
+        with self._lock:
+            self.spans.append((name, start - self.start, duration))
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+        return self.duration
+
+    def totals(self):
+        """Durée cumulée par nom d'étape (une étape peut se répéter), dans l'ordre de première apparition."""
+        totals = {}
+        with self._lock:
+            for name, _, duration in self.spans:
+                totals[name] = totals.get(name, 0.0) + duration
+        return totals
+
+    def server_timing(self):
+        """Valeur de l'en-tête Server-Timing (durées en millisecondes)."""
+        entries = [f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)};dur={duration * 1000:.1f}" for name, duration in self.totals().items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start if self.duration is None else self.duration) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def summary(self):
+        stages = ", ".join(f"{name} {duration * 1000:.1f} ms" for name, duration in self.totals().items())
+        return f"{self.name} en {self.finish() * 1000:.1f} ms" + (f" ({stages})" if stages else "")
+
+def start_trace(request_id=None, name=""):
+    """Ouvre une trace dans le contexte courant. Renvoie (trace, jeton pour end_trace)."""
+    trace = Trace(request_id, name)
+    return trace, _current.set(trace)
+
+def end_trace(token):
+    _current.reset(token)
+
+def current_trace():
+    return _current.get()
+
+def current_request_id():
+    trace = _current.get()
+    return trace.request_id if trace is not None else None
+
+@contextmanager
+def span(name):
+    """Mesure la durée du bloc et l'ajoute à la trace de la requête en cours (sans effet hors requête)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter() - start)
+
+def run_in_context(func):
+    """Enveloppe func pour l'exécuter dans une copie du contexte courant (trace comprise), dans un autre thread."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+class RequestIdFilter(logging.Filter):
+    """Ajoute record.request_id ('-' hors requête) pour le format de log."""
+
+    def filter(self, record):
+        record.request_id = current_request_id() or "-"
+        return True